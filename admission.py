@@ -0,0 +1,238 @@
+import collections
+import contextlib
+import os
+import threading
+import uuid
+import zipfile
+
+from convert import (
+    FRAME_SIZE_FACTOR, ROWS_SIZE_FACTOR, get_parse_memory_bytes, get_parse_pool, get_parse_workers, is_csv_member
+)
+from env import env_int
+import formats
+import log
+
+
+# Share of the instance's memory limit that requests may reserve.
+DEFAULT_MEMORY_BUDGET_FRACTION = 0.8
+
+# Memory an inline request holds per byte of base64 attachment: the raw
+# request body and the parsed JSON string (the decoded zip is counted
+# separately).
+INLINE_BODY_FACTOR = 2
+# Working memory of the streaming conversion paths, whatever the tile size:
+# xlsxwriter's constant_memory rows, CSV and Parquet batches.
+STREAMING_BASE_BYTES = 16 * 1024 * 1024
+# pyarrow holds a whole tile as an Arrow table, offsets included.
+ARROW_SIZE_FACTOR = 2
+# pandas' ExcelWriter keeps every cell of the workbook in memory until it
+# is saved, several times the CSV text.
+PANDAS_WORKBOOK_FACTOR = 6
+
+# What the zip's central directory says about an attachment, without
+# decompressing it: the zip size, the total and largest uncompressed CSV
+# member, and the number of tiles.
+AttachmentSize = collections.namedtuple('AttachmentSize', ['zip_bytes', 'csv_bytes', 'largest_tile', 'tiles'])
+
+_lock = threading.Lock()
+_budget = None
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    """Raised when a request does not fit the memory other requests have left."""
+
+
+class PayloadTooLarge(MemoryBudgetExceeded):
+    """Raised when a request would not fit the memory budget even on an idle instance."""
+
+
+def detect_memory_limit():
+    """Return the memory limit of this container (cgroup), else of the machine, or None."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as limit_file:
+                value = limit_file.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60: # 'max' or a huge number means no limit
+            return int(value)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_memory_budget():
+    """Bytes of memory requests may reserve on this instance (MEMORY_BUDGET_BYTES, 0 = unlimited).
+
+    Defaults to 80% of the detected memory limit, e.g. about 820 MB on a
+    1 GiB function.
+    """
+    budget = env_int("MEMORY_BUDGET_BYTES", None, minimum=0)
+    if budget is not None:
+        return budget
+    limit = detect_memory_limit()
+    return int(limit * DEFAULT_MEMORY_BUDGET_FRACTION) if limit else 0
+
+
+def current_rss_bytes():
+    """Resident set size of this process now, or None where unavailable."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def measure_attachment(attachment_stream):
+    """Size up a csv_zip attachment from its central directory and rewind it.
+
+    Returns None if it is not a readable zip; conversion then reports that.
+    """
+    attachment_stream.seek(0)
+    try:
+        with zipfile.ZipFile(attachment_stream, 'r') as zip_ref:
+            tiles = [info.file_size for info in zip_ref.infolist() if is_csv_member(info.filename)]
+        return AttachmentSize(attachment_stream.seek(0, os.SEEK_END), sum(tiles), max(tiles, default=0), len(tiles))
+    except zipfile.BadZipFile:
+        return None
+    finally:
+        attachment_stream.seek(0)
+
+
+def request_cost(content_length):
+    """Memory an inline execute request of content_length bytes holds before conversion."""
+    content_length = content_length or 0
+    return content_length * INLINE_BODY_FACTOR + content_length * 3 // 4
+
+
+def attachment_cost(request_json, size):
+    """Memory the request and its decoded attachment hold while it is converted."""
+    try:
+        inline_bytes = len(request_json["attachment"]["data"] or "")
+    except (KeyError, TypeError):
+        inline_bytes = 0 # Downloaded; the spool spills to disk past DOWNLOAD_SPOOL_BYTES
+    return inline_bytes * INLINE_BODY_FACTOR + (size.zip_bytes if size else 0)
+
+
+def conversion_cost(size, engine, output_format=formats.XLSX, spool_bytes=0):
+    """Estimate the memory a conversion needs, beyond the attachment itself.
+
+    Args:
+        size: The attachment's AttachmentSize, or None if unknown.
+        engine: The conversion engine for xlsx output.
+        spool_bytes: How much of the workbook the delivery keeps in memory
+            (the spool threshold in spool delivery mode).
+    """
+    if size is None or output_format == formats.CSV_ZIP:
+        return 0
+    if output_format != formats.XLSX:
+        return STREAMING_BASE_BYTES
+    output_bytes = min(size.csv_bytes, spool_bytes)
+    if engine == "pandas":
+        parsed = min(size.csv_bytes * FRAME_SIZE_FACTOR, size.largest_tile * FRAME_SIZE_FACTOR + get_parse_memory_bytes())
+        return parsed + size.csv_bytes * PANDAS_WORKBOOK_FACTOR + output_bytes
+    if engine == "pyarrow":
+        return size.largest_tile * ARROW_SIZE_FACTOR + STREAMING_BASE_BYTES + output_bytes
+    parsed = 0
+    if get_parse_pool("streaming") == "process" and get_parse_workers() > 1:
+        parsed = min(size.csv_bytes * ROWS_SIZE_FACTOR, get_parse_memory_bytes())
+    return STREAMING_BASE_BYTES + parsed + output_bytes
+
+
+class MemoryBudget:
+    """Admits requests while their estimated memory fits the instance's budget.
+
+    Each admitted request reserves its estimated cost until it finishes, so
+    concurrent requests (or async jobs) share one budget. The process's
+    resident size when the budget is created, i.e. the interpreter and its
+    imports, counts against it too.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit if limit is not None else get_memory_budget()
+        self.baseline = current_rss_bytes() or 0
+        self._reserved = {} # token -> bytes
+        self._lock = threading.Lock()
+
+    def check(self, cost):
+        """Raise PayloadTooLarge if cost could not fit even with nothing else running."""
+        if self.limit and self.baseline + cost > self.limit:
+            raise PayloadTooLarge(
+                f"The request needs about {cost // 1048576} MB of memory, more than the "
+                f"{max(0, self.limit - self.baseline) // 1048576} MB this instance can give one request."
+            )
+
+    def _take(self, options, replaces=None):
+        """Reserve the first of options that fits; return (token, label, cost). See admit."""
+        token = uuid.uuid4().hex
+        with self._lock:
+            replaced = self._reserved.pop(replaces, None)
+            in_use = self.baseline + sum(self._reserved.values())
+            for label, cost in options:
+                if not self.limit or in_use + cost <= self.limit:
+                    self._reserved[token] = cost
+                    return token, label, cost
+            if replaced is not None:
+                self._reserved[replaces] = replaced
+            cheapest = min(cost for _, cost in options)
+            self.check(cheapest)
+            raise MemoryBudgetExceeded(
+                f"The request needs about {cheapest // 1048576} MB of memory and "
+                f"{len(self._reserved)} running request(s) leave {max(0, self.limit - in_use) // 1048576} MB."
+            )
+
+    @contextlib.contextmanager
+    def admit(self, options, replaces=None):
+        """Reserve the first of options that fits, for the duration of the block.
+
+        options is a list of (label, cost in bytes), best first, e.g. the
+        configured engine then the streaming one. Yields the chosen label.
+        replaces is a token from reserve whose bytes this reservation takes
+        over, e.g. a queued job's request body, so they are not counted twice;
+        it is only released if admission succeeds.
+
+        Raises:
+            PayloadTooLarge: even the cheapest option exceeds the whole budget.
+            MemoryBudgetExceeded: it would fit, but not next to the requests already running.
+        """
+        token, label, cost = self._take(options, replaces)
+        if label != options[0][0]:
+            log.warning(f"The {options[0][0]} option needs about {options[0][1] // 1048576} MB, more than is free; using {label}.")
+        log.info(f"Admitted request with the {label} option, reserving {cost // 1048576} MB.", option=label, cost_bytes=cost, **self.stats())
+        try:
+            yield label
+        finally:
+            self.release(token)
+
+    def reserve(self, cost):
+        """Reserve cost bytes until release(token) is called, e.g. for a queued job.
+
+        Returns the token, a string, so it can travel in a job payload.
+        Raises as admit does.
+        """
+        token, _, _ = self._take([("reserve", cost)])
+        log.info(f"Reserved {cost // 1048576} MB.", cost_bytes=cost, **self.stats())
+        return token
+
+    def release(self, token):
+        """Give back what reserve (or admit) took; unknown tokens are ignored."""
+        with self._lock:
+            self._reserved.pop(token, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget_bytes": self.limit, "baseline_bytes": self.baseline,
+                "reserved_bytes": sum(self._reserved.values()), "admitted": len(self._reserved),
+                "rss_bytes": current_rss_bytes(),
+            }
+
+
+def get_budget():
+    """Return this process's MemoryBudget, creating it on first use."""
+    global _budget
+    with _lock:
+        if _budget is None:
+            _budget = MemoryBudget()
+        return _budget
@@ -0,0 +1,122 @@
+import base64
+import io
+import tempfile
+
+import requests
+
+from env import env_int
+import log
+from workspace import WorkspaceQuotaExceeded
+
+
+DEFAULT_DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+DEFAULT_DOWNLOAD_SPOOL_BYTES = 32 * 1024 * 1024
+DEFAULT_DOWNLOAD_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_DOWNLOAD_TIMEOUT_SECONDS = 60
+
+
+def get_download_url(request_json):
+    """Return the scheduled plan download_url Looker sends in 'url' download mode, if any."""
+    try:
+        scheduled_plan = request_json.get("scheduled_plan") or {}
+        return scheduled_plan.get("download_url")
+    except AttributeError: # request_json or scheduled_plan is not a dictionary
+        return None
+
+
+def download_to_spool(url, max_bytes=None, spool_bytes=None, chunk_bytes=None, timeout=None, spool_dir=None, quota_bytes=None):
+    """Stream a download into a size-capped spool file.
+
+    The body is read in chunks and kept in memory until it exceeds
+    spool_bytes, after which it rolls over to a temporary file on disk.
+    The download is abandoned as soon as it passes max_bytes, or once it has
+    spilled to disk and passes quota_bytes.
+
+    Args:
+        url: The URL to fetch, e.g. Looker's scheduled_plan.download_url.
+        max_bytes: Hard cap on the payload size (DOWNLOAD_MAX_BYTES).
+        spool_bytes: In-memory threshold before spilling to disk (DOWNLOAD_SPOOL_BYTES).
+        chunk_bytes: Read size per chunk (DOWNLOAD_CHUNK_BYTES).
+        timeout: Connect/read timeout in seconds (DOWNLOAD_TIMEOUT_SECONDS).
+        spool_dir: Directory the spool spills into, e.g. the request workspace.
+        quota_bytes: Disk space left in the workspace quota (see
+            Workspace.remaining_bytes); None for no limit.
+
+    Returns:
+        A binary file object positioned at the start of the payload.
+    """
+    max_bytes = max_bytes or env_int("DOWNLOAD_MAX_BYTES", DEFAULT_DOWNLOAD_MAX_BYTES)
+    spool_bytes = spool_bytes or env_int("DOWNLOAD_SPOOL_BYTES", DEFAULT_DOWNLOAD_SPOOL_BYTES)
+    chunk_bytes = chunk_bytes or env_int("DOWNLOAD_CHUNK_BYTES", DEFAULT_DOWNLOAD_CHUNK_BYTES)
+    timeout = timeout or env_int("DOWNLOAD_TIMEOUT_SECONDS", DEFAULT_DOWNLOAD_TIMEOUT_SECONDS)
+
+    # Below spool_bytes the payload stays in memory and takes no disk quota.
+    disk_limit = None if quota_bytes is None else max(quota_bytes, spool_bytes)
+
+    def check_disk(size):
+        if disk_limit is not None and size > disk_limit:
+            raise WorkspaceQuotaExceeded(
+                f"Download of {size} bytes does not fit the {quota_bytes} bytes left in the temp workspace quota."
+            )
+
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_bytes, mode='w+b', dir=spool_dir)
+    received = 0
+    try:
+        with log.span("download_attachment") as download_span, requests.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            declared = response.headers.get("Content-Length")
+            if declared and declared.isdigit() and int(declared) > max_bytes:
+                raise ValueError(f"Download is {declared} bytes, which exceeds the {max_bytes} byte limit.")
+            if declared and declared.isdigit():
+                check_disk(int(declared))
+            for chunk in response.iter_content(chunk_size=chunk_bytes):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise ValueError(f"Download exceeded the {max_bytes} byte limit.")
+                check_disk(received)
+                spool.write(chunk)
+            download_span.add_bytes(received)
+    except requests.RequestException as e:
+        spool.close()
+        log.error(f"Error downloading attachment from Looker: {e}")
+        raise RuntimeError(f"Failed to download attachment: {e}") from e
+    except Exception:
+        spool.close()
+        raise
+
+    log.debug(f"Downloaded {received} bytes from download_url.")
+    spool.seek(0)
+    return spool
+
+
+def open_attachment(request_json, spool_dir=None, quota_bytes=None):
+    """Return a binary stream over the csv_zip attachment of an execute request.
+
+    Looker's 'url' download mode is preferred: the zip is fetched from
+    scheduled_plan.download_url in chunks, spilling to spool_dir within
+    quota_bytes (see download_to_spool). Requests that carry the payload
+    inline in attachment.data are base64 decoded in memory instead.
+    """
+    download_url = get_download_url(request_json)
+    if download_url:
+        log.debug("Fetching attachment from scheduled_plan.download_url.")
+        return download_to_spool(download_url, spool_dir=spool_dir, quota_bytes=quota_bytes)
+
+    try:
+        attachment_data = request_json["attachment"]['data']
+    except KeyError as e:
+        log.error(f"Missing 'attachment' or 'data' in request_json: {e}")
+        raise ValueError(f"Request JSON missing expected attachment data structure: {e}") from e
+    except TypeError as e: # Handle cases where request_json or "attachment" is not a dictionary
+        log.error(f"Invalid request_json structure for attachment: {e}")
+        raise ValueError(f"Request JSON has invalid structure for attachment: {e}") from e
+
+    try:
+        with log.span("decode_attachment") as decode_span:
+            decoded_zip_data = base64.b64decode(attachment_data)
+            decode_span.add_bytes(len(decoded_zip_data))
+    except base64.binascii.Error as e: # base64.Error is an alias for binascii.Error
+        log.error(f"Error decoding base64 attachment data: {e}")
+        raise ValueError(f"Invalid base64 attachment data: {e}") from e
+
+    return io.BytesIO(decoded_zip_data)
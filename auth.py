@@ -2,15 +2,16 @@ import os
 import hmac
 from flask import Response
 import json
+import log
 
 
-def authenticate(request):
-    if request.method != 'POST':
-        r =  '|ERROR| Request must be POST'; print (r)
+def authenticate(request, methods=('POST',)):
+    if request.method not in methods:
+        r =  '|ERROR| Request must be {}'.format(' or '.join(methods)); log.warning(r)
         return Response(r, status=401, mimetype='application/json')
 
     elif 'authorization' not in request.headers:
-        r = '|ERROR| Request does not have auth token'; print (r)
+        r = '|ERROR| Request does not have auth token'; log.warning(r)
         return Response(r, status=400, mimetype='application/json')
 
     else:
@@ -20,7 +21,7 @@ def authenticate(request):
             return Response(status=200, mimetype='application/json')
 
         else:
-            r = '|ERROR| Incorrect token'; print (r)
+            r = '|ERROR| Incorrect token'; log.warning(r)
             return Response(r, status=403, mimetype='application/json')
 
 
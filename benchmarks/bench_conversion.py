@@ -0,0 +1,97 @@
+"""Compare the streaming, pandas and pyarrow CSV -> Excel conversion engines.
+
+Each engine runs in its own subprocess so peak RSS reflects only that
+engine. Usage:
+
+    python benchmarks/bench_conversion.py --rows 200000 --tiles 3
+    python benchmarks/bench_conversion.py --tiles 24 --rows 20000 --workers 1,4
+    python benchmarks/bench_conversion.py --engines streaming,pyarrow --types infer,schema,raw
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_tile(path, rows, columns):
+    rng = random.Random(rows * 31 + columns)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([f"Column {c}" for c in range(columns)])
+        for r in range(rows):
+            writer.writerow([
+                r if c == 0 else (f"label-{rng.randint(0, 999)}" if c % 3 == 1 else round(rng.random() * 1000, 2))
+                for c in range(columns)
+            ])
+
+
+def run_engine(engine, csv_paths, out_dir):
+    """Run one conversion in this process and print a JSON result line."""
+    sys.path.insert(0, REPO_ROOT)
+    import contextlib
+    import io
+    from convert import csv_files_to_excel
+
+    excel_file_path = os.path.join(out_dir, f"{engine}.xlsx")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        csv_files_to_excel(csv_paths, excel_file_path, engine=engine)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "engine": engine,
+        "workers": os.environ.get("CONVERSION_WORKERS"),
+        "pool": os.environ.get("CONVERSION_POOL") or "default",
+        "types": os.environ.get("CONVERSION_TYPES", "infer"),
+        "seconds": round(elapsed, 3),
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+        "xlsx_mb": round(os.path.getsize(excel_file_path) / 1e6, 2),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=12)
+    parser.add_argument("--tiles", type=int, default=2)
+    parser.add_argument("--engines", default="streaming,pandas")
+    parser.add_argument("--workers", default="1", help="comma separated CONVERSION_WORKERS values")
+    parser.add_argument("--pool", default="", choices=("", "thread", "process"), help="CONVERSION_POOL; default: per engine")
+    parser.add_argument("--types", default="infer", help="comma separated CONVERSION_TYPES values")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        csv_paths = sorted(os.path.join(args.workdir, f) for f in os.listdir(args.workdir) if f.endswith(".csv"))
+        run_engine(args.run, csv_paths, args.workdir)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for t in range(args.tiles):
+            write_tile(os.path.join(workdir, f"tile_{t}.csv"), args.rows, args.columns)
+        csv_mb = sum(os.path.getsize(os.path.join(workdir, f)) for f in os.listdir(workdir)) / 1e6
+        print(f"{args.tiles} tile(s) x {args.rows} rows x {args.columns} columns = {csv_mb:.1f} MB of CSV")
+        for engine in args.engines.split(","):
+            for workers in args.workers.split(","):
+                for types in args.types.split(","):
+                    env = dict(os.environ, CONVERSION_WORKERS=workers, CONVERSION_POOL=args.pool, CONVERSION_TYPES=types)
+                    out = subprocess.run(
+                        [sys.executable, __file__, "--run", engine, "--workdir", workdir],
+                        check=True, capture_output=True, text=True, env=env
+                    ).stdout.strip().splitlines()[-1]
+                    result = json.loads(out)
+                    result["csv_mb_per_s"] = round(csv_mb / result["seconds"], 2)
+                    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
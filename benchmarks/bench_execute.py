@@ -0,0 +1,346 @@
+"""End-to-end action_execute benchmark against synthetic Looker payloads.
+
+Each case builds a csv_zip payload (tile count, rows, columns and folder
+layout are configurable), sends it to action_execute through a Flask test
+request and uploads to the in-process SFTP server in sftp_server.py. Every
+case runs in its own subprocess, so peak RSS covers only that case.
+
+Reports per-stage latency (attachment, digest, convert, upload, total),
+peak RSS, peak bytes in the request workspaces (/tmp), bytes uploaded and
+CSV throughput. Save a run and compare a later commit against it:
+
+    python benchmarks/bench_execute.py --tiles 1,8 --rows 20000 --output before.json
+    python benchmarks/bench_execute.py --tiles 1,8 --rows 20000 --compare before.json
+
+In remote delivery mode conversion runs inside the upload, so those two
+stages overlap.
+"""
+import argparse
+import base64
+import contextlib
+import csv
+import functools
+import http.server
+import importlib.metadata
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+
+LAYOUTS = ("flat", "nested", "deep")
+STAGES = ("attachment", "digest", "convert", "upload", "total")
+# Case parameters, in the order they identify a case.
+CASE_KEYS = ("tiles", "rows", "columns", "layout", "engine", "delivery_mode", "format", "attachment")
+
+
+def tile_path(layout, tile):
+    """Archive path of a tile: flat like Looker's dashboards, or in nested folders."""
+    if layout == "nested":
+        return f"dashboard/section_{tile % 3}/tile_{tile}.csv"
+    if layout == "deep":
+        return f"dashboard/{tile % 2}/{tile % 3}/{tile % 5}/Tile {tile}.csv"
+    return f"tile_{tile}.csv"
+
+
+def make_payload(tiles, rows, columns, layout="flat", seed=0):
+    """Build a csv_zip attachment the way Looker sends it.
+
+    Columns cycle through ids, dates, labels, zero-padded codes and
+    decimals, so type inference does realistic work.
+    """
+    rng = random.Random(seed)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as payload:
+        for tile in range(tiles):
+            with payload.open(tile_path(layout, tile), "w") as member, \
+                    io.TextIOWrapper(member, encoding="utf-8", newline="") as text:
+                writer = csv.writer(text)
+                writer.writerow([f"Field {c}" for c in range(columns)])
+                for r in range(rows):
+                    writer.writerow([
+                        r if c == 0 else
+                        f"2024-{r % 12 + 1:02d}-{r % 28 + 1:02d}" if c % 4 == 1 else
+                        f"label-{rng.randint(0, 999)}" if c % 4 == 2 else
+                        f"{rng.randint(0, 9999):05d}" if c % 4 == 3 else
+                        round(rng.random() * 1000, 2)
+                        for c in range(columns)
+                    ])
+    return buffer.getvalue()
+
+
+def serve_payload(payload):
+    """Serve payload over HTTP on localhost, as Looker's download_url does. Returns (server, url)."""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/payload.zip"
+
+
+class StageTimer:
+    """Accumulates wall time spent in wrapped functions, per stage."""
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+
+    def wrap(self, owner, name, stage):
+        original = getattr(owner, name)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+
+        setattr(owner, name, timed)
+
+    def reset(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+
+
+class PeakSampler:
+    """Samples the size of a directory in a background thread and keeps the peak."""
+
+    def __init__(self, path, interval=0.005):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        from workspace import directory_size
+
+        while not self._stop.is_set():
+            self.peak = max(self.peak, directory_size(self.path))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_case(case, repeat, latency_ms):
+    """Run one case in this process and print a JSON result line."""
+    workdir = tempfile.mkdtemp(prefix="bench-execute-")
+    remote_root = os.path.join(workdir, "remote")
+    workspace_root = os.path.join(workdir, "workspaces")
+    os.mkdir(remote_root)
+
+    sys.path.insert(0, REPO_ROOT)
+    sys.path.insert(0, BENCH_DIR)
+    from sftp_server import LocalSFTPServer, generate_ed25519_key
+
+    os.environ.update({
+        "sftp_pem": generate_ed25519_key(os.path.join(workdir, "id_ed25519")),
+        "LOOKER_ACTION_HUB_SECRET": "bench",
+        "WORKSPACE_ROOT": workspace_root,
+        "CONVERSION_ENGINE": case["engine"],
+        "DELIVERY_MODE": case["delivery_mode"],
+        "EXECUTE_MODE": "sync",
+    })
+
+    payload = make_payload(case["tiles"], case["rows"], case["columns"], case["layout"])
+    with zipfile.ZipFile(io.BytesIO(payload)) as archive:
+        csv_bytes = sum(info.file_size for info in archive.infolist())
+
+    import_start = time.perf_counter()
+    from flask import Flask, request
+    import execute
+    import formats
+    import idempotency
+    import_seconds = time.perf_counter() - import_start
+
+    timer = StageTimer()
+    timer.wrap(execute, "open_attachment", "attachment")
+    timer.wrap(idempotency, "stream_digest", "digest")
+    timer.wrap(execute, "csv_files_to_excel", "convert")
+    timer.wrap(formats, "convert_to_format", "convert")
+    timer.wrap(execute, "upload_to_destinations", "upload")
+    timer.wrap(execute, "stream_file_sftp", "upload")
+
+    app = Flask(__name__)
+    http_server, download_url = serve_payload(payload) if case["attachment"] == "url" else (None, None)
+    runs = []
+    try:
+        with LocalSFTPServer(remote_root, latency=latency_ms / 1000) as server:
+            for run in range(repeat):
+                # A new plan id per run, so idempotency never skips the work.
+                scheduled_plan = {"scheduled_plan_id": f"bench-{run}"}
+                body = {
+                    "form_params": {
+                        "host": "127.0.0.1", "port": str(server.port), "username": "bench",
+                        "filename": "/dashboard.xlsx", "format": case["format"],
+                    },
+                    "scheduled_plan": scheduled_plan,
+                }
+                if download_url:
+                    scheduled_plan["download_url"] = download_url
+                else:
+                    body["attachment"] = {"data": base64.b64encode(payload).decode()}
+
+                timer.reset()
+                with PeakSampler(workspace_root) as tmp_sampler, contextlib.redirect_stdout(io.StringIO()):
+                    with app.test_request_context("/", method="POST", json=body, headers={"authorization": 'Token token="bench"'}):
+                        start = time.perf_counter()
+                        response = execute.action_execute(request)
+                        timer.seconds["total"] = time.perf_counter() - start
+                if response.status_code != 200:
+                    raise RuntimeError(f"action_execute returned {response.status_code}: {response.get_data(as_text=True)}")
+                destinations = response.get_json()["destinations"]
+                runs.append(dict(
+                    timer.seconds,
+                    tmp_bytes=tmp_sampler.peak,
+                    wire_bytes=sum(destination.get("size") or 0 for destination in destinations),
+                ))
+    finally:
+        if http_server:
+            http_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    # The first run pays for lazy imports and pooled connections; report it separately.
+    warm = runs[1:] or runs
+    seconds = {stage: round(statistics.median(run[stage] for run in warm), 4) for stage in STAGES}
+    print(json.dumps(dict(
+        case,
+        seconds=seconds,
+        cold_total_seconds=round(runs[0]["total"] + import_seconds, 4),
+        runs=len(runs),
+        peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        peak_tmp_mb=round(max(run["tmp_bytes"] for run in runs) / 1e6, 2),
+        csv_mb=round(csv_bytes / 1e6, 2),
+        payload_mb=round(len(payload) / 1e6, 2),
+        wire_mb=round(statistics.median(run["wire_bytes"] for run in warm) / 1e6, 2),
+        csv_mb_per_s=round(csv_bytes / 1e6 / seconds["total"], 2),
+    )))
+
+
+def environment():
+    """Describe what was measured, so runs from different commits can be told apart."""
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    versions = {}
+    for package in ("flask", "pandas", "paramiko", "xlsxwriter", "pyarrow"):
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "versions": versions,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def case_id(case):
+    return " ".join(f"{key}={case[key]}" for key in CASE_KEYS)
+
+
+def compare(results, baseline_path):
+    """Print the change in each stage against a saved run, for the cases both have."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {case_id(case): case for case in baseline["cases"]}
+    print(f"Compared with {baseline['environment'].get('commit')} ({baseline_path}):")
+    for case in results["cases"]:
+        old = before.get(case_id(case))
+        if old is None:
+            print(f"  {case_id(case)}: not in baseline")
+            continue
+        changes = []
+        for stage in STAGES:
+            if old["seconds"][stage] > 0:
+                change = (case["seconds"][stage] - old["seconds"][stage]) / old["seconds"][stage] * 100
+                changes.append(f"{stage} {old['seconds'][stage]:.3f}s -> {case['seconds'][stage]:.3f}s ({change:+.0f}%)")
+        changes.append(f"peak_rss {old['peak_rss_mb']} -> {case['peak_rss_mb']} MB")
+        print(f"  {case_id(case)}:\n    " + "\n    ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tiles", default="1,8", help="comma separated tile counts")
+    parser.add_argument("--rows", default="20000", help="comma separated rows per tile")
+    parser.add_argument("--columns", default="12", help="comma separated columns per tile")
+    parser.add_argument("--layouts", default="flat", help=f"comma separated archive layouts: {', '.join(LAYOUTS)}")
+    parser.add_argument("--engines", default="streaming", help="comma separated CONVERSION_ENGINE values")
+    parser.add_argument("--delivery-modes", default="spool", help="comma separated DELIVERY_MODE values")
+    parser.add_argument("--formats", default="xlsx", help="comma separated output formats")
+    parser.add_argument("--attachment", default="inline", choices=("inline", "url"),
+                        help="send the payload inline or serve it from a download_url")
+    parser.add_argument("--latency-ms", type=float, default=0, help="round-trip latency added to the SFTP server")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the median of the warm runs is reported")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="a JSON file from an earlier --output to compare against")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(json.loads(args.run_case), args.repeat, args.latency_ms)
+        return
+
+    results = {"environment": environment(), "latency_ms": args.latency_ms, "cases": []}
+    matrix = itertools.product(
+        map(int, args.tiles.split(",")), map(int, args.rows.split(",")), map(int, args.columns.split(",")),
+        args.layouts.split(","), args.engines.split(","), args.delivery_modes.split(","), args.formats.split(","),
+        [args.attachment],
+    )
+    for values in matrix:
+        case = dict(zip(CASE_KEYS, values))
+        completed = subprocess.run(
+            [sys.executable, __file__, "--run-case", json.dumps(case), "--repeat", str(args.repeat),
+             "--latency-ms", str(args.latency_ms)],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            print(f"{case_id(case)}: failed\n{completed.stderr.strip()}", file=sys.stderr)
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results["cases"].append(result)
+        print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {len(results['cases'])} case(s) to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
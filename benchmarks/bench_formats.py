@@ -0,0 +1,121 @@
+"""Compare the output formats: conversion time, bytes on the wire and upload time.
+
+Builds a csv_zip payload like Looker's, converts it to each format in its
+own subprocess (so peak RSS reflects only that format) and uploads the
+result to the in-process SFTP server in sftp_server.py. Usage:
+
+    python benchmarks/bench_formats.py --rows 200000 --tiles 3
+    python benchmarks/bench_formats.py --formats csv_zip,csv_gz --latency-ms 50
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_conversion import write_tile  # noqa: E402
+
+
+def run_format(output_format, workdir, latency_ms):
+    """Convert and upload the payload in this process and print a JSON result line."""
+    import formats
+    from convert import csv_files_to_excel, csv_sources_from_zip
+    from credentials import load_private_key
+    from schema import ColumnTyping
+    from sftp import upload_file_sftp
+    from sftp_server import LocalSFTPServer
+
+    out_dir = os.path.join(workdir, output_format)
+    os.mkdir(out_dir)
+    with open(os.path.join(workdir, "payload.zip"), "rb") as attachment_stream:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if output_format == formats.XLSX:
+                with zipfile.ZipFile(attachment_stream) as zip_ref:
+                    excel_file_path = os.path.join(out_dir, "tabbed.xlsx")
+                    csv_files_to_excel(csv_sources_from_zip(zip_ref), excel_file_path, tmpdir=out_dir)
+                outputs = [formats.OutputFile(excel_file_path, None)]
+            else:
+                outputs = formats.convert_to_format(output_format, attachment_stream, out_dir, ColumnTyping())
+        convert_seconds = time.perf_counter() - start
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        wire_bytes = 0
+        for output in outputs:
+            if hasattr(output.source, "read"):
+                wire_bytes += output.source.seek(0, os.SEEK_END)
+            else:
+                wire_bytes += os.path.getsize(output.source)
+
+        remote_root = os.path.join(workdir, f"remote_{output_format}")
+        os.mkdir(remote_root)
+        key = load_private_key(open(os.path.join(workdir, "id_ed25519")).read())
+        with LocalSFTPServer(remote_root, latency=latency_ms / 1000) as server:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for number, output in enumerate(outputs):
+                    if hasattr(output.source, "read"):
+                        output.source.seek(0)
+                    upload_file_sftp("127.0.0.1", server.port, "bench", output.source, f"/out_{number}", private_key=key)
+            upload_seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        "format": output_format,
+        "files": len(outputs),
+        "convert_seconds": round(convert_seconds, 3),
+        "upload_seconds": round(upload_seconds, 3),
+        "wire_mb": round(wire_bytes / 1e6, 2),
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=12)
+    parser.add_argument("--tiles", type=int, default=2)
+    parser.add_argument("--formats", default="xlsx,csv_zip,csv_gz,parquet")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_format(args.run, args.workdir, args.latency_ms)
+        return
+
+    from sftp_server import generate_ed25519_key
+
+    with tempfile.TemporaryDirectory() as workdir:
+        generate_ed25519_key(os.path.join(workdir, "id_ed25519"))
+        with zipfile.ZipFile(os.path.join(workdir, "payload.zip"), "w", zipfile.ZIP_DEFLATED) as payload:
+            for t in range(args.tiles):
+                csv_path = os.path.join(workdir, f"tile_{t}.csv")
+                write_tile(csv_path, args.rows, args.columns)
+                payload.write(csv_path, f"dashboard/tile_{t}.csv")
+                os.remove(csv_path)
+        with zipfile.ZipFile(os.path.join(workdir, "payload.zip")) as payload:
+            csv_mb = sum(info.file_size for info in payload.infolist()) / 1e6
+        print(f"{args.tiles} tile(s) x {args.rows} rows x {args.columns} columns = {csv_mb:.1f} MB of CSV, "
+              f"{os.path.getsize(os.path.join(workdir, 'payload.zip')) / 1e6:.1f} MB zipped")
+        for output_format in args.formats.split(","):
+            out = subprocess.run(
+                [sys.executable, __file__, "--run", output_format, "--workdir", workdir, "--latency-ms", str(args.latency_ms)],
+                check=True, capture_output=True, text=True
+            ).stdout.strip().splitlines()[-1]
+            print(out)
+
+
+if __name__ == "__main__":
+    main()
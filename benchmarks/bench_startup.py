@@ -0,0 +1,67 @@
+"""Measure cold-start cost per Cloud Functions entry point.
+
+Each entry point runs in a fresh interpreter with `-X importtime`, the way a
+new instance would: import main, then serve one request. Usage:
+
+    python benchmarks/bench_startup.py [--top 8]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPET = """
+import time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from flask import Flask, request
+app = Flask("bench")
+with app.test_request_context("/", method="POST", json={"form_params": {}}, headers={"authorization": "x"}):
+    getattr(main, "%s")(request)
+done = time.perf_counter()
+import sys
+sys.stderr.write("BENCH %%f %%f\\n" %% (imported - start, done - imported))
+"""
+
+
+def measure(entry_point, top):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SNIPPET % entry_point],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"),
+    )
+    modules = []
+    import_seconds = first_request_seconds = None
+    for line in proc.stderr.splitlines():
+        if line.startswith("BENCH "):
+            import_seconds, first_request_seconds = map(float, line.split()[1:])
+        elif line.startswith("import time:") and "|" in line and "self [us]" not in line:
+            self_us, cumulative_us, raw_name = line[len("import time:"):].split("|")
+            depth = len(raw_name) - len(raw_name.lstrip()) - 1
+            modules.append((int(self_us), int(cumulative_us), raw_name.strip(), depth))
+    # Top-level imports of main and of its direct children show where the time goes.
+    heaviest = sorted((m for m in modules if m[3] <= 1), key=lambda m: -m[1])[:top]
+    return {
+        "entry_point": entry_point,
+        "import_main_ms": round(import_seconds * 1000, 1),
+        "first_request_ms": round(first_request_seconds * 1000, 1),
+        "modules_imported": len(modules),
+        "total_import_self_ms": round(sum(m[0] for m in modules) / 1000, 1),
+        "heaviest_top_level": [{"module": m[2], "cumulative_ms": round(m[1] / 1000, 1)} for m in heaviest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=8)
+    args = parser.parse_args()
+    for entry_point in ("action_list", "action_form", "action_execute"):
+        print(json.dumps(measure(entry_point, args.top)))
+
+
+if __name__ == "__main__":
+    main()
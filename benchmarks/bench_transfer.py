@@ -0,0 +1,94 @@
+"""Measure SFTP upload throughput for different transfer profiles.
+
+Uploads run against the in-process paramiko server in sftp_server.py,
+behind a proxy that adds round-trip latency. Usage:
+
+    python benchmarks/bench_transfer.py --size-mb 16 --latency-ms 50
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from sftp import connect_ssh  # noqa: E402
+from sftp_server import LocalSFTPServer, generate_ed25519_key  # noqa: E402
+from credentials import load_private_key  # noqa: E402
+from transfer import TransferProfile, upload_file  # noqa: E402
+
+
+CASES = [
+    ("paramiko put (baseline)", TransferProfile(window_size=2097152), "put"),
+    ("pipelined depth=1", TransferProfile(max_outstanding_requests=1), "engine"),
+    ("pipelined depth=16", TransferProfile(max_outstanding_requests=16), "engine"),
+    ("pipelined depth=64", TransferProfile(), "engine"),
+    ("pipelined depth=128", TransferProfile(max_outstanding_requests=128), "engine"),
+    ("depth=64 window=2MiB", TransferProfile(window_size=2097152), "engine"),
+    ("depth=64 ciphers=fast", TransferProfile(cipher_profile="fast"), "engine"),
+    ("depth=64 ciphers=strong", TransferProfile(cipher_profile="strong"), "engine"),
+    ("depth=64 compress", TransferProfile(compress=True), "engine"),
+]
+
+
+def write_payload(path, size_mb, kind):
+    with open(path, "wb") as f:
+        if kind == "random":
+            f.write(os.urandom(size_mb * 1024 * 1024))
+            return
+        row = 0
+        while f.tell() < size_mb * 1024 * 1024:
+            f.write(f"{row},2024-01-{row % 28 + 1:02d},Region {row % 7},{row * 3.14:.2f}\n".encode())
+            row += 1
+
+
+def run_case(server, key, local_path, profile, mode):
+    with contextlib.redirect_stdout(io.StringIO()):
+        ssh_client = connect_ssh("127.0.0.1", server.port, "bench", key, profile=profile)
+    try:
+        sftp_client = ssh_client.open_sftp()
+        start = time.perf_counter()
+        if mode == "put":
+            sftp_client.put(local_path, "/upload.bin")
+        else:
+            upload_file(sftp_client, local_path, "/upload.bin", profile)
+        return time.perf_counter() - start
+    finally:
+        ssh_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--payload", choices=["csv", "random"], default="csv")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        root = os.path.join(workdir, "remote")
+        os.mkdir(root)
+        local_path = os.path.join(workdir, "payload")
+        write_payload(local_path, args.size_mb, args.payload)
+        key = load_private_key(generate_ed25519_key(os.path.join(workdir, "id_ed25519")))
+
+        with LocalSFTPServer(root, latency=args.latency_ms / 1000) as server:
+            for label, profile, mode in CASES:
+                seconds = run_case(server, key, local_path, profile, mode)
+                assert os.path.getsize(os.path.join(root, "upload.bin")) == os.path.getsize(local_path)
+                print(json.dumps({
+                    "case": label,
+                    "latency_ms": args.latency_ms,
+                    "payload": args.payload,
+                    "seconds": round(seconds, 3),
+                    "mb_per_s": round(args.size_mb / seconds, 2),
+                }))
+
+
+if __name__ == "__main__":
+    main()
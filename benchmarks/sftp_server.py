@@ -0,0 +1,272 @@
+"""An in-process paramiko SFTP server stand-in for benchmarks.
+
+Accepts any user, key or password, and serves a local directory. An
+optional latency proxy sits in front of it to emulate a far-away partner
+site: every chunk is delivered `latency` seconds after it was sent, in
+both directions, without serialising the stream.
+"""
+import collections
+import os
+import socket
+import threading
+import time
+
+import paramiko
+
+
+class StubServer(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def get_allowed_auths(self, username):
+        return "publickey,password"
+
+
+class StubSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+class StubSFTPServer(paramiko.SFTPServerInterface):
+    def __init__(self, server, *args, root=None, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+
+    def _realpath(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def list_folder(self, path):
+        path = self._realpath(path)
+        try:
+            out = []
+            for name in os.listdir(path):
+                attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)))
+                attr.filename = name
+                out.append(attr)
+            return out
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._realpath(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        path = self._realpath(path)
+        try:
+            fd = os.open(path, flags | getattr(os, "O_BINARY", 0), 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        try:
+            f = os.fdopen(fd, mode)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        handle = StubSFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._realpath(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self._realpath(oldpath), self._realpath(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self._realpath(oldpath), self._realpath(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._realpath(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._realpath(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+
+def _pump(source, destination, latency):
+    """Copy source -> destination, delaying every chunk by latency seconds."""
+    pending = collections.deque()
+    ready = threading.Condition()
+    done = []
+
+    def reader():
+        try:
+            while True:
+                data = source.recv(65536)
+                with ready:
+                    pending.append((time.monotonic() + latency, data))
+                    ready.notify()
+                if not data:
+                    return
+        except OSError:
+            with ready:
+                pending.append((0, b""))
+                ready.notify()
+
+    def writer():
+        try:
+            while True:
+                with ready:
+                    while not pending:
+                        ready.wait()
+                    deliver_at, data = pending.popleft()
+                delay = deliver_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if not data:
+                    destination.shutdown(socket.SHUT_WR)
+                    return
+                destination.sendall(data)
+        except OSError:
+            pass
+        finally:
+            done.append(True)
+
+    threading.Thread(target=reader, daemon=True).start()
+    threading.Thread(target=writer, daemon=True).start()
+
+
+class LocalSFTPServer:
+    """Serve root over SFTP on 127.0.0.1, optionally behind a latency proxy.
+
+    Usage:
+        with LocalSFTPServer(root, latency=0.05) as server:
+            upload_file_sftp("127.0.0.1", server.port, "bench", ...)
+    """
+
+    def __init__(self, root, latency=0.0):
+        self.root = root
+        self.latency = latency
+        self.host_key = paramiko.Ed25519Key.from_private_key_file(_host_key_path())
+        self.connections = 0
+        self._listener = None
+        self._proxy = None
+        self._transports = []
+        self._closing = False
+
+    @property
+    def port(self):
+        sock = self._proxy or self._listener
+        return sock.getsockname()[1]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(64)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        if self.latency:
+            self._proxy = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._proxy.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._proxy.bind(("127.0.0.1", 0))
+            self._proxy.listen(64)
+            threading.Thread(target=self._proxy_loop, daemon=True).start()
+
+    def stop(self):
+        self._closing = True
+        for sock in (self._proxy, self._listener):
+            if sock:
+                sock.close()
+        for transport in self._transports:
+            transport.close()
+
+    def _accept_loop(self):
+        while not self._closing:
+            try:
+                conn, _ = self._listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, StubSFTPServer, root=self.root)
+            transport.start_server(server=StubServer())
+            self._transports.append(transport)
+
+    def _proxy_loop(self):
+        upstream_port = self._listener.getsockname()[1]
+        while not self._closing:
+            try:
+                client, _ = self._proxy.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(("127.0.0.1", upstream_port))
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _pump(client, upstream, self.latency / 2)
+            _pump(upstream, client, self.latency / 2)
+
+
+def _host_key_path():
+    """Generate (once) and return an Ed25519 host key for the stand-in server."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sftp_host_key")
+    if not os.path.exists(path):
+        generate_ed25519_key(path)
+    return path
+
+
+def generate_ed25519_key(path):
+    """Write an unencrypted OpenSSH Ed25519 private key to path and return its text."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+
+    pem = ed25519.Ed25519PrivateKey.generate().private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.OpenSSH,
+        serialization.NoEncryption(),
+    ).decode()
+    with open(path, "w") as f:
+        f.write(pem)
+    return pem
@@ -0,0 +1,859 @@
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import functools
+import importlib.util
+import io
+import itertools
+import math
+import os
+import posixpath
+import re
+import tempfile
+import threading
+import zipfile
+
+import xlsxwriter
+
+from env import env_int
+import log
+from schema import NUMBER, STRING, ColumnTyping, sniff_column_kinds
+from workspace import WorkspaceQuotaExceeded
+
+
+# Excel limits sheet names to 31 characters.
+MAX_SHEET_NAME_LENGTH = 31
+
+# Rows in an Excel worksheet, including the header row.
+EXCEL_MAX_ROWS = 1048576
+
+# Matches the header style pandas applies in DataFrame.to_excel so both
+# engines produce visually identical workbooks.
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+
+# Tiles parsed ahead of the writer may hold at most this much memory.
+DEFAULT_PARSE_MEMORY_BYTES = 256 * 1024 * 1024
+
+# Rough in-memory size of a parsed tile relative to its CSV text, used to
+# keep tiles parsed ahead of the writer within the memory budget.
+ROWS_SIZE_FACTOR = 8
+FRAME_SIZE_FACTOR = 4
+
+# A CSV tile to convert: `name` is its file or archive member path,
+# `open()` returns a fresh binary stream over its contents and `size` is
+# its uncompressed size in bytes, if known.
+CsvSource = collections.namedtuple('CsvSource', ['name', 'open', 'size'], defaults=[None])
+
+_lock = threading.Lock()
+_conversion_slots = None
+
+
+def get_conversion_engine():
+    """Return the configured CSV -> Excel conversion engine.
+
+    Set CONVERSION_ENGINE=pandas to fall back to the DataFrame based path,
+    or CONVERSION_ENGINE=pyarrow to parse with pyarrow's multi-threaded CSV
+    reader (requires the optional pyarrow package). Anything else uses the
+    constant-memory streaming writer.
+    """
+    engine = os.environ.get("CONVERSION_ENGINE", "streaming").strip().lower()
+    if engine not in ("streaming", "pandas", "pyarrow"):
+        log.warning(f"Unknown CONVERSION_ENGINE '{engine}', using 'streaming'.")
+        engine = "streaming"
+    if engine == "pyarrow" and importlib.util.find_spec("pyarrow") is None:
+        log.warning("CONVERSION_ENGINE 'pyarrow' needs the pyarrow package, which is not installed. Using 'streaming'.")
+        engine = "streaming"
+    return engine
+
+
+def _usable_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError: # Not available on macOS
+        return os.cpu_count() or 1
+
+
+def get_parse_workers():
+    """Return how many tiles are parsed at once (CONVERSION_WORKERS).
+
+    Defaults to the number of CPUs this process may use, so a single vCPU
+    instance keeps parsing each tile inline. 1 disables parallel parsing.
+    """
+    return env_int("CONVERSION_WORKERS", _usable_cpus())
+
+
+def get_parse_pool(engine=None):
+    """Return 'thread' or 'process' (CONVERSION_POOL) for engine's parse-ahead pool.
+
+    Threads suit the pandas engine, whose C parser runs without the GIL.
+    The streaming engine's csv module holds the GIL, so it parses ahead in
+    processes, at the cost of pickling each parsed tile back to the writer.
+    Unset, each engine gets the pool that suits it.
+    """
+    default = "process" if engine == "streaming" else "thread"
+    pool = os.environ.get("CONVERSION_POOL", "").strip().lower() or default
+    if pool not in ("thread", "process"):
+        log.warning(f"Unknown CONVERSION_POOL '{pool}', using '{default}'.")
+        pool = default
+    return pool
+
+
+def get_parse_memory_bytes():
+    """Return the memory budget for tiles parsed ahead of the writer (CONVERSION_PARSE_MEMORY_BYTES)."""
+    return env_int("CONVERSION_PARSE_MEMORY_BYTES", DEFAULT_PARSE_MEMORY_BYTES, minimum=0)
+
+
+def get_max_sheet_rows():
+    """Return the most rows written to one sheet, header included (CONVERSION_MAX_SHEET_ROWS).
+
+    Defaults to Excel's limit of 1,048,576. Longer tiles are split; see get_split_mode.
+    """
+    return env_int("CONVERSION_MAX_SHEET_ROWS", EXCEL_MAX_ROWS, minimum=2, maximum=EXCEL_MAX_ROWS)
+
+
+def get_split_mode():
+    """Return where a tile continues once its sheet is full (CONVERSION_SPLIT).
+
+    'sheet' (default): on further sheets of the same workbook, named
+        '<sheet>_2', '<sheet>_3', ...
+    'workbook': on a sheet of the same name in a second, third, ...
+        workbook, which are delivered together in a zip bundle.
+    """
+    split = os.environ.get("CONVERSION_SPLIT", "sheet").strip().lower()
+    if split not in ("sheet", "workbook"):
+        log.warning(f"Unknown CONVERSION_SPLIT '{split}', using 'sheet'.")
+        split = "sheet"
+    return split
+
+
+def get_conversion_concurrency():
+    """Return how many conversions may run at once in this process (CONVERSION_CONCURRENCY).
+
+    Defaults to the number of CPUs this process may use. Only matters when
+    one process serves several requests (server.py, async jobs); a Cloud
+    Function handling one request at a time never waits.
+    """
+    return env_int("CONVERSION_CONCURRENCY", _usable_cpus())
+
+
+@contextlib.contextmanager
+def conversion_slot():
+    """Hold one of the process's CONVERSION_CONCURRENCY conversion slots for the block.
+
+    Conversion is CPU bound, so requests beyond the limit wait here rather
+    than slice the CPUs between them; downloads and uploads are not limited.
+    """
+    global _conversion_slots
+    with _lock:
+        if _conversion_slots is None:
+            _conversion_slots = threading.BoundedSemaphore(get_conversion_concurrency())
+    with log.span("wait_conversion_slot", level="DEBUG"):
+        _conversion_slots.acquire()
+    try:
+        yield
+    finally:
+        _conversion_slots.release()
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+def order_csv_sources(csv_sources, order=None):
+    """Return csv_sources in sheet order (CONVERSION_SHEET_ORDER).
+
+    'archive' (default) keeps the order of the members in the zip, which is
+    fixed for a given payload. 'name' sorts by file name, comparing runs of
+    digits as numbers so tile_2 comes before tile_10.
+    """
+    order = order or os.environ.get("CONVERSION_SHEET_ORDER", "archive").strip().lower()
+    if order == "name":
+        return sorted(csv_sources, key=lambda source: _natural_key(posixpath.basename(source.name)))
+    if order != "archive":
+        log.warning(f"Unknown CONVERSION_SHEET_ORDER '{order}', using 'archive'.")
+    return list(csv_sources)
+
+
+def read_csv_rows(raw_stream):
+    """Parse a binary CSV stream into a list of rows."""
+    return list(csv.reader(io.TextIOWrapper(raw_stream, encoding='utf-8-sig', newline='')))
+
+
+def read_csv_frame(raw_stream, **read_csv_kwargs):
+    """Parse a binary CSV stream into a DataFrame."""
+    import pandas as pd
+
+    return pd.read_csv(raw_stream, **read_csv_kwargs)
+
+
+def peek_csv(source, sample_rows):
+    """Return a tile's header row (None if empty) and up to sample_rows rows after it."""
+    with source.open() as raw_stream:
+        reader = csv.reader(io.TextIOWrapper(raw_stream, encoding='utf-8-sig', newline=''))
+        header = next(reader, None)
+        return header, list(itertools.islice(reader, sample_rows))
+
+
+def _parse_source(parse, source):
+    with source.open() as raw_stream:
+        return parse(raw_stream)
+
+
+def _parse_bytes(parse, data):
+    # Runs in a worker process, which cannot reach the open zip file.
+    return parse(io.BytesIO(data))
+
+
+def parse_ahead(csv_sources, parse, size_factor, workers=None, pool=None, memory_bytes=None):
+    """Parse tiles in a worker pool while the caller writes them in order.
+
+    parse is applied to each tile's binary stream; pass a list to use a
+    different callable per tile. Yields (source, future) pairs in csv_sources order, whatever order the
+    workers finish in. future.result() is the parsed tile. future is None
+    when the caller should stream the tile itself: always when workers is 1,
+    and for tiles of unknown size or whose estimated parsed size
+    (source.size * size_factor) does not fit memory_bytes. Tiles are only
+    submitted while the estimated size of everything parsed but not yet
+    written fits memory_bytes.
+    """
+    csv_sources = list(csv_sources)
+    parsers = parse if isinstance(parse, list) else [parse] * len(csv_sources)
+    workers = min(workers or get_parse_workers(), len(csv_sources))
+    if workers <= 1:
+        for source in csv_sources:
+            yield source, None
+        return
+
+    pool = pool or get_parse_pool()
+    memory_bytes = memory_bytes if memory_bytes is not None else get_parse_memory_bytes()
+    executor_cls = concurrent.futures.ProcessPoolExecutor if pool == "process" else concurrent.futures.ThreadPoolExecutor
+    log.info(f"Parsing up to {workers} CSV file(s) at once in a {pool} pool ({memory_bytes} byte budget).")
+
+    with executor_cls(max_workers=workers) as executor:
+        window = collections.deque() # (source, future, estimated bytes), in sheet order
+        next_index = 0
+        in_flight_bytes = 0
+        try:
+            while window or next_index < len(csv_sources):
+                while next_index < len(csv_sources) and len(window) < 2 * workers:
+                    source, parse = csv_sources[next_index], parsers[next_index]
+                    cost = source.size * size_factor if source.size is not None else None
+                    if cost is None or cost > memory_bytes:
+                        window.append((source, None, 0))
+                    elif in_flight_bytes + cost > memory_bytes:
+                        break # Wait for the writer to catch up
+                    elif pool == "process":
+                        with source.open() as raw_stream:
+                            data = raw_stream.read()
+                        window.append((source, executor.submit(_parse_bytes, parse, data), cost))
+                        in_flight_bytes += cost
+                    else:
+                        window.append((source, executor.submit(_parse_source, parse, source), cost))
+                        in_flight_bytes += cost
+                    next_index += 1
+
+                source, future, cost = window.popleft()
+                yield source, future
+                in_flight_bytes -= cost
+        finally:
+            for _, future, _ in window:
+                if future is not None:
+                    future.cancel()
+
+
+def sanitize_sheet_name(f_name, position):
+    """Build an Excel-safe sheet name from a CSV file name.
+
+    Args:
+        f_name: The CSV file name, e.g. 'Sales by Region.csv'.
+        position: 1-based position of the file, used when nothing survives sanitising.
+
+    Returns:
+        A sheet name of at most 31 characters.
+    """
+    sheet_name = os.path.splitext(os.path.basename(f_name))[0]
+    sheet_name = "".join(c for c in sheet_name if c.isalnum() or c in (' ', '_', '-'))[:MAX_SHEET_NAME_LENGTH]
+    if not sheet_name: # Handle case where sanitization results in an empty string
+        sheet_name = f"Sheet_{position}" # Generic name
+        log.warning(f"Sanitized sheet name for {f_name} was empty. Using generic name: {sheet_name}")
+    return sheet_name
+
+
+def unique_sheet_name(sheet_name, used_names):
+    """Suffix sheet_name with _2, _3, ... until it is unused, then record it.
+
+    Excel compares sheet names case-insensitively, so used_names holds
+    lower-cased names.
+    """
+    candidate = sheet_name
+    counter = 1
+    while candidate.lower() in used_names:
+        counter += 1
+        suffix = f"_{counter}"
+        candidate = sheet_name[:MAX_SHEET_NAME_LENGTH - len(suffix)] + suffix
+    if candidate != sheet_name:
+        log.warning(f"Sheet name '{sheet_name}' is already in use. Using '{candidate}' instead.")
+    used_names.add(candidate.lower())
+    return candidate
+
+
+def split_rows(rows, max_rows):
+    """Split a tile's data rows into chunks that each fit one sheet below a header row.
+
+    Always yields at least one (possibly empty) chunk. Each chunk is an
+    iterator over rows and must be consumed before the next is requested.
+    """
+    rows = iter(rows)
+    pending = []
+    while True:
+        yield itertools.chain(pending, itertools.islice(rows, max_rows - 1 - len(pending)))
+        pending = list(itertools.islice(rows, 1))
+        if not pending:
+            return
+
+
+class WorkbookSet:
+    """The workbook a conversion writes, plus any overflow workbooks.
+
+    place() names the sheet for each chunk of a tile (see split_rows) and
+    picks the workbook it goes in, per split (see get_split_mode). Sheet
+    names stay unique within each workbook. Overflow workbooks are written
+    to new files in tmpdir, which the caller removes.
+
+    Args:
+        output: Path or writable file object for the first workbook.
+        open_workbook: Callable taking a path or file object and returning
+            the engine's workbook object for it.
+        check_space: Optional callable run before each sheet is placed,
+            which raises to stop a conversion that is filling tmpdir.
+    """
+
+    def __init__(self, output, open_workbook, split=None, max_rows=None, tmpdir=None, check_space=None):
+        self.split = split or get_split_mode()
+        self.check_space = check_space
+        self.max_rows = max_rows or get_max_sheet_rows()
+        self.open_workbook = open_workbook
+        self.tmpdir = tmpdir
+        self.outputs, self.workbooks, self.used_names = [], [], []
+        self._add_workbook(output)
+
+    def _add_workbook(self, output):
+        self.workbooks.append(self.open_workbook(output))
+        self.outputs.append(output)
+        self.used_names.append(set())
+
+    def place(self, sheet_name, part=1):
+        """Return (workbook, sheet name) for chunk part (from 1) of the tile first placed as sheet_name."""
+        if self.check_space is not None:
+            self.check_space() # The sheets written so far hold their temp files in tmpdir
+        if self.split == "workbook":
+            index = part - 1
+        else:
+            index = 0
+            if part > 1:
+                suffix = f"_{part}"
+                sheet_name = sheet_name[:MAX_SHEET_NAME_LENGTH - len(suffix)] + suffix
+        while len(self.workbooks) <= index:
+            fd, path = tempfile.mkstemp(suffix=f"_{len(self.workbooks) + 1}.xlsx", dir=self.tmpdir)
+            os.close(fd)
+            log.info(f"Starting overflow workbook {len(self.workbooks) + 1} at {path}")
+            self._add_workbook(path)
+        return self.workbooks[index], unique_sheet_name(sheet_name, self.used_names[index])
+
+    def close(self, close_workbook):
+        """Close every workbook with close_workbook and return their outputs, first workbook first."""
+        for workbook in self.workbooks:
+            close_workbook(workbook)
+        return list(self.outputs)
+
+
+def bundle_workbooks(workbooks, output, stem="tabbed"):
+    """Zip workbook files into output as <stem>.xlsx, <stem>_2.xlsx, ...
+
+    The workbooks are already compressed, so they are stored as they are.
+    """
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as bundle:
+        for number, workbook in enumerate(workbooks, start=1):
+            bundle.write(workbook, f"{stem}.xlsx" if number == 1 else f"{stem}_{number}.xlsx")
+    return output
+
+
+def is_csv_member(member_name):
+    """Return True for archive members that hold a dashboard tile."""
+    if member_name.endswith('/') or not member_name.lower().endswith('.csv'):
+        return False
+    parts = member_name.split('/')
+    # Skip resource forks and hidden files added by macOS archivers.
+    if '__MACOSX' in parts or parts[-1].startswith('.'):
+        return False
+    return True
+
+
+def csv_sources_from_zip(zip_ref):
+    """List the CSV members of an open ZipFile as CsvSources, in archive order.
+
+    Members are found by path, wherever they sit in the archive, and are
+    decompressed on demand when the converter opens them.
+    """
+    return [
+        CsvSource(info.filename, lambda info=info: zip_ref.open(info, 'r'), info.file_size)
+        for info in zip_ref.infolist()
+        if is_csv_member(info.filename)
+    ]
+
+
+def csv_sources_from_paths(csv_paths):
+    """Wrap CSV files on disk as CsvSources."""
+    return [CsvSource(path, lambda path=path: open(path, 'rb'), os.path.getsize(path)) for path in csv_paths]
+
+
+def stream_csv_to_sheet(worksheet, csv_text_stream, header_format=None):
+    """Copy a CSV stream into a worksheet one row at a time.
+
+    Each column is typed once from a sample of its rows, as in the pyarrow
+    engine: it is a number column only when every sampled value is a number,
+    so codes with leading zeros such as '007' stay text. Empty cells are
+    left blank.
+
+    Returns:
+        The number of rows written, including the header.
+    """
+    return write_tile(worksheet, csv.reader(csv_text_stream), None, ColumnTyping("infer"), header_format)
+
+
+def write_typed_rows(worksheet, rows, kinds, header_format=None):
+    """Write CSV rows with each column stored as the kind given in kinds.
+
+    Cells in number columns that are not finite numbers after all are kept
+    as text, so a wrong guess never loses data. Empty cells are left blank.
+
+    Returns:
+        The number of rows written, including the header.
+    """
+    write_number, write_string = worksheet.write_number, worksheet.write_string
+    numeric = [kind == NUMBER for kind in kinds]
+    rows_written = 0
+    for row_index, row in enumerate(rows):
+        if row_index == 0:
+            for col_index, value in enumerate(row):
+                write_string(row_index, col_index, value, header_format)
+        else:
+            for col_index, value in enumerate(row):
+                if not value:
+                    continue
+                if col_index < len(numeric) and numeric[col_index]:
+                    try:
+                        number = float(value)
+                        if math.isfinite(number):
+                            write_number(row_index, col_index, number)
+                            continue
+                    except ValueError:
+                        pass
+                write_string(row_index, col_index, value)
+        rows_written += 1
+    return rows_written
+
+
+def write_tile(worksheet, rows, tile_name, column_typing, header_format=None, next_sheet=None, max_rows=None):
+    """Write one tile's CSV rows, typed as column_typing decides; see write_typed_rows.
+
+    Under CONVERSION_TYPES=infer the columns are typed from a sample of the
+    tile, as in the pyarrow engine, rather than cell by cell.
+
+    With max_rows, rows that do not fit worksheet continue on the sheets
+    next_sheet(part) returns as (worksheet, header_format) for part 2, 3,
+    ...; each repeats the header row.
+
+    Returns:
+        The number of rows written, counting each sheet's header.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return 0
+    sample = list(itertools.islice(rows, column_typing.sniff_rows)) if column_typing.mode != "raw" else []
+    kinds = column_typing.column_kinds(tile_name, header, sample) or sniff_column_kinds(len(header), sample)
+    rows = itertools.chain(sample, rows)
+    rows_written = 0
+    for part, chunk in enumerate(split_rows(rows, max_rows) if max_rows else [rows], start=1):
+        if part > 1:
+            worksheet, header_format = next_sheet(part)
+        rows_written += write_typed_rows(worksheet, itertools.chain([header], chunk), kinds, header_format)
+    return rows_written
+
+
+def stream_csv_files_to_excel(csv_sources, excel_file_path, tmpdir=None, column_typing=None, split=None, check_space=None):
+    """Convert CSV tiles into a tabbed workbook without loading them into memory.
+
+    The workbook is written with xlsxwriter's constant_memory mode, which
+    flushes each row to disk as soon as the next one starts, so peak memory
+    does not grow with the number of rows in a tile.
+
+    Args:
+        csv_sources: Ordered list of CsvSources, one sheet per tile.
+        excel_file_path: Destination path (or writable file object) for the .xlsx file.
+        tmpdir: Where xlsxwriter keeps its per-sheet temp files, and overflow
+            workbooks are written; defaults to the system temp dir.
+        column_typing: ColumnTyping deciding how cells are stored; defaults to CONVERSION_TYPES.
+        split: Where tiles longer than CONVERSION_MAX_SHEET_ROWS continue; see get_split_mode.
+        check_space: Called before each sheet is started; see csv_files_to_excel.
+
+    Returns:
+        The workbooks written: excel_file_path, then any overflow workbook paths.
+    """
+    header_formats = {}
+
+    def open_workbook(output):
+        workbook = _open_xlsx_workbook(output, {'constant_memory': True, 'tmpdir': tmpdir})
+        header_formats[workbook] = workbook.add_format(HEADER_FORMAT)
+        return workbook
+
+    workbooks = WorkbookSet(excel_file_path, open_workbook, split, tmpdir=tmpdir, check_space=check_space)
+    column_typing = column_typing or ColumnTyping()
+    # csv.reader holds the GIL, so parsing in threads only competes with the
+    # writer; tiles are parsed ahead only in a process pool, the default here.
+    pool = get_parse_pool("streaming")
+    workers = None if pool == "process" else 1
+    with contextlib.closing(parse_ahead(csv_sources, read_csv_rows, ROWS_SIZE_FACTOR, workers, pool)) as tiles:
+        for position, (source, parsed) in enumerate(tiles, start=1):
+            f_name = posixpath.basename(source.name)
+            log.debug(f"Streaming CSV: {source.name}")
+            workbook, sheet_name = workbooks.place(sanitize_sheet_name(f_name, position))
+            worksheet = workbook.add_worksheet(sheet_name)
+            next_sheet = functools.partial(_next_xlsx_sheet, workbooks, header_formats, source.name, sheet_name)
+            try:
+                # Streamed tiles are parsed as they are written, so one span covers both.
+                with log.span("write_sheet", tile=source.name, sheet=sheet_name, parsed_ahead=parsed is not None) as sheet_span:
+                    sheet_span.add_bytes(source.size)
+                    if parsed is not None:
+                        rows = parsed.result()
+                        rows_written = write_tile(
+                            worksheet, rows, source.name, column_typing, header_formats[workbook], next_sheet, workbooks.max_rows
+                        )
+                    else:
+                        with source.open() as raw_stream:
+                            rows = csv.reader(io.TextIOWrapper(raw_stream, encoding='utf-8-sig', newline=''))
+                            rows_written = write_tile(
+                                worksheet, rows, source.name, column_typing, header_formats[workbook], next_sheet, workbooks.max_rows
+                            )
+                    sheet_span.set(rows=rows_written)
+            except WorkspaceQuotaExceeded: # From check_space when a split part is started
+                raise
+            except FileNotFoundError:
+                log.error(f"CSV file {source.name} not found during processing loop.")
+                raise
+            except (csv.Error, UnicodeDecodeError) as e_parse:
+                log.error(f"Error parsing CSV file {source.name}: {e_parse}")
+                raise ValueError(f"Could not parse CSV file {source.name}: {e_parse}") from e_parse
+            except Exception as e_write:
+                log.error(f"Error writing sheet '{sheet_name}' (from CSV '{f_name}') to Excel: {e_write}")
+                raise RuntimeError(f"Failed to write sheet '{sheet_name}' from CSV '{f_name}': {e_write}") from e_write
+
+            if rows_written == 0:
+                log.warning(f"CSV file {source.name} is empty. An empty sheet will be created.")
+
+    return workbooks.close(_close_xlsx_workbook)
+
+
+def _open_xlsx_workbook(output, options):
+    try:
+        return xlsxwriter.Workbook(output, options)
+    except Exception as e_writer_init:
+        log.error(f"Error initializing streaming workbook for {output}: {e_writer_init}")
+        raise RuntimeError(f"Failed to initialize Excel file creation: {e_writer_init}") from e_writer_init
+
+
+def _close_xlsx_workbook(workbook):
+    try:
+        with log.span("close_workbook"):
+            workbook.close()
+        log.debug(f"Excel file successfully created and saved at: {workbook.filename}")
+    except Exception as e_close:
+        log.error(f"Error saving/closing Excel file {workbook.filename}: {e_close}. File may be corrupt or incomplete.")
+        raise RuntimeError(f"Failed to save/finalize Excel file {workbook.filename}: {e_close}") from e_close
+
+
+def _next_xlsx_sheet(workbooks, header_formats, tile_name, sheet_name, part):
+    """Add the sheet for chunk part of a tile; the next_sheet callable of write_tile."""
+    workbook, continued_name = workbooks.place(sheet_name, part)
+    log.info(f"Tile {tile_name} exceeds {workbooks.max_rows} rows; continuing on sheet '{continued_name}'.")
+    return workbook.add_worksheet(continued_name), header_formats[workbook]
+
+
+def pandas_frame_parsers(csv_sources, column_typing):
+    """Return a read_csv_frame callable per tile with the dtypes column_typing picks.
+
+    Also returns each tile's header, or None where pandas infers the types.
+    """
+    if column_typing.mode == "infer":
+        return [read_csv_frame] * len(csv_sources), [None] * len(csv_sources)
+    if column_typing.mode == "raw":
+        raw_parser = functools.partial(read_csv_frame, dtype=str, keep_default_na=False)
+        return [raw_parser] * len(csv_sources), [None] * len(csv_sources)
+
+    parsers, headers = [], []
+    for source in csv_sources:
+        header, sample = peek_csv(source, column_typing.sniff_rows)
+        kinds = column_typing.column_kinds(source.name, header, sample)
+        if kinds is None:
+            parsers.append(read_csv_frame)
+        else:
+            dtype = {column: 'float64' if kind == NUMBER else str for column, kind in zip(header, kinds)}
+            parsers.append(functools.partial(read_csv_frame, dtype=dtype))
+        headers.append(header)
+    return parsers, headers
+
+
+def pandas_csv_files_to_excel(csv_sources, excel_file_path, tmpdir=None, column_typing=None, split=None, check_space=None):
+    """Convert CSV tiles into a tabbed workbook through pandas DataFrames.
+
+    This is the original conversion path. Every tile is held in memory as a
+    DataFrame, so prefer stream_csv_files_to_excel for large dashboards.
+    """
+    import pandas as pd # Only this engine needs pandas; it is slow to import.
+
+    def open_writer(output):
+        try:
+            return pd.ExcelWriter(output, engine='xlsxwriter', engine_kwargs={'options': {'tmpdir': tmpdir}})
+        except Exception as e_writer_init: # Could be various pandas/xlsxwriter exceptions
+            log.error(f"Error initializing ExcelWriter for {output}: {e_writer_init}")
+            raise RuntimeError(f"Failed to initialize Excel file creation: {e_writer_init}") from e_writer_init
+
+    def close_writer(excel_writer_instance):
+        try:
+            with log.span("close_workbook"):
+                excel_writer_instance.close() # This saves the file with xlsxwriter engine
+            log.debug("Excel file successfully created and saved.")
+        except Exception as e_close: # Catches errors during writer.close()
+            log.error(f"Error saving/closing Excel file: {e_close}. File may be corrupt or incomplete.")
+            raise RuntimeError(f"Failed to save/finalize Excel file: {e_close}") from e_close
+
+    workbooks = WorkbookSet(excel_file_path, open_writer, split, tmpdir=tmpdir, check_space=check_space)
+    column_typing = column_typing or ColumnTyping()
+    parsers, headers = pandas_frame_parsers(csv_sources, column_typing)
+    with contextlib.closing(parse_ahead(csv_sources, parsers, FRAME_SIZE_FACTOR)) as tiles:
+        for position, (source, parsed) in enumerate(tiles, start=1):
+            f_name = posixpath.basename(source.name)
+            log.debug(f"Processing CSV: {source.name}")
+            parser, header = parsers[position - 1], headers[position - 1]
+            try:
+                with log.span("parse_tile", tile=source.name, parsed_ahead=parsed is not None) as parse_span:
+                    parse_span.add_bytes(source.size)
+                    try:
+                        df = parsed.result() if parsed is not None else _parse_source(parser, source)
+                    except (pd.errors.ParserError, pd.errors.EmptyDataError):
+                        raise
+                    except ValueError as e_typed:
+                        if header is None:
+                            raise
+                        # A number column holds text beyond the sample or cached types:
+                        # keep the text columns as text and let pandas infer the rest.
+                        log.warning(f"Typed parse of {source.name} failed ({e_typed}). Inferring number column types instead.")
+                        column_typing.forget(source.name, header)
+                        text_columns = {column: str for column, dtype in parser.keywords['dtype'].items() if dtype is str}
+                        df = _parse_source(functools.partial(read_csv_frame, dtype=text_columns), source)
+                    parse_span.set(rows=len(df))
+                if df.empty:
+                    log.warning(f"CSV file {source.name} is empty. An empty sheet will be created.")
+            except pd.errors.EmptyDataError:
+                log.warning(f"CSV file {source.name} is empty (pd.errors.EmptyDataError). Creating an empty sheet.")
+                df = pd.DataFrame() # Create an empty DataFrame to proceed robustly
+            except pd.errors.ParserError as e_parse:
+                log.error(f"Error parsing CSV file {source.name}: {e_parse}")
+                raise ValueError(f"Could not parse CSV file {source.name}: {e_parse}") from e_parse
+            except FileNotFoundError: # Should ideally not occur if listing was correct
+                log.error(f"CSV file {source.name} not found during processing loop.")
+                raise # Propagate as it indicates a prior logic flaw
+            except Exception as e_read_csv: # Catch any other pandas read_csv error
+                log.error(f"Error reading CSV file {source.name} with pandas: {e_read_csv}")
+                raise RuntimeError(f"Failed to read CSV {source.name}: {e_read_csv}") from e_read_csv
+
+            excel_writer_instance, sheet_name = workbooks.place(sanitize_sheet_name(f_name, position))
+            first_sheet_name = sheet_name
+            # Excel stops at max_rows rows, header included; longer frames continue on further sheets.
+            data_rows = workbooks.max_rows - 1
+            for part, start in enumerate(range(0, max(len(df), 1), data_rows), start=1):
+                if part > 1:
+                    excel_writer_instance, sheet_name = workbooks.place(first_sheet_name, part)
+                    log.info(f"Tile {source.name} exceeds {workbooks.max_rows} rows; continuing on sheet '{sheet_name}'.")
+                try:
+                    with log.span("write_sheet", tile=source.name, sheet=sheet_name) as sheet_span:
+                        chunk = df.iloc[start:start + data_rows]
+                        chunk.to_excel(excel_writer_instance, sheet_name=sheet_name, index=False)
+                        sheet_span.set(rows=len(chunk) + 1)
+                except Exception as e_to_excel:
+                    log.error(f"Error writing sheet '{sheet_name}' (from CSV '{f_name}') to Excel: {e_to_excel}")
+                    raise RuntimeError(f"Failed to write sheet '{sheet_name}' from CSV '{f_name}': {e_to_excel}") from e_to_excel
+            del df
+
+    return workbooks.close(close_writer)
+
+
+def arrow_convert_options(header, kinds):
+    """pyarrow CSV ConvertOptions typing each header column as its kind."""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    return pa_csv.ConvertOptions(
+        column_types={column: pa.float64() if kind == NUMBER else pa.string() for column, kind in zip(header, kinds)},
+        null_values=[""],
+        strings_can_be_null=False,
+    )
+
+
+def read_arrow_table(source, header, kinds):
+    """Read a whole tile with pyarrow, converting its number columns in C++."""
+    import pyarrow.csv as pa_csv
+
+    with source.open() as raw_stream:
+        return pa_csv.read_csv(raw_stream, convert_options=arrow_convert_options(header, kinds))
+
+
+def write_arrow_table(worksheet, table, kinds, header_format=None, next_sheet=None, max_rows=None):
+    """Write a pyarrow Table into a worksheet; see write_typed_rows.
+
+    Columns pyarrow converted arrive as floats. Number columns that had to
+    be read as text are converted cell by cell. max_rows and next_sheet
+    split long tables across sheets as in write_tile.
+
+    Returns:
+        The number of rows written, counting each sheet's header.
+    """
+    numeric = [kind == NUMBER for kind in kinds]
+    rows = (row for batch in table.to_batches() for row in zip(*(column.to_pylist() for column in batch.columns)))
+    rows_written = 0
+    for part, chunk in enumerate(split_rows(rows, max_rows) if max_rows else [rows], start=1):
+        if part > 1:
+            worksheet, header_format = next_sheet(part)
+        rows_written += _write_arrow_rows(worksheet, table.column_names, chunk, numeric, header_format)
+    return rows_written
+
+
+def _write_arrow_rows(worksheet, column_names, rows, numeric, header_format):
+    write_number, write_string = worksheet.write_number, worksheet.write_string
+    for col_index, name in enumerate(column_names):
+        write_string(0, col_index, name, header_format)
+    row_index = 0
+    for row in rows:
+        row_index += 1
+        for col_index, value in enumerate(row):
+            if value is None or value == "":
+                continue
+            if value.__class__ is float:
+                if math.isfinite(value):
+                    write_number(row_index, col_index, value)
+                else:
+                    write_string(row_index, col_index, str(value))
+                continue
+            if col_index < len(numeric) and numeric[col_index]:
+                try:
+                    number = float(value)
+                    if math.isfinite(number):
+                        write_number(row_index, col_index, number)
+                        continue
+                except ValueError:
+                    pass
+            write_string(row_index, col_index, value)
+    return row_index + 1
+
+
+def pyarrow_csv_files_to_excel(csv_sources, excel_file_path, tmpdir=None, column_typing=None, split=None, check_space=None):
+    """Convert CSV tiles into a tabbed workbook, parsing them with pyarrow.
+
+    pyarrow parses each tile on every core and converts number columns
+    natively, leaving Python only the cell writes. Columns are always typed
+    explicitly: by column_typing, or under CONVERSION_TYPES=infer from a
+    sample of each tile. Each tile is held in memory as an Arrow table
+    while it is written.
+    """
+    import pyarrow as pa
+
+    header_formats = {}
+
+    def open_workbook(output):
+        workbook = _open_xlsx_workbook(output, {'constant_memory': True, 'tmpdir': tmpdir})
+        header_formats[workbook] = workbook.add_format(HEADER_FORMAT)
+        return workbook
+
+    workbooks = WorkbookSet(excel_file_path, open_workbook, split, tmpdir=tmpdir, check_space=check_space)
+    column_typing = column_typing or ColumnTyping()
+
+    for position, source in enumerate(csv_sources, start=1):
+        f_name = posixpath.basename(source.name)
+        log.debug(f"Reading CSV with pyarrow: {source.name}")
+        workbook, sheet_name = workbooks.place(sanitize_sheet_name(f_name, position))
+        worksheet = workbook.add_worksheet(sheet_name)
+        next_sheet = functools.partial(_next_xlsx_sheet, workbooks, header_formats, source.name, sheet_name)
+        try:
+            header, sample = peek_csv(source, column_typing.sniff_rows)
+            if header is None:
+                rows_written = 0
+            else:
+                kinds = column_typing.column_kinds(source.name, header, sample) or sniff_column_kinds(len(header), sample)
+                with log.span("parse_tile", tile=source.name) as parse_span:
+                    parse_span.add_bytes(source.size)
+                    try:
+                        table = read_arrow_table(source, header, kinds)
+                    except pa.ArrowInvalid as e_typed:
+                        # A number column holds text beyond the sample; read it all as text.
+                        log.warning(f"Typed parse of {source.name} failed ({e_typed}). Reading every column as text.")
+                        column_typing.forget(source.name, header)
+                        table = read_arrow_table(source, header, [STRING] * len(header))
+                    parse_span.set(rows=table.num_rows)
+                with log.span("write_sheet", tile=source.name, sheet=sheet_name) as sheet_span:
+                    sheet_span.add_bytes(table.nbytes)
+                    rows_written = write_arrow_table(
+                        worksheet, table, kinds, header_formats[workbook], next_sheet, workbooks.max_rows
+                    )
+                    sheet_span.set(rows=rows_written)
+                del table
+        except WorkspaceQuotaExceeded:
+            raise
+        except FileNotFoundError:
+            log.error(f"CSV file {source.name} not found during processing loop.")
+            raise
+        except (pa.ArrowInvalid, csv.Error, UnicodeDecodeError) as e_parse:
+            log.error(f"Error parsing CSV file {source.name}: {e_parse}")
+            raise ValueError(f"Could not parse CSV file {source.name}: {e_parse}") from e_parse
+        except Exception as e_write:
+            log.error(f"Error writing sheet '{sheet_name}' (from CSV '{f_name}') to Excel: {e_write}")
+            raise RuntimeError(f"Failed to write sheet '{sheet_name}' from CSV '{f_name}': {e_write}") from e_write
+
+        if rows_written == 0:
+            log.warning(f"CSV file {source.name} is empty. An empty sheet will be created.")
+
+    return workbooks.close(_close_xlsx_workbook)
+
+
+def csv_files_to_excel(csv_sources, excel_file_path, engine=None, tmpdir=None, column_typing=None, split=None, check_space=None):
+    """Convert CSV tiles into a tabbed workbook with the selected engine.
+
+    Args:
+        csv_sources: Ordered list of CsvSources, or of plain CSV file paths.
+        excel_file_path: Destination path for the .xlsx file.
+        engine: 'streaming', 'pandas' or 'pyarrow'; defaults to CONVERSION_ENGINE.
+        tmpdir: Directory for xlsxwriter's temp files and overflow workbooks, e.g. the request workspace.
+        column_typing: ColumnTyping for the request, e.g. ColumnTyping.for_request(request_json);
+            defaults to CONVERSION_TYPES without Looker metadata or caching.
+        split: 'sheet' or 'workbook'; defaults to CONVERSION_SPLIT.
+        check_space: Called before each sheet is started, e.g. Workspace.check_quota,
+            so a conversion filling tmpdir stops early rather than after the last sheet.
+
+    Returns:
+        The workbooks written: excel_file_path, followed by any overflow
+        workbooks when split is 'workbook' and a tile needed more than one sheet.
+    """
+    csv_sources = order_csv_sources([
+        source if isinstance(source, CsvSource) else csv_sources_from_paths([source])[0]
+        for source in csv_sources
+    ])
+    engine = engine or get_conversion_engine()
+    column_typing = column_typing or ColumnTyping()
+    log.info(f"Converting {len(csv_sources)} CSV file(s) with the '{engine}' engine and '{column_typing.mode}' column types.")
+    convert = {"pandas": pandas_csv_files_to_excel, "pyarrow": pyarrow_csv_files_to_excel}.get(engine, stream_csv_files_to_excel)
+    with log.span("convert", engine=engine, tiles=len(csv_sources)) as convert_span:
+        convert_span.add_bytes(sum(source.size or 0 for source in csv_sources))
+        workbooks = convert(csv_sources, excel_file_path, tmpdir, column_typing, split, check_space)
+        convert_span.set(workbooks=len(workbooks))
+    return workbooks
@@ -0,0 +1,143 @@
+import hashlib
+import io
+import os
+import threading
+
+import log
+
+
+# The default key is mounted from Secret Manager as `sftp_pem`. Additional
+# named keys are mounted as `sftp_pem_<name>`, e.g. sftp_pem_partner_a.
+DEFAULT_KEY_NAME = "default"
+DEFAULT_KEY_ENV_VAR = "sftp_pem"
+NAMED_KEY_ENV_PREFIX = "sftp_pem_"
+
+
+_lock = threading.Lock()
+_parsed_keys = {}    # sha256 of key text -> paramiko key object (None if unparseable)
+_key_classes = {}    # key name -> key class that parsed it
+
+
+class UnknownKeyError(KeyError):
+    """Raised when a form selects a key name that is not configured."""
+
+
+def list_key_names():
+    """Return the configured key names, default first."""
+    names = []
+    if os.environ.get(DEFAULT_KEY_ENV_VAR):
+        names.append(DEFAULT_KEY_NAME)
+    names.extend(sorted(
+        env_var[len(NAMED_KEY_ENV_PREFIX):]
+        for env_var, value in os.environ.items()
+        if env_var.startswith(NAMED_KEY_ENV_PREFIX) and value
+    ))
+    return names
+
+
+def get_key_string(name=None):
+    """Return the private key text for a key name, or None for an unset default key."""
+    if not name or name == DEFAULT_KEY_NAME:
+        return os.environ.get(DEFAULT_KEY_ENV_VAR)
+    secret = os.environ.get(NAMED_KEY_ENV_PREFIX + name)
+    if not secret:
+        raise UnknownKeyError(name)
+    return secret
+
+
+def key_classes_to_try():
+    """Return the paramiko key classes to try, in order.
+
+    paramiko is imported here rather than at module level so action_form can
+    list key names without loading it.
+    """
+    import paramiko
+
+    # Explicitly try loading as common key types
+    return [
+        paramiko.Ed25519Key,
+        paramiko.ECDSAKey
+        # paramiko.DSSKey, # DSS is older and sometimes problematic; add if needed
+    ]
+
+
+def parse_private_key(private_key_string, preferred_cls=None):
+    """Parse an unencrypted Ed25519 or ECDSA private key from a string.
+
+    Tries preferred_cls first when given, then every class from key_classes_to_try().
+
+    Returns:
+        The paramiko key object, or None if the string could not be parsed.
+    """
+    if not isinstance(private_key_string, str):
+        log.error("private_key_string must be a string.")
+        return None
+
+    import paramiko
+
+    try:
+        key_file_obj = io.StringIO(private_key_string)
+        key_classes = [preferred_cls] if preferred_cls else []
+        key_classes += [key_cls for key_cls in key_classes_to_try() if key_cls is not preferred_cls]
+
+        for key_cls in key_classes:
+            try:
+                key_file_obj.seek(0) # Reset stream for each parsing attempt
+                private_key_obj = key_cls.from_private_key(key_file_obj, password=None) # No password
+                log.debug(f"Successfully loaded key as {key_cls.__name__} from string.")
+                return private_key_obj
+            except paramiko.SSHException as e_ssh_type:
+                # This is expected if the key is not of the current type,
+                # or if it's encrypted (but we assume unencrypted).
+                log.debug(f"Could not load key as {key_cls.__name__}: {e_ssh_type}")
+            except Exception as e_other_type:
+                # Catch any other unexpected error during a specific key type load
+                log.debug(f"Unexpected error trying to load as {key_cls.__name__}: {e_other_type}")
+
+        log.error("Failed to load private key from string using any known key type. "
+              "Ensure the key string is a valid unencrypted private key (OpenSSH or PEM format).")
+    except Exception as e_load_key: # Catch errors like io.StringIO failing
+        log.error(f"Error preparing or loading SSH key from string: {e_load_key}")
+    return None
+
+
+def load_private_key(private_key_string, name=None):
+    """Return the parsed key for private_key_string, parsing it at most once per process.
+
+    Keys are cached by a hash of their text, so a rotated secret is parsed
+    again. The class that worked is remembered per name and tried first
+    when that name's secret changes.
+    """
+    if not isinstance(private_key_string, str):
+        log.error("private_key_string must be a string.")
+        return None
+
+    digest = hashlib.sha256(private_key_string.encode("utf-8")).hexdigest()
+    with _lock:
+        if digest in _parsed_keys:
+            return _parsed_keys[digest]
+        private_key_obj = parse_private_key(private_key_string, _key_classes.get(name))
+        _parsed_keys[digest] = private_key_obj
+        if private_key_obj is not None and name:
+            _key_classes[name] = type(private_key_obj)
+        return private_key_obj
+
+
+def get_private_key(name=None):
+    """Return the parsed private key configured under name (default key if None).
+
+    Returns:
+        The paramiko key object, or None when no default key is configured.
+
+    Raises:
+        UnknownKeyError: name is not a configured key.
+        ValueError: the configured secret is not a usable private key.
+    """
+    key_name = name or DEFAULT_KEY_NAME
+    private_key_string = get_key_string(key_name)
+    if private_key_string is None:
+        return None
+    private_key_obj = load_private_key(private_key_string, key_name)
+    if private_key_obj is None:
+        raise ValueError(f"Configured SSH key '{key_name}' could not be parsed.")
+    return private_key_obj
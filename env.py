@@ -0,0 +1,53 @@
+"""Settings read from environment variables.
+
+Every module reads its numeric and on/off settings through these helpers,
+so a misconfigured value behaves the same everywhere: it is logged as a
+warning and the default is used instead.
+"""
+import os
+
+import log
+
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+FALSE_VALUES = ("0", "false", "no", "off")
+
+
+def env_number(name, default, cast=int, minimum=1, maximum=None):
+    """Read a number from the environment variable name.
+
+    An unset or empty variable gives default. A value cast cannot parse, or
+    outside minimum..maximum, is ignored with a warning and gives default.
+    minimum is 1 unless the setting gives 0 a meaning (e.g. 0 = disabled).
+    """
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        parsed = cast(value)
+    except ValueError:
+        parsed = None
+    if parsed is None or parsed < minimum or (maximum is not None and parsed > maximum):
+        limits = f"{minimum} or more" if maximum is None else f"{minimum}-{maximum}"
+        log.warning(f"Ignoring invalid {name}='{value}' (must be {limits}), using {default}.")
+        return default
+    return parsed
+
+
+def env_int(name, default, minimum=1, maximum=None):
+    """Read an integer setting; see env_number."""
+    return env_number(name, default, int, minimum, maximum)
+
+
+def env_flag(name, default):
+    """Read an on/off setting: 1/true/yes/on or 0/false/no/off, else default (with a warning if set)."""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    log.warning(f"Ignoring invalid {name}='{value}' (must be true or false), using {default}.")
+    return default
@@ -0,0 +1,712 @@
+# action_execute and the conversion/delivery pipeline behind it. main.py
+# imports this module on first use so the hub endpoints skip its imports.
+import admission
+from attachment import open_attachment
+from auth import authenticate
+from convert import (
+    bundle_workbooks, conversion_slot, csv_files_to_excel, csv_sources_from_zip, get_conversion_engine, get_split_mode
+)
+from credentials import get_private_key, UnknownKeyError
+from env import env_int
+from fanout import (
+    Destination, destination_result, host_slot, parse_destinations, unique_destinations, upload_to_destinations
+)
+from flask import Response
+import formats
+import idempotency
+from jobs import JobQueueFull, get_job_queue, register_handler
+import log
+import zipfile, json
+import contextlib
+import os
+import shutil
+from schema import ColumnTyping
+from sftp import sftp_session, stream_file_sftp
+import tempfile
+from transfer import ChecksumWriter
+from workspace import Workspace, WorkspaceQuotaExceeded, request_workspace, usage_report
+
+
+tmpdir = tempfile.gettempdir()
+
+DEFAULT_DELIVERY_SPOOL_BYTES = 32 * 1024 * 1024
+
+def get_delivery_mode():
+    """Return how the workbook reaches the SFTP server (DELIVERY_MODE).
+
+    'spool' (default): build it in a SpooledTemporaryFile that stays in memory
+        up to DELIVERY_SPOOL_BYTES and spills to disk beyond that, then upload.
+    'remote': write it straight into the remote file while converting.
+    'file': write tabbed.xlsx to a temp directory, then upload it.
+    """
+    mode = os.environ.get("DELIVERY_MODE", "spool").strip().lower()
+    if mode not in ("spool", "remote", "file"):
+        log.warning(f"Unknown DELIVERY_MODE '{mode}', using 'spool'.")
+        mode = "spool"
+    return mode
+
+
+def get_spool_threshold():
+    """Bytes of workbook kept in memory before the spool spills to disk (DELIVERY_SPOOL_BYTES)."""
+    return env_int("DELIVERY_SPOOL_BYTES", DEFAULT_DELIVERY_SPOOL_BYTES, minimum=0)
+
+
+def convertname(request_json, output=None, workspace=None, attachment_stream=None, workbook_name=None, engine=None):
+    """Convert the csv_zip attachment of an execute request into a tabbed workbook.
+
+    When CONVERSION_SPLIT=workbook and a tile is too long for one sheet, the
+    result is a zip bundle of the workbooks instead (see bundle_workbooks).
+
+    Args:
+        request_json: The parsed action_execute payload.
+        output: Optional writable binary file object to write the workbook into.
+        workspace: The request's Workspace for scratch files (download spool,
+            xlsxwriter temp files, tabbed.xlsx). If None, a new one is created
+            and removing it is the caller's responsibility.
+        attachment_stream: The already opened attachment (see open_attachment).
+            It is read from the start and left open for the caller to close.
+        workbook_name: File name the workbooks are given inside a bundle,
+            e.g. the destination file name; defaults to tabbed.xlsx.
+        engine: Conversion engine; defaults to CONVERSION_ENGINE.
+
+    Returns:
+        output if it was given, otherwise the path of tabbed.xlsx in the
+        workspace, or of tabbed.zip if the workbooks were bundled.
+    """
+    if workspace is None:
+        try:
+            workspace = Workspace.create()
+        except OSError as e:
+            log.error(f"Error creating temporary directory: {e}")
+            raise RuntimeError(f"Failed to create temporary directory: {e}") from e
+        log.debug(f"Working in temporary directory: {workspace.path}")
+    operation_dir = workspace.path
+    excel_file_path = None # Ensure it's defined for return in case of early exit (though we raise)
+
+    try:
+        # 1. Fetch (url download mode) or decode (inline) the csv_zip attachment
+        if attachment_stream is None:
+            attachment_stream = open_attachment(request_json, spool_dir=operation_dir, quota_bytes=workspace.remaining_bytes())
+            owned_stream = attachment_stream
+        else:
+            attachment_stream.seek(0)
+            owned_stream = contextlib.nullcontext()
+
+        # 2. Locate the CSV members and stream them straight into the workbook.
+        # Nothing is extracted to disk; /tmp is RAM on Cloud Functions.
+        try:
+            with owned_stream, zipfile.ZipFile(attachment_stream, 'r') as zip_ref:
+                with log.span("extract") as extract_span:
+                    csv_sources = csv_sources_from_zip(zip_ref)
+                    if not csv_sources:
+                        raise FileNotFoundError(f"No CSV files found in the attachment archive. Members: {zip_ref.namelist()}")
+                    extract_span.set(tiles=len(csv_sources))
+                    extract_span.add_bytes(sum(source.size or 0 for source in csv_sources))
+                log.debug(f"Found CSV members: {[source.name for source in csv_sources]}")
+
+                # 3. Create Excel file. Split workbooks must be bundled before
+                # they reach output, so they are written to the workspace first.
+                split = get_split_mode()
+                excel_file_path = output if output is not None and split == "sheet" else workspace.file_path('tabbed.xlsx')
+                with conversion_slot():
+                    workbooks = csv_files_to_excel(
+                        csv_sources, excel_file_path, engine=engine, tmpdir=operation_dir,
+                        column_typing=ColumnTyping.for_request(request_json), split=split,
+                        check_space=workspace.check_quota
+                    )
+                workspace.check_quota()
+
+                if len(workbooks) > 1:
+                    stem = os.path.splitext(os.path.basename(workbook_name or 'tabbed.xlsx'))[0]
+                    log.info(f"Bundling {len(workbooks)} workbooks into a zip.")
+                    excel_file_path = bundle_workbooks(
+                        workbooks, output if output is not None else workspace.file_path('tabbed.zip'), stem
+                    )
+                    workspace.check_quota()
+                elif output is not None and excel_file_path is not output:
+                    with open(excel_file_path, 'rb') as workbook_file:
+                        shutil.copyfileobj(workbook_file, output)
+                    excel_file_path = output
+        except zipfile.BadZipFile as e:
+            log.error(f"Uploaded file is not a valid zip file or is corrupted: {e}")
+            raise ValueError(f"Invalid or corrupted zip file: {e}") from e
+
+        if log.debug_enabled():
+            log.debug(f"Contents of {operation_dir} before return: {os.listdir(operation_dir)}")
+
+        return excel_file_path
+
+    except Exception as e_outer:
+        # This is the main catch block for convertname.
+        # It catches any exception not handled by inner blocks or re-raised by them.
+        log.error(f"An error occurred in convertname function: {e_outer}", error_type=type(e_outer).__name__)
+        # Cleanup of the workspace is the caller's responsibility (see request_workspace).
+        # Re-raise the exception so action_execute can handle it and return a proper error response.
+        raise
+
+class DeliveryError(Exception):
+    """A conversion or upload failure, with the HTTP status to report it under."""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+def deliver_workbook(request_json, destinations, key, output_format=formats.XLSX, reservation=None):
+    """Convert the request's attachment once and upload it to every SFTP destination.
+
+    All scratch files live in a per-request workspace that is removed when
+    this returns, whether delivery succeeded or not. Each delivery is keyed
+    on the scheduled plan, destination and attachment contents (see
+    idempotency.py): an identical delivery already running is waited for,
+    and one that recently succeeded is not repeated. Uploads run
+    concurrently; see fanout.upload_to_destinations.
+
+    Args:
+        destinations: Destinations (or [host, port, username, filename]
+            lists); repeats are dropped.
+        output_format: One of formats.FORMAT_LABELS; see _convert_and_upload.
+        reservation: MemoryBudget token already held for this request, e.g.
+            by its queued job; the conversion's reservation takes it over.
+
+    Returns:
+        One result dict per destination, in order, with 'status' 'success'
+        or 'failure'; 'duplicate' is True where the delivery was not repeated.
+
+    Conversion only starts once its estimated memory fits this instance's
+    budget (see admission.py), falling back to the streaming engine if the
+    configured one does not fit.
+
+    Raises:
+        DeliveryError: conversion failed, an identical delivery is still
+            running, or the conversion does not fit in memory (413 if it
+            never will, 503 while other requests hold the memory); the
+            message is safe to return to Looker.
+    """
+    destinations = unique_destinations(destinations)
+    try:
+        with request_workspace() as workspace:
+            try:
+                attachment_stream = open_attachment(request_json, spool_dir=workspace.path, quota_bytes=workspace.remaining_bytes())
+            except Exception as e_attachment:
+                log.error(f"Error reading the attachment: {e_attachment}")
+                raise DeliveryError(f"File conversion process failed: {str(e_attachment)}") from e_attachment
+
+            with attachment_stream, contextlib.ExitStack() as held_claims:
+                results = {}
+                claims = {}
+                if idempotency.is_enabled():
+                    with log.span("digest_attachment") as digest_span:
+                        attachment_digest = idempotency.stream_digest(attachment_stream)
+                        digest_span.add_bytes(attachment_stream.seek(0, os.SEEK_END))
+                        attachment_stream.seek(0)
+                        digest_span.set(sha256=attachment_digest)
+                    try:
+                        # Claimed in a fixed order so overlapping fan-outs cannot deadlock.
+                        for destination in sorted(destinations):
+                            # xlsx deliveries keep the keys they had before formats existed.
+                            identity = list(destination) + ([output_format] if output_format != formats.XLSX else [])
+                            delivery_key = idempotency.delivery_key(request_json, identity, attachment_digest)
+                            log.debug(f"Delivery key {delivery_key} for {destination.username}@{destination.host}:{destination.port} {destination.filename}")
+                            claim = held_claims.enter_context(idempotency.get_ledger().claim(delivery_key))
+                            if claim.cached:
+                                results[destination] = dict(claim.result, duplicate=True)
+                                continue
+                            delivered_as = None
+                            if idempotency.remote_digest_enabled():
+                                delivered_as = _remote_has_delivery(
+                                    *destination[:3], _remote_filenames(destination.filename, output_format), key, delivery_key
+                                )
+                            if delivered_as:
+                                log.info(f"Remote file '{delivered_as}' already holds this delivery. Skipping it.")
+                                claim.result = destination_result(destination._replace(filename=delivered_as), status="success", size=None, sha256=None)
+                                results[destination] = dict(claim.result, duplicate=True)
+                            else:
+                                claims[destination] = claim
+                    except idempotency.DeliveryInProgress as e_busy:
+                        log.error(str(e_busy))
+                        raise DeliveryError(f"This delivery is already in progress. {str(e_busy)}", status=409) from e_busy
+
+                pending = [destination for destination in destinations if destination not in results]
+                if pending:
+                    try:
+                        engine = held_claims.enter_context(
+                            _admit_conversion(request_json, pending, attachment_stream, output_format, reservation)
+                        )
+                    except admission.PayloadTooLarge as e_large:
+                        log.error(str(e_large))
+                        raise DeliveryError(f"The dashboard is too large to convert on this instance. {str(e_large)}", status=413) from e_large
+                    except admission.MemoryBudgetExceeded as e_memory:
+                        log.error(str(e_memory))
+                        raise DeliveryError(f"This instance is busy with other deliveries. Please retry later. {str(e_memory)}", status=503) from e_memory
+                    uploaded = _convert_and_upload(request_json, pending, key, workspace, attachment_stream, output_format, engine)
+                    for destination, result in uploaded.items():
+                        if result["status"] == "success" and destination in claims:
+                            if idempotency.remote_digest_enabled():
+                                _record_remote_delivery(*destination._replace(filename=result["filename"]), key, claims[destination].key)
+                            claims[destination].result = result
+                        results[destination] = dict(result, duplicate=False)
+                elif destinations:
+                    log.info("Every destination already holds this delivery. Skipping conversion.")
+                return [results[destination] for destination in destinations]
+    except WorkspaceQuotaExceeded as e_quota:
+        log.error(str(e_quota), **usage_report())
+        raise DeliveryError(f"Temporary storage is full on this instance. Please retry later. {str(e_quota)}", status=507) from e_quota
+
+
+def _remote_filenames(filename, output_format):
+    """Remote names a delivery to filename may have been uploaded as.
+
+    Deliveries of several files record the digest next to the first one,
+    whose name depends on the tiles, so only single-file names are listed.
+    """
+    if output_format == formats.XLSX:
+        return [formats.remote_filename(filename, ".zip"), filename] if get_split_mode() == "workbook" else [filename]
+    suffix = {formats.CSV_ZIP: ".zip", formats.CSV_GZ: ".csv.gz", formats.PARQUET: ".parquet"}[output_format]
+    return [formats.remote_filename(filename, suffix)]
+
+
+def _remote_has_delivery(host, port, username, filenames, key, delivery_key):
+    """Return whichever of filenames already holds this delivery, or None."""
+    try:
+        with sftp_session(host, port, username, private_key=key) as sftp_client:
+            for candidate in filenames:
+                if idempotency.remote_has_delivery(sftp_client, candidate, delivery_key):
+                    return candidate
+    except Exception as e_check:
+        # The upload will report a real connection problem; just don't skip it.
+        log.warning(f"Could not check the remote digest for '{filenames[0]}': {e_check}")
+    return None
+
+
+def _record_remote_delivery(host, port, username, filename, key, delivery_key):
+    try:
+        with sftp_session(host, port, username, private_key=key) as sftp_client:
+            idempotency.record_remote_delivery(sftp_client, filename, delivery_key)
+    except Exception as e_record:
+        # The workbook is delivered; a missing digest only costs a re-send later.
+        log.warning(f"Could not write the remote digest for '{filename}': {e_record}")
+
+
+def _admit_conversion(request_json, destinations, attachment_stream, output_format, reservation=None):
+    """Reserve memory for converting the attachment; see admission.MemoryBudget.admit.
+
+    The cost is estimated from the request body and the zip's central
+    directory. If the configured engine does not fit, the streaming engine
+    is tried before giving up. Yields the engine to convert with.
+    """
+    size = admission.measure_attachment(attachment_stream)
+    held = admission.attachment_cost(request_json, size)
+    delivery_mode = get_delivery_mode()
+    spooled = delivery_mode == "spool" or (delivery_mode == "remote" and len(destinations) > 1)
+    spool_bytes = get_spool_threshold() if spooled else 0
+    engines = list(dict.fromkeys([get_conversion_engine(), "streaming"]))
+    if size is not None:
+        log.info(f"Attachment holds {size.tiles} CSV file(s), {size.csv_bytes} bytes uncompressed.", **size._asdict())
+    return admission.get_budget().admit([
+        (engine, held + admission.conversion_cost(size, engine, output_format, spool_bytes)) for engine in engines
+    ], replaces=reservation)
+
+
+def _convert_and_upload(request_json, destinations, key, workspace, attachment_stream, output_format=formats.XLSX, engine=None):
+    """Build the output and upload it to each destination; see deliver_workbook.
+
+    xlsx workbooks are built per DELIVERY_MODE with engine (defaults to
+    CONVERSION_ENGINE). Other formats are written to the workspace (see
+    formats.convert_to_format), or for csv_zip not converted at all.
+
+    Returns:
+        A dict mapping each destination to its result dict.
+    """
+    if output_format != formats.XLSX:
+        log.info(f"Output format: {output_format}")
+        try:
+            # csv_zip is passed through unconverted, so it does not wait for a slot.
+            with contextlib.nullcontext() if output_format == formats.CSV_ZIP else conversion_slot():
+                outputs = formats.convert_to_format(
+                    output_format, attachment_stream, workspace.path, ColumnTyping.for_request(request_json),
+                    check_space=workspace.check_quota
+                )
+            workspace.check_quota()
+        except WorkspaceQuotaExceeded:
+            raise
+        except Exception as e_convert:
+            log.error(f"Error during {output_format} conversion: {e_convert}")
+            raise DeliveryError(f"File conversion process failed: {str(e_convert)}") from e_convert
+        return _upload_outputs(outputs, destinations, key)
+
+    delivery_mode = get_delivery_mode()
+    if delivery_mode == "remote" and len(destinations) > 1:
+        # One remote file can be written while converting; the others need a local copy.
+        log.info(f"Delivering to {len(destinations)} destinations; spooling instead of streaming to the remote file.")
+        delivery_mode = "spool"
+    if delivery_mode != "file" and get_split_mode() == "workbook":
+        # Whether the result is a workbook or a zip bundle, and so its
+        # remote name, is only known once conversion finishes.
+        log.info("CONVERSION_SPLIT=workbook: writing the workbook to a file before uploading.")
+        delivery_mode = "file"
+    log.info(f"Delivery mode: {delivery_mode}")
+
+    if delivery_mode == "remote":
+        # Conversion writes straight into the remote file, so it overlaps with the upload.
+        destination = destinations[0]
+        try:
+            with host_slot(destination.host, destination.port):
+                stream_result = stream_file_sftp(
+                    destination.host,
+                    destination.port,
+                    destination.username,
+                    lambda remote_output: convertname(request_json, remote_output, workspace, attachment_stream, engine=engine),
+                    destination.filename,
+                    private_key=key
+                )
+            log.info(f"Streamed upload successful: {stream_result.size} bytes, sha256 {stream_result.sha256}")
+        except WorkspaceQuotaExceeded:
+            raise
+        except Exception as e_stream:
+            log.error(f"Error during streamed conversion/upload: {e_stream}")
+            raise DeliveryError(f"Streamed conversion and upload failed. Check server logs for details. Error: {str(e_stream)}") from e_stream
+        return {destination: destination_result(
+            destination, status="success", size=stream_result.size, sha256=stream_result.sha256, attempts=1
+        )}
+
+    spool = None
+    path_to_excel = None # Initialize
+    local_digest = None
+    try:
+        if delivery_mode == "spool":
+            spool = tempfile.SpooledTemporaryFile(max_size=get_spool_threshold(), mode='w+b', dir=workspace.path)
+            checksum_writer = ChecksumWriter(spool)
+            convertname(request_json, checksum_writer, workspace, attachment_stream, engine=engine)
+            spool.seek(0)
+            path_to_excel = spool
+            local_digest = (checksum_writer.size, checksum_writer.hexdigest())
+            log.info(f"Workbook spooled: {checksum_writer.size} bytes, sha256 {checksum_writer.hexdigest()}")
+        else:
+            path_to_excel = convertname(
+                request_json, workspace=workspace, attachment_stream=attachment_stream,
+                workbook_name=destinations[0].filename, engine=engine
+            )
+            # convertname now raises exceptions on failure, so path_to_excel should be valid if no exception.
+            if not path_to_excel or not os.path.exists(path_to_excel):
+                 # This case should ideally be covered by exceptions from convertname
+                 log.error(f"convertname completed but returned an invalid path ('{path_to_excel}') or file does not exist.")
+                 raise FileNotFoundError("Excel file creation process completed, but the output file is missing or path is invalid.")
+    except WorkspaceQuotaExceeded:
+        if spool is not None:
+            spool.close()
+        raise
+    except Exception as e_convert:
+        if spool is not None:
+            spool.close()
+        log.error(f"Error during file conversion (convertname): {e_convert}")
+        # Consider logging traceback for server-side debugging:
+        # import traceback; traceback.print_exc()
+        raise DeliveryError(f"File conversion process failed: {str(e_convert)}") from e_convert
+
+    log.debug(f"File conversion successful. Excel file at: {path_to_excel}")
+    # A bundle of split workbooks is uploaded as <name>.zip.
+    bundled = isinstance(path_to_excel, str) and path_to_excel.endswith(".zip")
+    try:
+        return _upload_outputs([formats.OutputFile(path_to_excel, ".zip" if bundled else None, local_digest)], destinations, key)
+    finally:
+        if spool is not None:
+            spool.close()
+
+
+def _upload_outputs(outputs, destinations, key):
+    """Upload every formats.OutputFile to every destination.
+
+    Returns:
+        A dict mapping each destination to its result dict. A delivery of
+        several files lists them under 'files' and fails if any of them did.
+    """
+    file_results = {destination: [] for destination in destinations}
+    for output in outputs:
+        targets = {
+            destination: destination._replace(filename=formats.remote_filename(destination.filename, output.suffix))
+            for destination in destinations
+        }
+        log.debug(f"Attempting to upload {output.source} to {len(destinations)} SFTP destination(s) as {[target.filename for target in targets.values()]}...")
+        uploaded = upload_to_destinations(output.source, list(targets.values()), key, local_digest=output.digest)
+        for destination, target in targets.items():
+            file_results[destination].append(uploaded[target])
+
+    results = {}
+    for destination, files in file_results.items():
+        if len(files) == 1:
+            results[destination] = files[0]
+            continue
+        failures = [result for result in files if result["status"] != "success"]
+        result = destination_result(
+            destination._replace(filename=files[0]["filename"]),
+            status="failure" if failures else "success",
+            size=sum(file_result.get("size") or 0 for file_result in files),
+            attempts=max(file_result["attempts"] for file_result in files),
+            files=files,
+        )
+        if failures:
+            result.update(error=failures[0]["error"], retryable=any(failure["retryable"] for failure in failures))
+        results[destination] = result
+
+    for result in results.values():
+        if result["status"] != "success":
+            # Be cautious about exposing raw SFTP error details to client
+            # 503 tells Looker a retry may work (and resume the partial upload); 500 that it will not.
+            result["error"] = f"SFTP upload failed. Check server logs for details. Error: {result['error']}"
+            result["http_status"] = 503 if result["retryable"] else 500
+    log.info(f"SFTP upload finished: {sum(result['status'] == 'success' for result in results.values())} of {len(results)} succeeded.")
+    return results
+
+
+def delivery_failure(results):
+    """Summarise failed destinations as (message, HTTP status), or None if all succeeded.
+
+    The status is 503 when any failure may succeed on retry, so Looker
+    retries; destinations that already succeeded are then not re-sent.
+    """
+    failures = [result for result in results if result["status"] != "success"]
+    if not failures:
+        return None
+    status = 503 if any(result["http_status"] == 503 for result in failures) else failures[0]["http_status"]
+    if len(results) == 1:
+        return failures[0]["error"], status
+    return f"SFTP upload failed for {len(failures)} of {len(results)} destinations.", status
+
+
+def get_execute_mode():
+    """Return 'sync' (convert and upload before responding) or 'async' (EXECUTE_MODE)."""
+    mode = os.environ.get("EXECUTE_MODE", "sync").strip().lower()
+    if mode not in ("sync", "async"):
+        log.warning(f"Unknown EXECUTE_MODE '{mode}', using 'sync'.")
+        mode = "sync"
+    return mode
+
+
+def run_delivery_job(payload):
+    """Job handler for async mode: deliver one queued execute request.
+
+    Logs carry the correlation id of the execute request that queued it.
+    The memory reserved when it was queued is released when it finishes.
+    """
+    with log.bound(payload.get("correlation_id") or log.correlation_id() or log.new_correlation_id()), \
+            log.span("delivery_job"):
+        key = get_private_key(payload.get("key_name"))
+        destinations = payload.get("destinations") or [
+            [payload["host"], payload["port"], payload["username"], payload["filename"]] # Queued before fan-out
+        ]
+        try:
+            results = deliver_workbook(
+                payload["request_json"], destinations, key, payload.get("format") or formats.XLSX, payload.get("reservation")
+            )
+        finally:
+            admission.get_budget().release(payload.get("reservation"))
+    log.info("Temp storage usage", **usage_report())
+    failure = delivery_failure(results)
+    if failure:
+        raise DeliveryError(*failure)
+    return {"destinations": results}
+
+
+DELIVERY_JOB = "deliver"
+register_handler(DELIVERY_JOB, run_delivery_job)
+
+
+def parse_port_string(port_str):
+    """
+    Tries to convert a string variable 'port_str' to an integer.
+    Returns the integer if successful.
+    Returns an error message string if it cannot be converted.
+    The general default port for the system (e.g., SSH) is 22,
+    which the caller can use if this function returns an error.
+    """
+    if port_str is None: # Explicit check for None
+        return "Error: Port input is None. Port type must be an integer."
+    try:
+        port_int = int(port_str)
+        # Optional: You might want to add port range validation here (e.g., 1-65535)
+        if not (0 < port_int <= 65535): # Common port range
+            return f"Error: Port number {port_int} is out of valid range (1-65535)."
+        return port_int
+    except ValueError:
+        return f"Error: Port '{port_str}' is not a valid integer."
+    except TypeError: # Should be caught by (port_str is None) or int() if not string-like
+        return f"Error: Port input type is invalid ({type(port_str)}). Port must be a string representing an integer."
+
+
+# https://github.com/looker-open-source/actions/blob/master/docs/action_api.md#action-execute-endpoint
+def action_execute(request):
+    """Handle one execute request, logging it under its own correlation id.
+
+    The id comes from the request headers (see log.new_correlation_id) and
+    is returned in the X-Request-Id response header. An 'action_execute'
+    span records the request's total time, peak memory and response status.
+    """
+    with log.bound(log.new_correlation_id(request)) as correlation_id, log.span("action_execute") as request_span:
+        response = _execute(request)
+        request_span.set(http_status=response.status_code)
+    response.headers["X-Request-Id"] = correlation_id
+    return response
+
+
+def _execute(request):
+    with log.span("auth"):
+        auth = authenticate(request)
+    if auth.status_code != 200:
+        return auth
+        
+    try:
+        try:
+            # Reject bodies that could never be converted here before parsing them.
+            admission.get_budget().check(admission.request_cost(request.content_length))
+        except admission.PayloadTooLarge as e_large:
+            log.error(str(e_large), content_length=request.content_length)
+            return Response(json.dumps({"error": f"The request is too large for this instance. {str(e_large)}", "status": "failure"}), status=413, mimetype='application/json')
+
+        try:
+            with log.span("parse_json") as parse_span:
+                parse_span.add_bytes(request.content_length)
+                request_json = request.get_json()
+            if request_json is None:
+                log.error("Failed to parse request JSON or request body is empty.")
+                # Using json.dumps for error response consistency
+                return Response(json.dumps({"error": "Invalid JSON payload. Request body might be empty or not JSON.", "status": "failure"}), status=400, mimetype='application/json')
+        except Exception as e_json_parse: # Catches Werkzeug BadRequest or other parsing errors
+            log.error(f"Error parsing request JSON: {e_json_parse}")
+            return Response(json.dumps({"error": f"Malformed JSON request: {str(e_json_parse)}", "status": "failure"}), status=400, mimetype='application/json')
+
+        log.debug("Preparing for SFTP operation and file processing...")
+
+        try:
+            # Safely access form_params and its keys
+            form_params = request_json.get("form_params")
+            if form_params is None:
+                raise KeyError("form_params missing from request JSON")
+            
+            host = form_params["host"]
+            username = form_params["username"]
+            filename = form_params["filename"]
+            port_str = form_params.get("port") # Use .get for port_str to handle if it's missing, then parse_port_string handles None
+
+        except KeyError as e_key:
+            param_name = str(e_key).strip("'")
+            log.error(f"Missing required form parameter: {param_name}")
+            return Response(json.dumps({"error": f"Missing form_params: '{param_name}' is required.", "status": "failure"}), status=400, mimetype='application/json')
+        except TypeError as e_type: # If request_json or form_params is not a dict as expected
+            log.error(f"form_params is not structured correctly or request_json is invalid: {e_type}")
+            return Response(json.dumps({"error": f"Invalid form_params structure: {str(e_type)}", "status": "failure"}), status=400, mimetype='application/json')
+
+        port_or_error = parse_port_string(port_str)
+        if isinstance(port_or_error, str) and port_or_error.startswith("Error:"):
+            log.error(f"Invalid port configuration: {port_or_error}")
+            return Response(json.dumps({"error": f"Invalid port: {port_or_error}", "status": "failure"}), status=400, mimetype='application/json')
+        port = port_or_error # Now, port is a validated integer
+
+        key_name = form_params.get("key_name") or None
+        try:
+            # Parsed once per process and cached; see credentials.py
+            key = get_private_key(key_name)
+        except UnknownKeyError:
+            log.error(f"Unknown SSH key name selected in form: {key_name}")
+            return Response(json.dumps({"error": f"Unknown SSH key '{key_name}'.", "status": "failure"}), status=400, mimetype='application/json')
+        except Exception as e_cred:
+            log.error(f"Error loading SSH key '{key_name or 'default'}': {e_cred}")
+            # It's good practice to not expose raw credential errors if they are sensitive.
+            return Response(json.dumps({"error": "Credential configuration error. Check server logs.", "status": "failure"}), status=500, mimetype='application/json')
+
+        log.info(f"SFTP parameters: Host={host}, Username={username}, Port={port}, TargetFilename={filename}")
+
+        try:
+            destinations = unique_destinations(
+                [Destination(host, port, username, filename)] + parse_destinations(form_params.get("destinations"))
+            )
+        except ValueError as e_destinations:
+            log.error(f"Invalid additional destinations: {e_destinations}")
+            return Response(json.dumps({"error": f"Invalid destinations: {str(e_destinations)}", "status": "failure"}), status=400, mimetype='application/json')
+        if len(destinations) > 1:
+            log.info(f"Additional destinations: {destinations[1:]}")
+
+        try:
+            output_format = formats.parse_output_format(form_params.get("format"))
+        except ValueError as e_format:
+            log.error(str(e_format))
+            return Response(json.dumps({"error": str(e_format), "status": "failure"}), status=400, mimetype='application/json')
+
+        if get_execute_mode() == "async":
+            # Acknowledge Looker now; a worker converts and uploads in the background.
+            # The queued request body counts against the memory budget until the job ends.
+            budget = admission.get_budget()
+            try:
+                reservation = budget.reserve(admission.request_cost(request.content_length))
+            except admission.MemoryBudgetExceeded as e_memory:
+                log.error(str(e_memory))
+                return Response(json.dumps({"error": f"This instance is busy with other deliveries. Please retry later. {str(e_memory)}", "status": "failure"}), status=503, mimetype='application/json')
+            payload = {
+                "request_json": request_json, "destinations": [list(destination) for destination in destinations],
+                "key_name": key_name, "format": output_format, "correlation_id": log.correlation_id(),
+                "reservation": reservation,
+            }
+            job_queue = get_job_queue()
+            try:
+                job_id = job_queue.submit(DELIVERY_JOB, payload)
+            except JobQueueFull as e_full:
+                budget.release(reservation)
+                log.error(str(e_full))
+                return Response(json.dumps({"error": f"Delivery queue is full. Please retry later. {str(e_full)}", "status": "failure"}), status=503, mimetype='application/json')
+            except Exception:
+                budget.release(reservation)
+                raise
+            if not job_queue.holds_payloads:
+                budget.release(reservation) # The backend keeps the payload outside this process
+            return Response(json.dumps({"status": "accepted", "job_id": job_id, "message": "Delivery queued."}), status=200, mimetype='application/json')
+
+        log.debug("Starting file conversion process...")
+        
+        try:
+            results = deliver_workbook(request_json, destinations, key, output_format)
+        except DeliveryError as e_delivery:
+            return Response(json.dumps({"error": str(e_delivery), "status": "failure"}), status=e_delivery.status, mimetype='application/json')
+
+        failure = delivery_failure(results)
+        if failure:
+            error_message, status = failure
+            return Response(json.dumps({"error": error_message, "status": "failure", "destinations": results}), status=status, mimetype='application/json')
+
+        log.debug("Execute request details", data=request_json.get('data'), form_params=request_json.get('form_params'))
+
+        log.info("Temp storage usage", **usage_report())
+        log.debug("Action execute handler completed successfully.")
+        if all(result["duplicate"] for result in results):
+            return Response(json.dumps({"status": "success", "message": "Identical delivery already uploaded; nothing was re-sent.", "destinations": results}), status=200, mimetype='application/json')
+        return Response(json.dumps({"status": "success", "message": "File processed and uploaded successfully.", "destinations": results}), status=200, mimetype='application/json')
+
+    except Exception as e_global_handler: # Broad catch-all for any unhandled errors in action_execute
+        log.error(f"Unhandled critical error in action_execute: {e_global_handler}", error_type=type(e_global_handler).__name__)
+        # import traceback
+        # traceback.print_exc() # For detailed server-side debugging
+        
+        # Generic error for the client
+        error_message = f"An unexpected server error occurred. Please contact support. Ref: {type(e_global_handler).__name__}"
+        return Response(json.dumps({"error": error_message, "status": "failure"}), status=500, mimetype='application/json')
+
+
+
+def action_job_status(request):
+    """Return the status of an async delivery job.
+
+    The job id comes from the job_id query parameter or JSON body field,
+    and the request must carry the same token as action_execute.
+    """
+    auth = authenticate(request, methods=('GET', 'POST'))
+    if auth.status_code != 200:
+        return auth
+
+    request_json = request.get_json(silent=True) or {}
+    job_id = request.args.get("job_id") or request_json.get("job_id")
+    if not job_id:
+        return Response(json.dumps({"error": "job_id is required.", "status": "failure"}), status=400, mimetype='application/json')
+
+    job = get_job_queue().status(job_id)
+    if job is None:
+        return Response(json.dumps({"error": f"Unknown job '{job_id}'.", "status": "failure"}), status=404, mimetype='application/json')
+    return Response(json.dumps(job), status=200, mimetype='application/json')
@@ -0,0 +1,172 @@
+import collections
+import concurrent.futures
+import contextlib
+import io
+import re
+import threading
+
+from env import env_int
+import log
+from sftp import upload_file_sftp
+from sftp_pool import upload_coalescer
+
+
+DEFAULT_UPLOAD_CONCURRENCY = 4
+DEFAULT_UPLOADS_PER_HOST = 2
+DEFAULT_SFTP_PORT = 22
+
+# Where one copy of the workbook goes.
+Destination = collections.namedtuple('Destination', ['host', 'port', 'username', 'filename'])
+
+# One line of the 'destinations' form field: username@host[:port] filename
+DESTINATION_LINE = re.compile(r'^(?P<username>[^@\s]+)@(?P<host>[^:\s]+)(?::(?P<port>\d+))?\s+(?P<filename>\S.*)$')
+
+_lock = threading.Lock()
+_host_slots = {} # (host, port) -> BoundedSemaphore
+
+
+def parse_destinations(text):
+    """Parse the 'destinations' form field into Destinations.
+
+    Each non-blank line reads 'username@host[:port] filename', e.g.
+    'partner_a@sftp.example.com:2222 /inbound/sales.xlsx'. Lines starting
+    with '#' are ignored.
+
+    Raises:
+        ValueError: a line is malformed; the message names it.
+    """
+    destinations = []
+    for line_number, line in enumerate((text or "").splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        match = DESTINATION_LINE.match(line)
+        if not match:
+            raise ValueError(f"Destination line {line_number} ('{line}') must look like 'username@host[:port] filename'.")
+        port = int(match.group("port") or DEFAULT_SFTP_PORT)
+        if not 0 < port <= 65535:
+            raise ValueError(f"Destination line {line_number} has port {port}, which is out of range (1-65535).")
+        destinations.append(Destination(match.group("host"), port, match.group("username"), match.group("filename").strip()))
+    return destinations
+
+
+def unique_destinations(destinations):
+    """Drop repeated destinations, keeping the first of each in order."""
+    return list(dict.fromkeys(Destination(*destination) for destination in destinations))
+
+
+def host_slot(host, port):
+    """Semaphore limiting concurrent uploads to one server (DELIVERY_UPLOADS_PER_HOST)."""
+    with _lock:
+        slot = _host_slots.get((host, port))
+        if slot is None:
+            slot = _host_slots[(host, port)] = threading.BoundedSemaphore(
+                env_int("DELIVERY_UPLOADS_PER_HOST", DEFAULT_UPLOADS_PER_HOST)
+            )
+        return slot
+
+
+class SharedReader(io.RawIOBase):
+    """A read cursor of its own over a seekable file shared between threads.
+
+    Lets several uploads read one spooled workbook at once: every read
+    seeks the shared file to this reader's position under a common lock.
+    """
+
+    def __init__(self, shared, lock):
+        self.shared = shared
+        self.lock = lock
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            with self.lock:
+                self.position = self.shared.seek(offset, io.SEEK_END)
+        return self.position
+
+    def read(self, size=-1):
+        with self.lock:
+            self.shared.seek(self.position)
+            data = self.shared.read(size)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def destination_result(destination, **fields):
+    """Build the per-destination entry reported in the execute response."""
+    result = destination._asdict()
+    result.update(fields)
+    return result
+
+
+def upload_to_destinations(local_file, destinations, private_key, local_digest=None):
+    """Upload one workbook to every destination concurrently.
+
+    At most DELIVERY_UPLOAD_CONCURRENCY uploads run at once and at most
+    DELIVERY_UPLOADS_PER_HOST go to any one server; the rest wait their
+    turn. A failed destination does not stop the others.
+
+    Args:
+        local_file: Path or seekable binary file object holding the workbook.
+        local_digest: Optional (size, sha256) of the workbook, to skip rehashing it.
+
+    Returns:
+        A dict mapping each Destination to its result dict, with 'status'
+        'success' or 'failure'. Failures carry 'error', 'retryable' and
+        'attempts'.
+    """
+    shared_lock = threading.Lock()
+
+    def upload(destination):
+        reader = local_file if not hasattr(local_file, "read") else SharedReader(local_file, shared_lock)
+        # Coalesced uploads share one session per batch, so the pool's per-host
+        # session limit applies instead; a slot per upload would cap the batch.
+        slot = contextlib.nullcontext() if upload_coalescer.enabled else host_slot(destination.host, destination.port)
+        with slot:
+            try:
+                upload_result = upload_file_sftp(
+                    destination.host,
+                    destination.port,
+                    destination.username,
+                    reader,
+                    destination.filename,
+                    private_key=private_key,
+                    local_digest=local_digest
+                )
+            except Exception as e_sftp:
+                log.error(f"Error uploading to {destination.username}@{destination.host}:{destination.port} {destination.filename}: {e_sftp}")
+                return destination_result(
+                    destination, status="failure", error=str(e_sftp),
+                    retryable=getattr(e_sftp, "retryable", False), attempts=getattr(e_sftp, "attempts", 1)
+                )
+        return destination_result(
+            destination, status="success", size=upload_result.size, sha256=upload_result.sha256,
+            attempts=upload_result.attempts
+        )
+
+    if len(destinations) == 1:
+        return {destinations[0]: upload(destinations[0])}
+
+    workers = min(len(destinations), env_int("DELIVERY_UPLOAD_CONCURRENCY", DEFAULT_UPLOAD_CONCURRENCY))
+    log.info(f"Uploading to {len(destinations)} destinations, {workers} at a time.")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fanout") as executor:
+        futures = {destination: executor.submit(log.propagate(upload), destination) for destination in destinations}
+    return {destination: future.result() for destination, future in futures.items()}
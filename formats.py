@@ -0,0 +1,207 @@
+import collections
+import contextlib
+import gzip
+import importlib.util
+import os
+import shutil
+import struct
+import zipfile
+
+from env import env_int
+import log
+
+
+# Output formats a schedule can pick in the action form.
+XLSX = "xlsx"
+CSV_ZIP = "csv_zip"
+CSV_GZ = "csv_gz"
+PARQUET = "parquet"
+
+FORMAT_LABELS = {
+    XLSX: "Excel workbook, one sheet per tile (.xlsx)",
+    CSV_ZIP: "Looker's CSV zip, unchanged (.zip)",
+    CSV_GZ: "Gzipped CSV per tile (.csv.gz)",
+    PARQUET: "Parquet file per tile (.parquet)",
+}
+
+DEFAULT_CSV_GZIP_LEVEL = 6
+DEFAULT_PARQUET_COMPRESSION = "zstd"
+
+# Zip local file header: signature, versions, flags, method, time, date,
+# crc, sizes, then the file name and extra field lengths.
+ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+ZIP_LOCAL_HEADER_SIGNATURE = b"PK\003\004"
+# gzip header: magic, deflate, no flags, no mtime, no extra flags, unknown OS.
+GZIP_HEADER = b"\037\213\010\000\000\000\000\000\000\377"
+
+# A file to upload. source is a path or seekable binary file object; the
+# destination's file name has its extension replaced by suffix, or is
+# kept as it is when suffix is None; digest is (size, sha256) when known.
+OutputFile = collections.namedtuple('OutputFile', ['source', 'suffix', 'digest'], defaults=[None])
+
+
+def available_formats():
+    """Return the output formats this deployment can produce, default first."""
+    formats = [XLSX, CSV_ZIP, CSV_GZ]
+    if importlib.util.find_spec("pyarrow") is not None:
+        formats.append(PARQUET)
+    return formats
+
+
+def parse_output_format(value):
+    """Validate the 'format' form parameter; empty means xlsx.
+
+    Raises:
+        ValueError: the format is unknown or needs a package that is not installed.
+    """
+    output_format = (value or XLSX).strip().lower()
+    if output_format not in FORMAT_LABELS:
+        raise ValueError(f"Unknown format '{value}'. Choose one of: {', '.join(FORMAT_LABELS)}.")
+    if output_format not in available_formats():
+        raise ValueError(f"Format '{output_format}' needs the pyarrow package, which is not installed.")
+    return output_format
+
+
+def filename_stem(filename):
+    """Strip a file name's extension, treating e.g. '.csv.gz' as one."""
+    stem, extension = os.path.splitext(filename)
+    if extension.lower() == ".gz":
+        stem = os.path.splitext(stem)[0]
+    return stem
+
+
+def remote_filename(filename, suffix):
+    """Return the remote name of an OutputFile with suffix for a destination file name."""
+    return filename if suffix is None else filename_stem(filename) + suffix
+
+
+def get_gzip_level():
+    """Compression level for tiles that have to be recompressed (CSV_GZIP_LEVEL, 1-9)."""
+    return env_int("CSV_GZIP_LEVEL", DEFAULT_CSV_GZIP_LEVEL, maximum=9)
+
+
+def get_parquet_compression():
+    """Parquet column compression codec (PARQUET_COMPRESSION), e.g. zstd, snappy, gzip or none."""
+    return os.environ.get("PARQUET_COMPRESSION", DEFAULT_PARQUET_COMPRESSION).strip().lower()
+
+
+def copy_deflated_member(zip_ref, info, output, chunk_bytes=1024 * 1024):
+    """Write a deflated zip member to output as a gzip file, without recompressing it.
+
+    A zip member's deflate stream is exactly what gzip wraps, and the zip
+    directory already records its CRC-32 and size, so only the framing
+    changes. Returns False, writing nothing, for members that are not
+    plainly deflated (stored or encrypted).
+    """
+    if info.compress_type != zipfile.ZIP_DEFLATED or info.flag_bits & 0x1:
+        return False
+    zip_file = zip_ref.fp
+    zip_file.seek(info.header_offset)
+    header = ZIP_LOCAL_HEADER.unpack(zip_file.read(ZIP_LOCAL_HEADER.size))
+    if header[0] != ZIP_LOCAL_HEADER_SIGNATURE:
+        return False
+    zip_file.seek(header[-2] + header[-1], os.SEEK_CUR) # File name and extra field
+    output.write(GZIP_HEADER)
+    remaining = info.compress_size
+    while remaining:
+        chunk = zip_file.read(min(chunk_bytes, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Member {info.filename} is truncated.")
+        output.write(chunk)
+        remaining -= len(chunk)
+    output.write(struct.pack("<2L", info.CRC, info.file_size & 0xFFFFFFFF))
+    return True
+
+
+def gzip_csv(zip_ref, info, source, path, level=None):
+    """Write one tile to path as gzipped CSV, re-framing its deflate stream when possible."""
+    with open(path, 'wb') as output:
+        if copy_deflated_member(zip_ref, info, output):
+            return
+        output.seek(0)
+        output.truncate()
+        log.info(f"Recompressing {source.name} (level {level or get_gzip_level()}).")
+        with source.open() as raw_stream, gzip.GzipFile(
+            filename=os.path.basename(source.name), mode='wb', compresslevel=level or get_gzip_level(),
+            fileobj=output, mtime=0
+        ) as gzip_file:
+            shutil.copyfileobj(raw_stream, gzip_file, 1024 * 1024)
+
+
+def write_parquet(source, path, column_typing, compression=None):
+    """Stream one tile into a Parquet file, batch by batch.
+
+    Columns are typed as in the pyarrow conversion engine: by
+    column_typing, or from a sample of the tile. If a number column turns
+    out to hold text, the tile is written again with every column as text.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    from convert import arrow_convert_options, peek_csv
+    from schema import STRING, sniff_column_kinds
+
+    compression = compression or get_parquet_compression()
+    header, sample = peek_csv(source, column_typing.sniff_rows)
+    if header is None:
+        pq.write_table(pa.table({}), path)
+        return
+
+    def write(kinds):
+        with source.open() as raw_stream, contextlib.closing(
+            pa_csv.open_csv(raw_stream, convert_options=arrow_convert_options(header, kinds))
+        ) as reader, pq.ParquetWriter(path, reader.schema, compression=compression) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+
+    kinds = column_typing.column_kinds(source.name, header, sample) or sniff_column_kinds(len(header), sample)
+    try:
+        write(kinds)
+    except pa.ArrowInvalid as e_typed:
+        log.warning(f"Typed parse of {source.name} failed ({e_typed}). Writing every column as text.")
+        column_typing.forget(source.name, header)
+        write([STRING] * len(header))
+
+
+def convert_to_format(output_format, attachment_stream, out_dir, column_typing, check_space=None):
+    """Turn a csv_zip attachment into OutputFiles of a format other than xlsx.
+
+    csv_zip uploads the attachment as it is. csv_gz and parquet write one
+    file per tile to out_dir, in sheet order (see order_csv_sources). A
+    single tile is named after the destination file; several are
+    suffixed with their tile names, e.g. sales_Revenue.csv.gz. check_space,
+    e.g. Workspace.check_quota, is called before each file is written.
+    """
+    if output_format == CSV_ZIP:
+        attachment_stream.seek(0)
+        return [OutputFile(attachment_stream, ".zip")]
+
+    from convert import csv_sources_from_zip, order_csv_sources, sanitize_sheet_name, unique_sheet_name
+
+    extension = ".csv.gz" if output_format == CSV_GZ else ".parquet"
+    outputs = []
+    attachment_stream.seek(0)
+    with zipfile.ZipFile(attachment_stream, 'r') as zip_ref:
+        with log.span("extract") as extract_span:
+            csv_sources = order_csv_sources(csv_sources_from_zip(zip_ref))
+            if not csv_sources:
+                raise FileNotFoundError(f"No CSV files found in the attachment archive. Members: {zip_ref.namelist()}")
+            extract_span.set(tiles=len(csv_sources))
+            extract_span.add_bytes(sum(source.size or 0 for source in csv_sources))
+        used_names = set()
+        for position, source in enumerate(csv_sources, start=1):
+            tile_name = unique_sheet_name(sanitize_sheet_name(os.path.basename(source.name), position), used_names)
+            path = os.path.join(out_dir, tile_name + extension)
+            if check_space is not None:
+                check_space()
+            log.debug(f"Writing {source.name} as {os.path.basename(path)}")
+            with log.span("write_file", tile=source.name, format=output_format) as file_span:
+                file_span.add_bytes(source.size)
+                if output_format == CSV_GZ:
+                    gzip_csv(zip_ref, zip_ref.getinfo(source.name), source, path)
+                else:
+                    write_parquet(source, path, column_typing)
+                file_span.set(output_bytes=os.path.getsize(path))
+            outputs.append(OutputFile(path, extension if len(csv_sources) == 1 else f"_{tile_name}{extension}"))
+    return outputs
@@ -0,0 +1,97 @@
+# action_list and action_form. Looker calls these synchronously while the
+# user waits, so keep this module's imports light; both responses are built
+# once per process.
+import functools
+import json
+import os
+
+from flask import Response
+
+from credentials import list_key_names
+from formats import FORMAT_LABELS, XLSX, available_formats
+from icon import icon_data_uri
+import log
+
+
+@functools.lru_cache(maxsize=None)
+def form_response_body():
+    """Return the action_form JSON, built on first use."""
+    response = [
+        {"name": "filename", "label": "filename", "type": "string", "required":True},
+        {"name": "host", "label": "host", "type": "string", "required":True},
+        {"name": "username", "label": "username", "type": "string", "required": True},
+        {"name": "port", "label": "port", "type": "string" , "required": True},
+        {"name": "destinations", "label": "additional destinations", "type": "textarea", "required": False,
+         "description": "Also upload the workbook here, one per line: username@host[:port] /path/filename"}
+      ]
+
+    response.append({
+        "name": "format", "label": "format", "type": "select", "required": False, "default": XLSX,
+        "options": [{"name": name, "label": FORMAT_LABELS[name]} for name in available_formats()]
+    })
+
+    key_names = list_key_names()
+    if len(key_names) > 1:
+        response.append({
+            "name": "key_name", "label": "SSH key", "type": "select", "required": False,
+            "default": key_names[0],
+            "options": [{"name": name, "label": name} for name in key_names]
+        })
+
+    return json.dumps(response)
+
+
+@functools.lru_cache(maxsize=None)
+def list_response_body():
+    """Return the action_list JSON, built on first use.
+
+    ACTION_BASE_URL (e.g. https://sftp-action.example.com) points Looker at
+    a standalone server (server.py); otherwise the Cloud Functions URLs are
+    built from PROJECT_NUMBER and REGION.
+    """
+    base_url = os.environ.get("ACTION_BASE_URL", "").strip().rstrip("/")
+    if base_url:
+        form_url = f"{base_url}/action_form"
+        execute_url = f"{base_url}/action_execute"
+    else:
+        project_number = os.environ.get("PROJECT_NUMBER")
+        region = os.environ.get("REGION")
+        form_url = f"https://actionform-{project_number}.{region}.run.app/action_form"
+        execute_url = f"https://actionexecute-{project_number}.{region}.run.app/action_execute"
+    log.info(f"form url: {form_url}")
+    log.info(f"execute url: {execute_url}")
+    response = {
+        'label': 'Secure SFTP',
+        'integrations': [{
+            'name': 'SecureSFTP',
+            'label': 'SecureSFTP',
+            "icon_data_uri": icon_data_uri,
+            'form_url': form_url,
+            'url': execute_url,
+            'supported_action_types': ['dashboard'],
+            'supported_download_settings': ['url'],
+            'supported_formats': ['csv_zip'],
+            'supported_formattings': ['unformatted']
+        }]
+    }
+    return json.dumps(response)
+
+
+# https://github.com/looker-open-source/actions/blob/master/docs/action_api.md#action-form-endpoint
+def action_form(request):
+    """Return form endpoint data for action"""
+
+    request_json = request.get_json()
+    form_params = request_json['form_params']
+    log.debug("action_form request", form_params=form_params)
+
+    body = form_response_body()
+    log.debug('returning form json', bytes=len(body))
+    return Response(body, status=200, mimetype='application/json')
+
+
+def action_list(request):
+    """Return action hub list endpoint data for action"""
+    body = list_response_body()
+    log.debug('returning integrations json')
+    return Response(body, status=200, mimetype='application/json')
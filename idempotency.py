@@ -0,0 +1,154 @@
+import contextlib
+import hashlib
+import json
+import threading
+import time
+
+import cachetools
+
+from env import env_flag, env_int
+import log
+from schema import dashboard_key
+
+
+DEFAULT_IDEMPOTENCY_TTL_SECONDS = 600
+DEFAULT_IDEMPOTENCY_WAIT_SECONDS = 540
+DEFAULT_IDEMPOTENCY_CACHE_SIZE = 1024
+
+# Written next to the workbook in IDEMPOTENCY_REMOTE_DIGEST mode; holds the
+# delivery key of the upload that produced it.
+REMOTE_DIGEST_SUFFIX = ".looker.sha256"
+
+_lock = threading.Lock()
+_ledger = None
+
+
+class DeliveryInProgress(RuntimeError):
+    """Raised when an identical delivery is still running after the wait limit."""
+
+
+def is_enabled():
+    """Whether identical deliveries are deduplicated (IDEMPOTENCY, on by default)."""
+    return env_flag("IDEMPOTENCY", True)
+
+
+def remote_digest_enabled():
+    """Whether the remote digest file is checked and written (IDEMPOTENCY_REMOTE_DIGEST)."""
+    return env_flag("IDEMPOTENCY_REMOTE_DIGEST", False)
+
+
+def stream_digest(stream, chunk_bytes=1024 * 1024):
+    """Return the sha256 hex digest of a seekable binary stream and rewind it."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_bytes), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def delivery_key(request_json, destination, attachment_digest):
+    """Key a delivery on its scheduled plan, destination and attachment contents.
+
+    destination is a JSON-serialisable description of where the file goes,
+    e.g. [host, port, username, filename].
+    """
+    identity = json.dumps([dashboard_key(request_json) or "", list(destination), attachment_digest])
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+class Claim:
+    """One caller's hold on a delivery key; see DeliveryLedger.claim."""
+
+    def __init__(self, key, result=None):
+        self.key = key
+        self.result = result
+        self.cached = result is not None
+
+
+class DeliveryLedger:
+    """Tracks deliveries running in this process and the results of recent ones.
+
+    Finished results are kept for ttl seconds. Only successes are recorded,
+    so a retry of a failed delivery runs again.
+    """
+
+    def __init__(self, ttl=None, maxsize=None, wait=None):
+        self.ttl = ttl or env_int("IDEMPOTENCY_TTL_SECONDS", DEFAULT_IDEMPOTENCY_TTL_SECONDS)
+        self.wait = wait if wait is not None else env_int("IDEMPOTENCY_WAIT_SECONDS", DEFAULT_IDEMPOTENCY_WAIT_SECONDS, minimum=0)
+        self._results = cachetools.TTLCache(
+            maxsize=maxsize or env_int("IDEMPOTENCY_CACHE_SIZE", DEFAULT_IDEMPOTENCY_CACHE_SIZE), ttl=self.ttl
+        )
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def claim(self, key):
+        """Yield a Claim on key once no identical delivery is running.
+
+        If a recent delivery with this key succeeded, claim.cached is True
+        and claim.result holds its result. Otherwise the caller runs the
+        delivery and sets claim.result on success. Identical deliveries
+        that arrive meanwhile wait for this one.
+
+        Raises:
+            DeliveryInProgress: the running delivery did not finish within the wait limit.
+        """
+        deadline = time.monotonic() + self.wait
+        while True:
+            with self._lock:
+                result = self._results.get(key)
+                event = None if result is not None else self._in_flight.get(key)
+                if result is None and event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    break
+            if result is not None:
+                log.info(f"Delivery {key[:12]} already succeeded; returning its result.")
+                yield Claim(key, result)
+                return
+            log.info(f"Delivery {key[:12]} is already running; waiting for it to finish.")
+            if not event.wait(max(0.0, deadline - time.monotonic())):
+                raise DeliveryInProgress(f"An identical delivery is still running after {self.wait}s.")
+
+        claim = Claim(key)
+        try:
+            yield claim
+        finally:
+            with self._lock:
+                if claim.result is not None:
+                    self._results[key] = claim.result
+                del self._in_flight[key]
+            event.set()
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._in_flight), "cached_results": len(self._results)}
+
+
+def get_ledger():
+    """Return this process's DeliveryLedger, creating it on first use."""
+    global _ledger
+    with _lock:
+        if _ledger is None:
+            _ledger = DeliveryLedger()
+        return _ledger
+
+
+def remote_digest_path(remote_file_path):
+    return remote_file_path + REMOTE_DIGEST_SUFFIX
+
+
+def remote_has_delivery(sftp_client, remote_file_path, key):
+    """True if remote_file_path exists and its digest file records key."""
+    try:
+        sftp_client.stat(remote_file_path)
+        with sftp_client.open(remote_digest_path(remote_file_path), 'r') as digest_file:
+            return digest_file.read(256).decode("ascii", "replace").strip() == key
+    except IOError: # Either file is missing
+        return False
+
+
+def record_remote_delivery(sftp_client, remote_file_path, key):
+    """Write key to the digest file next to remote_file_path."""
+    with sftp_client.open(remote_digest_path(remote_file_path), 'w') as digest_file:
+        digest_file.write(f"{key}\n".encode("ascii"))
@@ -0,0 +1,186 @@
+import abc
+import concurrent.futures
+import importlib
+import os
+import threading
+import time
+import uuid
+
+from env import env_int
+import log
+
+
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_JOB_QUEUE_MAX = 16
+DEFAULT_JOB_RETENTION_SECONDS = 3600
+
+# Job states, in order.
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_handlers = {}
+_queue = None
+_queue_lock = threading.Lock()
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+def register_handler(kind, handler):
+    """Register handler(payload) as the worker for jobs of the given kind."""
+    _handlers[kind] = handler
+
+
+def run_job(kind, payload):
+    """Run one job synchronously. Durable backends call this from their worker."""
+    try:
+        handler = _handlers[kind]
+    except KeyError:
+        raise ValueError(f"No handler registered for job kind '{kind}'.") from None
+    return handler(payload)
+
+
+class JobQueue(abc.ABC):
+    """Interface for job queue backends.
+
+    A job is a kind (see register_handler) plus a JSON-serialisable payload,
+    so a durable backend can persist it and run it elsewhere via run_job.
+    holds_payloads is True for backends that keep queued payloads in this
+    process's memory until the job runs.
+    """
+
+    holds_payloads = False
+
+    @abc.abstractmethod
+    def submit(self, kind, payload):
+        """Queue a job and return its id. Raise JobQueueFull when at capacity."""
+
+    @abc.abstractmethod
+    def status(self, job_id):
+        """Return a dict describing the job, or None if it is unknown."""
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs; with wait, block until queued jobs finish."""
+
+
+class LocalJobQueue(JobQueue):
+    """In-process backend: a bounded thread pool plus an in-memory job table.
+
+    At most max_workers jobs run at once and at most max_pending wait
+    behind them. Finished jobs are kept for retention seconds so their
+    status can be looked up. Jobs are lost if the process exits.
+    """
+
+    holds_payloads = True
+
+    def __init__(self, max_workers=None, max_pending=None, retention=None):
+        self.max_workers = max_workers or env_int("JOB_WORKERS", DEFAULT_JOB_WORKERS)
+        self.max_pending = max_pending if max_pending is not None else env_int("JOB_QUEUE_MAX", DEFAULT_JOB_QUEUE_MAX, minimum=0)
+        self.retention = retention if retention is not None else env_int("JOB_RETENTION_SECONDS", DEFAULT_JOB_RETENTION_SECONDS, minimum=0)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="delivery-job"
+        )
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def _prune(self, now):
+        """Forget finished jobs past their retention. Caller holds the lock."""
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None and now - job["finished_at"] > self.retention
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, kind, payload):
+        if kind not in _handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'.")
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull(
+                f"Job queue is full ({self.max_workers} running, {self.max_pending} waiting)."
+            )
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._jobs[job_id] = {
+                "job_id": job_id, "kind": kind, "status": QUEUED, "error": None, "result": None,
+                "submitted_at": now, "started_at": None, "finished_at": None,
+            }
+        try:
+            self._executor.submit(log.propagate(self._run), job_id, kind, payload)
+        except RuntimeError:
+            # Executor is shutting down.
+            self._slots.release()
+            with self._lock:
+                del self._jobs[job_id]
+            raise JobQueueFull("Job queue is shutting down.")
+        log.info(f"Queued {kind} job {job_id}.")
+        return job_id
+
+    def _run(self, job_id, kind, payload):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = RUNNING
+            job["started_at"] = time.time()
+        log.info(f"Running {kind} job {job_id}.")
+        try:
+            result = run_job(kind, payload)
+            status, error = SUCCEEDED, None
+        except Exception as e:
+            log.error(f"Job {job_id} failed: {e}")
+            result, status, error = None, FAILED, str(e)
+        finally:
+            self._slots.release()
+        with self._lock:
+            job.update(status=status, error=error, result=result, finished_at=time.time())
+        log.info(f"Job {job_id} {status} after {job['finished_at'] - job['started_at']:.2f}s.")
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def counts(self):
+        """Return the number of tracked jobs in each state."""
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def get_job_queue():
+    """Return this process's job queue, creating it on first use.
+
+    JOB_QUEUE_BACKEND selects the backend: 'local' (default) or a
+    'module:ClassName' path to a JobQueue subclass, e.g. one backed by
+    Cloud Tasks or Pub/Sub.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            backend = os.environ.get("JOB_QUEUE_BACKEND", "local").strip()
+            if backend == "local":
+                _queue = LocalJobQueue()
+            else:
+                module_name, _, class_name = backend.partition(":")
+                _queue = getattr(importlib.import_module(module_name), class_name)()
+            log.info(f"Job queue backend: {type(_queue).__name__}")
+        return _queue
+
+
+def shutdown_job_queue(wait=True):
+    """Stop this process's job queue, if one was created, waiting for running and queued jobs."""
+    global _queue
+    with _queue_lock:
+        queue, _queue = _queue, None
+    if queue is not None:
+        queue.shutdown(wait=wait)
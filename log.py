@@ -0,0 +1,188 @@
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+
+# Severity names Cloud Logging understands, lowest first.
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 40, "ERROR": 50}
+DEFAULT_LOG_LEVEL = "INFO"
+
+_correlation_id = contextvars.ContextVar("correlation_id", default=None)
+_write_lock = threading.Lock()
+_threshold = None
+
+
+def _level_threshold():
+    """Lowest severity written (LOG_LEVEL: DEBUG, INFO, WARNING or ERROR); read once."""
+    global _threshold
+    if _threshold is None:
+        name = os.environ.get("LOG_LEVEL", DEFAULT_LOG_LEVEL).strip().upper()
+        if name not in LEVELS:
+            _threshold = LEVELS[DEFAULT_LOG_LEVEL]
+            warning(f"Unknown LOG_LEVEL '{name}', using '{DEFAULT_LOG_LEVEL}'.")
+        else:
+            _threshold = LEVELS[name]
+    return _threshold
+
+
+def set_level(name):
+    """Change the lowest severity written, e.g. from a test or a local run."""
+    global _threshold
+    _threshold = LEVELS[name.upper()]
+
+
+def is_enabled(level):
+    return LEVELS[level] >= _level_threshold()
+
+
+def debug_enabled():
+    """Guard for debug output that is costly to build (directory listings, payload dumps)."""
+    return LEVELS["DEBUG"] >= _level_threshold()
+
+
+def _json_default(value):
+    return str(value)
+
+
+def emit(level, message, **fields):
+    """Write one log event to stdout as a JSON line, if level is enabled.
+
+    Cloud Functions turns each line into a structured log entry: severity
+    and message are shown as usual, the other fields are searchable, e.g.
+    jsonPayload.correlation_id.
+    """
+    if LEVELS[level] < _level_threshold():
+        return
+    entry = {"severity": level, "message": message}
+    correlation_id = _correlation_id.get()
+    if correlation_id:
+        entry["correlation_id"] = correlation_id
+    entry.update(fields)
+    line = json.dumps(entry, default=_json_default)
+    with _write_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+def debug(message, **fields):
+    emit("DEBUG", message, **fields)
+
+
+def info(message, **fields):
+    emit("INFO", message, **fields)
+
+
+def warning(message, **fields):
+    emit("WARNING", message, **fields)
+
+
+def error(message, **fields):
+    emit("ERROR", message, **fields)
+
+
+def correlation_id():
+    """The id of the request or job being handled on this thread, or None."""
+    return _correlation_id.get()
+
+
+def new_correlation_id(request=None):
+    """Pick a correlation id for an incoming request.
+
+    An X-Request-Id header is used as it is; otherwise the trace id of
+    X-Cloud-Trace-Context, so log lines match the request's trace. Failing
+    both, a random id.
+    """
+    headers = getattr(request, "headers", None) or {}
+    request_id = headers.get("X-Request-Id")
+    if request_id:
+        return request_id[:64]
+    trace = headers.get("X-Cloud-Trace-Context")
+    if trace:
+        return trace.split("/", 1)[0][:64]
+    return uuid.uuid4().hex[:16]
+
+
+@contextlib.contextmanager
+def bound(correlation_id):
+    """Tag every log event written in this block with correlation_id."""
+    token = _correlation_id.set(correlation_id)
+    try:
+        yield correlation_id
+    finally:
+        _correlation_id.reset(token)
+
+
+def propagate(function):
+    """Wrap function to run with the caller's correlation id, e.g. in a worker thread."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(function, *args, **kwargs)
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None where unavailable."""
+    try:
+        import resource
+    except ImportError: # Not on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Span:
+    """A timed stage of a request; see span()."""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.bytes = None
+
+    def add_bytes(self, count):
+        """Count bytes processed by this stage."""
+        if count is not None:
+            self.bytes = (self.bytes or 0) + count
+
+    def set(self, **fields):
+        """Add fields to the event written when the stage ends."""
+        self.fields.update(fields)
+
+
+@contextlib.contextmanager
+def span(name, level="INFO", **fields):
+    """Time a stage and log one event for it when it ends.
+
+    The event carries duration_ms, bytes (when the stage counted any with
+    span.add_bytes), and the process's peak RSS with how much it rose
+    during the stage. Peak RSS is process-wide, so stages of concurrent
+    requests share it. A stage that raises is logged at ERROR with the
+    exception type, and the exception propagates.
+    """
+    current = Span(name, fields)
+    peak_before = peak_rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        _end_span(current, "ERROR", start, peak_before, status="failure", error=type(e).__name__)
+        raise
+    _end_span(current, level, start, peak_before, status="success")
+
+
+def _end_span(current, level, start, peak_before, **outcome):
+    if LEVELS[level] < _level_threshold():
+        return
+    duration_ms = round((time.perf_counter() - start) * 1000, 1)
+    event = {"span": current.name, "duration_ms": duration_ms}
+    if current.bytes is not None:
+        event["bytes"] = current.bytes
+    peak_after = peak_rss_bytes()
+    if peak_after is not None:
+        event["peak_rss_mb"] = round(peak_after / 1048576, 1)
+        event["peak_rss_growth_mb"] = round((peak_after - peak_before) / 1048576, 1)
+    event.update(outcome)
+    event.update(current.fields)
+    emit(level, f"{current.name} took {duration_ms} ms", **event)
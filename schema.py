@@ -0,0 +1,184 @@
+import math
+import os
+import threading
+
+import cachetools
+
+from env import env_int
+import log
+
+
+# Column kinds. Number columns are written as numeric cells, everything
+# else as text.
+NUMBER = "number"
+STRING = "string"
+
+DEFAULT_SNIFF_ROWS = 100
+DEFAULT_SCHEMA_CACHE_SIZE = 1024
+DEFAULT_SCHEMA_CACHE_TTL_SECONDS = 24 * 3600
+
+# Looker field types whose values are numbers, for metadata without is_numeric.
+LOOKER_NUMERIC_TYPES = {
+    "number", "count", "count_distinct", "sum", "sum_distinct", "average",
+    "average_distinct", "min", "max", "median", "median_distinct",
+    "percentile", "percentile_distinct", "percent_of_total",
+    "percent_of_previous", "running_total", "int",
+}
+
+_lock = threading.Lock()
+_cache = None
+
+
+def get_ingest_mode():
+    """Return how CSV cell types are decided (CONVERSION_TYPES).
+
+    'infer' (default): each cell that looks like a number is stored as one.
+    'schema': each column is typed once, from Looker field metadata or a
+        sample of its rows, and the result is cached per dashboard tile.
+    'raw': every cell is stored as text, exactly as it appears in the CSV.
+    """
+    mode = os.environ.get("CONVERSION_TYPES", "infer").strip().lower()
+    if mode not in ("infer", "schema", "raw"):
+        log.warning(f"Unknown CONVERSION_TYPES '{mode}', using 'infer'.")
+        mode = "infer"
+    return mode
+
+
+def _schema_cache():
+    global _cache
+    if _cache is None:
+        _cache = cachetools.TTLCache(
+            maxsize=env_int("CONVERSION_SCHEMA_CACHE_SIZE", DEFAULT_SCHEMA_CACHE_SIZE, minimum=0),
+            ttl=env_int("CONVERSION_SCHEMA_CACHE_TTL_SECONDS", DEFAULT_SCHEMA_CACHE_TTL_SECONDS, minimum=0),
+        )
+    return _cache
+
+
+def _looker_fields(request_json):
+    """Yield the field dicts of any Looker field metadata in the request."""
+    candidates = []
+    data = request_json.get("data")
+    if isinstance(data, dict):
+        candidates.append(data.get("fields"))
+    scheduled_plan = request_json.get("scheduled_plan")
+    if isinstance(scheduled_plan, dict) and isinstance(scheduled_plan.get("query"), dict):
+        candidates.append(scheduled_plan["query"].get("fields"))
+    for fields in candidates:
+        # json_detail style: {"dimensions": [...], "measures": [...], ...}
+        if isinstance(fields, dict):
+            for group in fields.values():
+                if isinstance(group, list):
+                    yield from (field for field in group if isinstance(field, dict))
+        elif isinstance(fields, list):
+            yield from (field for field in fields if isinstance(field, dict))
+
+
+def field_kinds_from_metadata(request_json):
+    """Map CSV column headers to kinds using Looker field metadata in the request.
+
+    Looker names CSV columns after a field's label, short label or name
+    depending on the export settings, so all three are mapped. Requests
+    without field metadata (plain fields lists, or none at all) give {}.
+    """
+    kinds = {}
+    try:
+        for field in _looker_fields(request_json):
+            if "is_numeric" in field:
+                kind = NUMBER if field["is_numeric"] else STRING
+            else:
+                kind = NUMBER if field.get("type") in LOOKER_NUMERIC_TYPES else STRING
+            for key in ("label", "label_short", "name"):
+                if field.get(key):
+                    kinds[field[key]] = kind
+    except AttributeError: # request_json is not a dictionary
+        return {}
+    return kinds
+
+
+def is_number_text(value):
+    """True if value would be stored as a number, keeping codes like '007' as text."""
+    try:
+        number = float(value)
+    except ValueError:
+        return False
+    if not math.isfinite(number):
+        return False
+    digits = value.lstrip("+-")
+    return not (len(digits) > 1 and digits[0] == "0" and digits[1].isdigit())
+
+
+def sniff_column_kinds(width, sample_rows):
+    """Guess the kind of each of width columns from sample_rows.
+
+    A column is a number column when every non-empty sampled value is a
+    number; columns with no values in the sample are text.
+    """
+    kinds = []
+    for col_index in range(width):
+        values = [row[col_index] for row in sample_rows if col_index < len(row) and row[col_index]]
+        kinds.append(NUMBER if values and all(is_number_text(value) for value in values) else STRING)
+    return kinds
+
+
+def get_sniff_rows():
+    """Rows sampled per tile when a column's kind has to be guessed (CONVERSION_SNIFF_ROWS)."""
+    return env_int("CONVERSION_SNIFF_ROWS", DEFAULT_SNIFF_ROWS)
+
+
+def dashboard_key(request_json):
+    """Identify the scheduled dashboard or Look a request belongs to, or None."""
+    try:
+        scheduled_plan = request_json.get("scheduled_plan") or {}
+        for key in ("scheduled_plan_id", "url", "query_id", "title"):
+            if scheduled_plan.get(key):
+                return f"{key}:{scheduled_plan[key]}"
+    except AttributeError:
+        pass
+    return None
+
+
+class ColumnTyping:
+    """Decides the kind of every column in a request's CSV tiles."""
+
+    def __init__(self, mode=None, field_kinds=None, scope=None):
+        self.mode = mode or get_ingest_mode()
+        self.field_kinds = field_kinds or {}
+        self.scope = scope # Cache namespace; None disables the cache
+        self.sniff_rows = get_sniff_rows()
+
+    @classmethod
+    def for_request(cls, request_json, mode=None):
+        mode = mode or get_ingest_mode()
+        if mode != "schema":
+            return cls(mode)
+        field_kinds = field_kinds_from_metadata(request_json)
+        if field_kinds:
+            log.info(f"Typing columns from Looker metadata for {len(field_kinds)} field name(s).")
+        return cls(mode, field_kinds, dashboard_key(request_json))
+
+    def column_kinds(self, tile_name, header, sample_rows=()):
+        """Return one kind per header column, or None to let the writer infer each cell."""
+        if self.mode == "infer" or header is None:
+            return None
+        if self.mode == "raw":
+            return [STRING] * len(header)
+
+        cache_key = (self.scope, tile_name, tuple(header)) if self.scope else None
+        if cache_key:
+            with _lock:
+                kinds = _schema_cache().get(cache_key)
+            if kinds is not None:
+                return list(kinds)
+
+        sniffed = sniff_column_kinds(len(header), sample_rows)
+        kinds = [self.field_kinds.get(column, guess) for column, guess in zip(header, sniffed)]
+        if cache_key:
+            with _lock:
+                _schema_cache()[cache_key] = tuple(kinds)
+        return kinds
+
+    def forget(self, tile_name, header):
+        """Drop a tile's cached kinds, e.g. after its data stopped matching them."""
+        if self.scope and header is not None:
+            with _lock:
+                _schema_cache().pop((self.scope, tile_name, tuple(header)), None)
@@ -0,0 +1,186 @@
+"""Standalone server for self-hosted deployments (a VM, a container, Kubernetes).
+
+Serves action_list, action_form, action_execute and action_job_status from
+one long-running process instead of one Cloud Function each:
+
+    ACTION_BASE_URL=https://sftp-action.example.com python server.py
+
+Requests are handled by a bounded pool of SERVER_THREADS threads, while
+conversions are limited separately to CONVERSION_CONCURRENCY at a time
+(see convert.conversion_slot) and uploads to DELIVERY_UPLOADS_PER_HOST per
+SFTP server (see fanout.host_slot). Private keys, pooled SSH sessions and
+the built hub responses are module singletons, so every request shares
+them. On SIGTERM or SIGINT the server stops accepting connections, lets the
+requests in progress finish for up to SERVER_DRAIN_SECONDS, waits for
+queued async jobs and closes the pooled SSH sessions.
+"""
+import concurrent.futures
+import importlib
+import json
+import os
+import signal
+import threading
+import time
+import traceback
+
+from flask import Flask, Response, request
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from env import env_int
+import jobs
+import log
+import main
+from sftp_pool import connection_pool
+
+
+DEFAULT_SERVER_HOST = "0.0.0.0"
+DEFAULT_SERVER_PORT = 8080
+DEFAULT_SERVER_THREADS = 8
+DEFAULT_SERVER_DRAIN_SECONDS = 30
+
+# URL path -> entry point; Looker is given the action_list URL as the hub.
+ROUTES = {
+    "/": main.action_list,
+    "/action_list": main.action_list,
+    "/action_form": main.action_form,
+    "/action_execute": main.action_execute,
+    "/action_job_status": main.action_job_status,
+}
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Writes werkzeug's access and error lines through log instead of stderr."""
+
+    # One request per connection: an idle keep-alive connection would hold
+    # a request thread, and delay draining, until the client closed it.
+    protocol_version = "HTTP/1.0"
+
+    def log_request(self, code="-", size="-"):
+        log.debug(f"{self.requestline} {code}", client=self.address_string(), status_code=code, bytes=size)
+
+    def log(self, type, message, *args):
+        log.emit("ERROR" if type == "error" else "DEBUG", message % args, client=self.address_string())
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """A WSGI server handling at most `threads` requests at once.
+
+    Connections beyond that wait in the listen backlog rather than queue
+    inside the process, so a busy instance pushes back on the load
+    balancer instead of growing without bound.
+    """
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads):
+        self.threads = threads
+        self.draining = threading.Event()
+        self._slots = threading.BoundedSemaphore(threads)
+        self._in_flight = 0
+        self._idle = threading.Condition()
+        self._executor = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix="request")
+        super().__init__(host, port, app, handler=RequestHandler)
+
+    def process_request(self, request, client_address):
+        while not self._slots.acquire(timeout=0.5):
+            if self.draining.is_set():
+                self.shutdown_request(request)
+                return
+        with self._idle:
+            self._in_flight += 1
+        self._executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+            with self._idle:
+                self._in_flight -= 1
+                self._idle.notify_all()
+
+    def handle_error(self, request, client_address):
+        log.error("Error handling a connection.", client=str(client_address), traceback=traceback.format_exc())
+
+    def in_flight(self):
+        with self._idle:
+            return self._in_flight
+
+    def drain(self, timeout):
+        """Stop accepting and wait up to timeout seconds for the requests in progress.
+
+        Must be called from a thread other than the one in serve_forever.
+        Returns the number of requests still running when it gave up.
+        """
+        self.draining.set()
+        self.shutdown() # serve_forever returns and closes the listening socket
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._in_flight and deadline > time.monotonic():
+                self._idle.wait(deadline - time.monotonic())
+            remaining = self._in_flight
+        self._executor.shutdown(wait=False)
+        return remaining
+
+
+def create_app():
+    """Return the Flask app routing each entry point; also usable with any WSGI server."""
+    app = Flask(__name__)
+
+    def handler(entry_point):
+        return lambda: entry_point(request)
+
+    for path, entry_point in ROUTES.items():
+        app.add_url_rule(path, entry_point.__name__ + path, handler(entry_point), methods=["GET", "POST"])
+
+    @app.route("/healthz")
+    def healthz():
+        return Response(json.dumps({"status": "ok"}), status=200, mimetype='application/json')
+
+    return app
+
+
+def serve(host=None, port=None, threads=None, drain_seconds=None):
+    """Run the server until SIGTERM or SIGINT, then drain.
+
+    Returns the number of requests that did not finish within drain_seconds.
+    """
+    host = host or os.environ.get("SERVER_HOST", DEFAULT_SERVER_HOST)
+    port = port or env_int("PORT", DEFAULT_SERVER_PORT)
+    threads = threads or env_int("SERVER_THREADS", DEFAULT_SERVER_THREADS)
+    drain_seconds = drain_seconds or env_int("SERVER_DRAIN_SECONDS", DEFAULT_SERVER_DRAIN_SECONDS)
+
+    # Load the conversion/SFTP stack now rather than on the first execute request.
+    importlib.import_module("execute")
+    server = PooledWSGIServer(host, port, create_app(), threads)
+
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        log.info(f"Received {signal.Signals(signum).name}, draining.")
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    threading.Thread(target=server.serve_forever, name="accept", daemon=True).start()
+    log.info(f"Serving on {host}:{server.port} with {threads} request threads.", threads=threads)
+    while not stopping.wait(1):
+        pass
+
+    with log.span("drain", in_flight=server.in_flight()):
+        remaining = server.drain(drain_seconds)
+        if remaining:
+            log.warning(f"{remaining} request(s) still running after {drain_seconds} s; stopping anyway.")
+        # Queued deliveries were already accepted, so they run to the end.
+        jobs.shutdown_job_queue(wait=True)
+        connection_pool.close_all()
+    return remaining
+
+
+if __name__ == "__main__":
+    if serve():
+        os._exit(1) # Do not wait for the requests that overran the drain
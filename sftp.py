@@ -1,150 +1,371 @@
+import backoff
+import collections
+import contextlib
+import getpass
 import paramiko
 import os
 import json
-import io
+from credentials import get_key_string, load_private_key
+import log
+from sftp_pool import connection_pool, credential_fingerprint, upload_coalescer
+from transfer import (
+    ChecksumWriter, PARTIAL_SUFFIX, PipelinedWriter, file_digest, get_retry_policy, get_transfer_profile, is_retryable,
+    make_transport_factory, partial_path, pipelined_write, rename_into_place, verify_upload
+)
 
-def get_cred_config():
-    """Retrieve Cloud SQL credentials stored in Secret Manager
-    or default to environment variables.
+
+# Outcome of a streamed upload: bytes sent and their sha256 hex digest.
+StreamResult = collections.namedtuple('StreamResult', ['size', 'sha256'])
+
+# Outcome of upload_file_sftp: file size and sha256, attempts made, and the
+# byte offset the final attempt resumed from (0 if it started afresh).
+UploadResult = collections.namedtuple('UploadResult', ['size', 'sha256', 'attempts', 'resumed_from'])
+
+
+class UploadError(IOError):
+    """upload_file_sftp gave up; retryable says whether a later retry may succeed."""
+
+    def __init__(self, message, attempts=1, retryable=False):
+        super().__init__(message)
+        self.attempts = attempts
+        self.retryable = retryable
+
+
+def get_cred_config(key_name=None):
+    """Retrieve the SFTP private key stored in Secret Manager
+    and exposed to the function as an environment variable.
+
+    Args:
+        key_name: A named key (sftp_pem_<name>); the default sftp_pem key if None.
 
     Returns:
-        A dictionary with Cloud SQL credential values
+        The private key text, or None if the default key is not set.
     """
-    secret = os.environ.get("sftp_pem")
+    secret = get_key_string(key_name)
     if secret:
-        print("got secret")
+        log.debug("got secret")
         return secret
 
 
-def upload_file_sftp(
-    sftp_host,
-    sftp_port,
-    sftp_user,
-    local_file_path,
-    remote_file_path,
-    private_key_string=None,
-    sftp_password=None
-):
-
-    print(f"sftp host: {sftp_host}")
-    print(f"sftp port: {sftp_port}")
-    print(f"sftp user: {sftp_user}")
-    print(f"local_file_path: {local_file_path}")
-    print(f"remote_file_path: {remote_file_path}")
-
-    ssh_client = None
-    sftp_client = None
-    use_key_auth = bool(private_key_string)
-    private_key_obj = None # Initialize here
+def connect_ssh(sftp_host, sftp_port, sftp_user, private_key_obj=None, sftp_password=None, profile=None):
+    """Open and authenticate an SSH connection with a key or a password.
 
+    The transport's window/packet sizes, cipher order and compression come
+    from profile (see transfer.get_transfer_profile).
+    """
+    profile = profile or get_transfer_profile()
+    ssh_client = paramiko.SSHClient()
+    ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    log.debug(f"Connecting to {sftp_host}:{sftp_port} as {sftp_user}...")
     try:
-        ssh_client = paramiko.SSHClient()
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        print(f"Connecting to {sftp_host}:{sftp_port} as {sftp_user}...")
-
-        if use_key_auth:
-            print("Attempting key-based authentication using provided key string.")
-            if not isinstance(private_key_string, str):
-                print("Error: private_key_string must be a string.")
-                use_key_auth = False # Fallback if string not provided correctly
-            else:
-                try:
-                    key_file_obj = io.StringIO(private_key_string)
-                    
-                    # Explicitly try loading as common key types
-                    key_classes_to_try = [
-                        paramiko.Ed25519Key,
-                        paramiko.ECDSAKey
-                        # paramiko.DSSKey, # DSS is older and sometimes problematic; add if needed
-                    ]
-                    
-                    loaded_successfully = False
-                    for key_cls in key_classes_to_try:
-                        try:
-                            key_file_obj.seek(0) # Reset stream for each parsing attempt
-                            private_key_obj = key_cls.from_private_key(key_file_obj, password=None) # No password
-                            print(f"Successfully loaded key as {key_cls.__name__} from string.")
-                            loaded_successfully = True
-                            break # Key loaded, exit loop
-                        except paramiko.SSHException as e_ssh_type:
-                            # This is expected if the key is not of the current type,
-                            # or if it's encrypted (but we assume unencrypted).
-                            print(f"DEBUG: Could not load key as {key_cls.__name__}: {e_ssh_type}")
-                        except Exception as e_other_type:
-                            # Catch any other unexpected error during a specific key type load
-                            print(f"DEBUG: Unexpected error trying to load as {key_cls.__name__}: {e_other_type}")
-                    
-                    if not loaded_successfully:
-                        print("Error: Failed to load private key from string using any known key type. "
-                              "Ensure the key string is a valid unencrypted private key (OpenSSH or PEM format).")
-                        use_key_auth = False # Fallback to password
-
-                except Exception as e_load_key: # Catch errors like io.StringIO failing
-                    print(f"Error preparing or loading SSH key from string: {e_load_key}")
-                    use_key_auth = False # Fallback to password
-            
-            # Proceed with connection if key was loaded and use_key_auth is still true
-            if use_key_auth and private_key_obj:
-                 ssh_client.connect(
-                    sftp_host,
-                    port=sftp_port,
-                    username=sftp_user,
-                    pkey=private_key_obj,
-                    allow_agent=False,
-                    look_for_keys=False
-                )
-            else: # Key loading failed or wasn't attempted correctly, ensure use_key_auth is false
-                use_key_auth = False
-
-
-        if not use_key_auth: # True if key_string wasn't provided, or if key loading/auth failed
-            if sftp_password:
-                print("Attempting password-based authentication.")
+        with log.span("connect", host=sftp_host, port=sftp_port, cipher_profile=profile.cipher_profile):
+            if private_key_obj is not None:
                 ssh_client.connect(
                     sftp_host,
                     port=sftp_port,
                     username=sftp_user,
-                    password=sftp_password,
+                    pkey=private_key_obj,
                     allow_agent=False,
-                    look_for_keys=False
+                    look_for_keys=False,
+                    compress=profile.compress,
+                    transport_factory=make_transport_factory(profile)
                 )
             else:
-                print("Key authentication not used or failed, and no sftp_password provided. Prompting for password...")
-                pw_prompt = getpass.getpass(f"Enter password for {sftp_user}@{sftp_host}: ")
+                log.debug("Attempting password-based authentication.")
                 ssh_client.connect(
                     sftp_host,
                     port=sftp_port,
                     username=sftp_user,
-                    password=pw_prompt,
+                    password=sftp_password,
                     allow_agent=False,
-                    look_for_keys=False
+                    look_for_keys=False,
+                    compress=profile.compress,
+                    transport_factory=make_transport_factory(profile)
                 )
+    except BaseException:
+        ssh_client.close()
+        raise
+    return ssh_client
+
+
+def _session_factory(sftp_host, sftp_port, sftp_user, private_key_string, sftp_password, private_key, transfer_profile):
+    """Resolve credentials and return (pool key, connect callable, transfer profile)."""
+    private_key_obj = private_key
+    if private_key_obj is None and private_key_string:
+        log.debug("Attempting key-based authentication using provided key string.")
+        private_key_obj = load_private_key(private_key_string) # None falls back to password
+
+    if private_key_obj is None and not sftp_password:
+        log.info("Key authentication not used or failed, and no sftp_password provided. Prompting for password...")
+        sftp_password = getpass.getpass(f"Enter password for {sftp_user}@{sftp_host}: ")
+
+    profile = transfer_profile or get_transfer_profile()
+    pool_key = (sftp_host, sftp_port, sftp_user, credential_fingerprint(private_key_obj, sftp_password))
+
+    def connect():
+        return connect_ssh(sftp_host, sftp_port, sftp_user, private_key_obj, sftp_password, profile)
+
+    return pool_key, connect, profile
+
+
+@contextlib.contextmanager
+def sftp_session(
+    sftp_host,
+    sftp_port,
+    sftp_user,
+    private_key_string=None,
+    sftp_password=None,
+    private_key=None,
+    transfer_profile=None
+):
+    """Yield a pooled SFTPClient for small remote operations (stat, read, rename).
+
+    Credentials are resolved as in upload_file_sftp. The session goes back
+    to the pool afterwards, or is discarded if it died.
+    """
+    pool_key, connect, _ = _session_factory(
+        sftp_host, sftp_port, sftp_user, private_key_string, sftp_password, private_key, transfer_profile
+    )
+    session = connection_pool.acquire(pool_key, connect)
+    try:
+        yield session.sftp_client
+    except BaseException:
+        connection_pool.release(session, healthy=session.is_alive())
+        raise
+    connection_pool.release(session)
 
-        print("Connection established.")
-        sftp_client = ssh_client.open_sftp()
-        print("SFTP session opened.")
 
-        print(f"Uploading '{local_file_path}' to '{remote_file_path}'...")
-        sftp_client.put(local_file_path, remote_file_path)
-        print("File uploaded successfully!")
-        return True
+def _upload_attempt(sftp_client, local_file_obj, remote_file_path, size, sha256, profile, policy):
+    """Upload once over sftp_client and return the offset it resumed from."""
+    if not policy.resume:
+        pipelined_write(sftp_client, local_file_obj, remote_file_path, profile)
+        verify_upload(sftp_client, remote_file_path, size, sha256, policy.verify)
+        return 0
 
-    except paramiko.AuthenticationException:
-        print("Authentication failed. Please check your credentials (key or password).")
-    except paramiko.SSHException as ssh_ex: # Catches broader SSH issues including connection problems
-        print(f"SSH error: {ssh_ex}")
+    # Upload under a partial name and rename it into place once complete, so
+    # the destination never holds a half-written file and a retry (in this
+    # call or a later Looker retry) continues where the last attempt stopped.
+    part_path = partial_path(remote_file_path, sha256)
+    try:
+        offset = sftp_client.stat(part_path).st_size
     except FileNotFoundError:
-        print(f"Error: Local file '{local_file_path}' not found during sftp.put().")
-    except IOError as io_ex:
-        print(f"IOError during SFTP operation (e.g., remote path issue): {io_ex}")
-        print(f"Please ensure the remote directory '{os.path.dirname(remote_file_path)}' exists on the server.")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-    finally:
-        if sftp_client:
-            sftp_client.close()
-            print("SFTP session closed.")
-        if ssh_client:
-            ssh_client.close()
-            print("SSH connection closed.")
-    return False
+        offset = 0
+    if offset > size:
+        offset = 0
+    # Pipelined writes can land out of order, so a dropped connection may
+    # leave holes below the partial file's size, as deep as the writes that
+    # were in flight. Rewrite that much again rather than trust it.
+    offset = max(0, offset - profile.max_outstanding_requests * profile.chunk_size)
+    if offset:
+        log.info(f"Resuming upload of '{remote_file_path}' at byte {offset} of {size}.")
+    local_file_obj.seek(0)
+    pipelined_write(sftp_client, local_file_obj, part_path, profile, offset=offset)
+    try:
+        verify_upload(sftp_client, part_path, size, sha256, policy.verify)
+    except IOError:
+        # Never resume from a partial file that failed verification.
+        try:
+            sftp_client.remove(part_path)
+        except IOError:
+            pass
+        raise
+    rename_into_place(sftp_client, part_path, remote_file_path)
+    return offset
+
+
+def upload_file_sftp(
+    sftp_host,
+    sftp_port,
+    sftp_user,
+    local_file_path,
+    remote_file_path,
+    private_key_string=None,
+    sftp_password=None,
+    private_key=None,
+    transfer_profile=None,
+    retry_policy=None,
+    local_digest=None
+):
+    """Upload local_file_path (a path or binary file object) to remote_file_path over SFTP.
+
+    Authenticates with private_key (an already parsed paramiko key, see
+    credentials.get_private_key), else private_key_string, else sftp_password.
+    The file is sent with the pipelined engine in transfer.py, tuned by
+    transfer_profile (defaults to the SFTP_* environment settings).
+
+    Retryable failures (see transfer.is_retryable) are retried with
+    exponential backoff and jitter per retry_policy (defaults to
+    transfer.get_retry_policy()). With resume on, the file is uploaded to a
+    partial name, verified and renamed into place, and each retry continues
+    from the partial file's size. A partial file left after giving up is
+    resumed by the next call for the same content. Pass local_digest as
+    (size, sha256) when the file's digest is already known.
+
+    Returns:
+        An UploadResult.
+
+    Raises:
+        UploadError: the upload failed; the message says why and after how many attempts.
+    """
+
+    log.debug(
+        f"Uploading {local_file_path} to {sftp_user}@{sftp_host}:{sftp_port} {remote_file_path}",
+        host=sftp_host, port=sftp_port, remote_file_path=remote_file_path
+    )
+
+    pool_key, connect, profile = _session_factory(
+        sftp_host, sftp_port, sftp_user, private_key_string, sftp_password, private_key, transfer_profile
+    )
+    policy = retry_policy or get_retry_policy()
+
+    with contextlib.ExitStack() as stack:
+        if hasattr(local_file_path, "read"):
+            local_file_obj = local_file_path
+        else:
+            try:
+                local_file_obj = stack.enter_context(open(local_file_path, 'rb'))
+            except FileNotFoundError as e:
+                log.error(f"Local file '{local_file_path}' not found.")
+                raise UploadError(f"Local file '{local_file_path}' not found.") from e
+        seekable = local_file_obj.seekable() if hasattr(local_file_obj, "seekable") else hasattr(local_file_obj, "seek")
+        if seekable:
+            size, sha256 = local_digest or file_digest(local_file_obj)
+        else:
+            # Can only be read once: no resume, no retries.
+            size, sha256 = None, None
+            policy = policy._replace(max_tries=1, resume=False, verify="none")
+
+        attempts = 0
+
+        def log_backoff(details):
+            log.warning(f"Upload attempt {details['tries']} failed ({details['exception']}). "
+                        f"Retrying in {details['wait']:.1f}s...")
+
+        @backoff.on_exception(
+            backoff.expo,
+            Exception,
+            max_tries=policy.max_tries,
+            max_time=policy.max_time,
+            giveup=lambda e: not is_retryable(e),
+            on_backoff=log_backoff,
+            factor=policy.base_seconds,
+            max_value=policy.max_seconds,
+        )
+        def attempt():
+            nonlocal attempts
+            attempts += 1
+            log.debug(f"Uploading '{local_file_path}' to '{remote_file_path}' (attempt {attempts})...")
+            if upload_coalescer.enabled:
+                # Shares a session with other uploads to this server; see UploadCoalescer.
+                return upload_coalescer.run(pool_key, connect, lambda sftp_client: _upload_attempt(
+                    sftp_client, local_file_obj, remote_file_path, size, sha256, profile, policy
+                ))
+            session = connection_pool.acquire(pool_key, connect)
+            try:
+                resumed_from = _upload_attempt(session.sftp_client, local_file_obj, remote_file_path, size, sha256, profile, policy)
+            except BaseException:
+                # The SFTP channel may be broken even if the transport is up;
+                # a retry on the same session would fail the same way.
+                if session.reused and not session.is_alive():
+                    log.warning("Pooled session went stale during upload.")
+                    connection_pool.record_stale()
+                connection_pool.discard(session)
+                raise
+            connection_pool.release(session)
+            return resumed_from
+
+        try:
+            with log.span("upload", host=sftp_host, port=sftp_port, remote_file_path=remote_file_path) as upload_span:
+                upload_span.add_bytes(size)
+                resumed_from = attempt()
+                upload_span.set(attempts=attempts, resumed_from=resumed_from, sha256=sha256)
+        except Exception as e:
+            retryable = is_retryable(e)
+            if isinstance(e, paramiko.AuthenticationException):
+                log.error("Authentication failed. Please check your credentials (key or password).")
+            elif isinstance(e, FileNotFoundError):
+                log.error(f"Please ensure the remote directory '{os.path.dirname(remote_file_path)}' exists on the server.")
+            elif isinstance(e, paramiko.SSHException):
+                log.error(f"SSH error: {e}")
+            else:
+                log.error(f"Upload error: {e}")
+            reason = "giving up" if retryable else "not retryable"
+            raise UploadError(
+                f"Upload to '{remote_file_path}' failed after {attempts} attempt(s) ({reason}): {e}",
+                attempts=attempts, retryable=retryable
+            ) from e
+
+    log.debug(f"File uploaded successfully! ({size} bytes, sha256 {sha256}, {attempts} attempt(s))")
+    return UploadResult(size, sha256, attempts, resumed_from)
+
+
+def stream_file_sftp(
+    sftp_host,
+    sftp_port,
+    sftp_user,
+    write_output,
+    remote_file_path,
+    private_key_string=None,
+    sftp_password=None,
+    private_key=None,
+    transfer_profile=None
+):
+    """Stream output straight into remote_file_path without a local copy.
+
+    write_output is called with a forward-only, checksumming writer backed
+    by pipelined SFTP writes, so producing the file and uploading it
+    overlap. Once it returns, the remote size is checked against the bytes
+    written. The output goes to '<remote_file_path>.part' and is renamed
+    into place once checked, so the destination keeps its previous file
+    until then and is never seen half written. The partial file is removed
+    if anything fails.
+
+    Returns:
+        A StreamResult with the byte count and sha256 of what was sent.
+
+    Raises:
+        Whatever write_output raises, or the SFTP error that stopped the upload.
+    """
+    log.debug(
+        f"Streaming to {sftp_user}@{sftp_host}:{sftp_port} {remote_file_path}",
+        host=sftp_host, port=sftp_port, remote_file_path=remote_file_path
+    )
+
+    pool_key, connect, profile = _session_factory(
+        sftp_host, sftp_port, sftp_user, private_key_string, sftp_password, private_key, transfer_profile
+    )
+    part_path = remote_file_path + PARTIAL_SUFFIX
+    session = connection_pool.acquire(pool_key, connect)
+    sftp_client = session.sftp_client
+    try:
+        # Covers producing the output as well, which overlaps with sending it.
+        with log.span("upload", host=sftp_host, port=sftp_port, remote_file_path=remote_file_path, streamed=True) as upload_span:
+            with sftp_client.open(part_path, 'wb') as remote_file:
+                writer = PipelinedWriter(remote_file, profile)
+                checksum_writer = ChecksumWriter(writer)
+                write_output(checksum_writer)
+                writer.close()
+
+            remote_size = sftp_client.stat(part_path).st_size
+            if remote_size != checksum_writer.size:
+                raise IOError(
+                    f"Remote file '{part_path}' is {remote_size} bytes, expected {checksum_writer.size}."
+                )
+            rename_into_place(sftp_client, part_path, remote_file_path)
+            upload_span.add_bytes(checksum_writer.size)
+            upload_span.set(sha256=checksum_writer.hexdigest())
+        log.debug(f"File streamed successfully! ({checksum_writer.size} bytes, sha256 {checksum_writer.hexdigest()})")
+    except BaseException as e:
+        log.error(f"Error streaming to '{remote_file_path}': {e}")
+        healthy = session.is_alive()
+        if healthy:
+            try:
+                sftp_client.remove(part_path)
+                log.info(f"Removed partial remote file '{part_path}'.")
+            except Exception:
+                pass
+        connection_pool.release(session, healthy=healthy)
+        raise
+
+    connection_pool.release(session)
+    return StreamResult(checksum_writer.size, checksum_writer.hexdigest())
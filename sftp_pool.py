@@ -0,0 +1,407 @@
+import concurrent.futures
+import hashlib
+import queue
+import threading
+import time
+
+from env import env_int, env_number
+import log
+
+
+DEFAULT_IDLE_TTL_SECONDS = 300
+DEFAULT_MAX_SESSIONS_PER_HOST = 4
+DEFAULT_KEEPALIVE_SECONDS = 30
+DEFAULT_ACQUIRE_TIMEOUT_SECONDS = 60
+DEFAULT_COALESCE_WINDOW_SECONDS = 0
+DEFAULT_COALESCE_CHANNELS = 4
+
+
+def credential_fingerprint(private_key_obj=None, sftp_password=None):
+    """Identify the credential a session was authenticated with.
+
+    Keys are identified by their public fingerprint. Passwords are hashed so
+    the pool never keeps them in its keys.
+    """
+    if private_key_obj is not None:
+        return f"{private_key_obj.get_name()}:{private_key_obj.get_fingerprint().hex()}"
+    if sftp_password:
+        return "password:" + hashlib.sha256(sftp_password.encode("utf-8")).hexdigest()
+    return "none"
+
+
+class PooledSession:
+    """An authenticated SSH connection plus its open SFTP channel."""
+
+    def __init__(self, key, ssh_client, sftp_client):
+        self.key = key
+        self.ssh_client = ssh_client
+        self.sftp_client = sftp_client
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.reused = False
+
+    @property
+    def host_key(self):
+        """(host, port) this session is connected to."""
+        return self.key[0], self.key[1]
+
+    def is_alive(self):
+        """Check the SFTP channel is open and the transport is up (SSH_MSG_IGNORE probe).
+
+        A server can close the SFTP channel and keep the connection, e.g.
+        OpenSSH's ChannelTimeout, so the transport alone is not enough.
+        """
+        transport = self.ssh_client.get_transport() if self.ssh_client else None
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            channel = self.sftp_client.get_channel() if self.sftp_client else None
+            if channel is None or channel.closed or not channel.active or channel.eof_received:
+                log.debug(f"Pooled session to {self.key[0]}:{self.key[1]} has a closed SFTP channel.")
+                return False
+            transport.send_ignore()
+        except Exception as e:
+            log.debug(f"Pooled session to {self.key[0]}:{self.key[1]} failed keepalive: {e}")
+            return False
+        return transport.is_active()
+
+    def close(self):
+        if self.sftp_client:
+            try:
+                self.sftp_client.close()
+            except Exception:
+                pass
+        if self.ssh_client:
+            try:
+                self.ssh_client.close()
+            except Exception:
+                pass
+
+
+class SFTPConnectionPool:
+    """Keeps authenticated SFTP sessions open across warm invocations.
+
+    Sessions are keyed by (host, port, user, credential fingerprint). Idle
+    sessions are evicted after idle_ttl seconds, each host gets at most
+    max_per_host open sessions, and a session that fails its keepalive
+    check when it is checked out is discarded and replaced.
+    """
+
+    def __init__(self, idle_ttl=None, max_per_host=None, keepalive=None, acquire_timeout=None):
+        self.idle_ttl = idle_ttl if idle_ttl is not None else env_number(
+            "SFTP_POOL_IDLE_TTL_SECONDS", DEFAULT_IDLE_TTL_SECONDS, float, minimum=0)
+        self.max_per_host = max_per_host or env_int(
+            "SFTP_POOL_MAX_PER_HOST", DEFAULT_MAX_SESSIONS_PER_HOST)
+        self.keepalive = keepalive if keepalive is not None else env_int(
+            "SFTP_KEEPALIVE_SECONDS", DEFAULT_KEEPALIVE_SECONDS, minimum=0)
+        self.acquire_timeout = acquire_timeout if acquire_timeout is not None else env_number(
+            "SFTP_POOL_ACQUIRE_TIMEOUT_SECONDS", DEFAULT_ACQUIRE_TIMEOUT_SECONDS, float, minimum=0)
+
+        self._condition = threading.Condition()
+        self._idle = {}          # key -> list of idle PooledSessions, most recently used last
+        self._open_per_host = {} # (host, port) -> number of open sessions, idle or checked out
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def stats(self):
+        """Return the pool counters and current occupancy."""
+        with self._condition:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "idle": sum(len(sessions) for sessions in self._idle.values()),
+                "open": sum(self._open_per_host.values()),
+            }
+
+    def _forget(self, session):
+        """Drop a session from the per-host count. Caller holds the lock."""
+        host_key = session.host_key
+        remaining = self._open_per_host.get(host_key, 0) - 1
+        if remaining > 0:
+            self._open_per_host[host_key] = remaining
+        else:
+            self._open_per_host.pop(host_key, None)
+        self._condition.notify_all()
+
+    def _evict_expired(self, now):
+        """Collect idle sessions past their TTL. Caller holds the lock."""
+        expired = []
+        for key, sessions in list(self._idle.items()):
+            keep = []
+            for session in sessions:
+                if now - session.last_used > self.idle_ttl:
+                    expired.append(session)
+                else:
+                    keep.append(session)
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        for session in expired:
+            self._forget(session)
+        self.evictions += len(expired)
+        return expired
+
+    def _evict_idle_for_host(self, host_key):
+        """Free a slot on host_key by evicting its oldest idle session. Caller holds the lock."""
+        candidates = [
+            session for key, sessions in self._idle.items() if (key[0], key[1]) == host_key
+            for session in sessions
+        ]
+        if not candidates:
+            return None
+        victim = min(candidates, key=lambda session: session.last_used)
+        self._idle[victim.key].remove(victim)
+        if not self._idle[victim.key]:
+            del self._idle[victim.key]
+        self._forget(victim)
+        self.evictions += 1
+        return victim
+
+    def acquire(self, key, connect):
+        """Check out a live session for key, opening a new one with connect() on a miss.
+
+        Args:
+            key: (host, port, user, credential fingerprint).
+            connect: Callable returning a connected paramiko.SSHClient.
+
+        Returns:
+            A PooledSession. Hand it back with release() when done.
+        """
+        host_key = (key[0], key[1])
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            candidate = self._check_out(key, host_key, deadline)
+            if candidate is None:
+                break # A slot is reserved for a new session
+            # Probed outside the lock: is_alive talks to the server, and a
+            # slow or dead host must not hold up sessions to every other host.
+            # The candidate is checked out meanwhile, so it keeps its slot.
+            if candidate.is_alive():
+                with self._condition:
+                    self.hits += 1
+                candidate.reused = True
+                log.debug(f"Reusing pooled SFTP session to {key[0]}:{key[1]} as {key[2]}.")
+                return candidate
+            self.record_stale()
+            self.discard(candidate)
+
+        # Connect outside the lock so a slow handshake does not block other hosts.
+        ssh_client = None
+        try:
+            ssh_client = connect()
+            transport = ssh_client.get_transport()
+            if transport is not None and self.keepalive:
+                transport.set_keepalive(self.keepalive)
+            sftp_client = ssh_client.open_sftp()
+        except BaseException:
+            if ssh_client:
+                ssh_client.close()
+            with self._condition:
+                self._open_per_host[host_key] = self._open_per_host.get(host_key, 1) - 1
+                if self._open_per_host[host_key] <= 0:
+                    del self._open_per_host[host_key]
+                self._condition.notify_all()
+            raise
+        log.debug("SFTP session opened.")
+        return PooledSession(key, ssh_client, sftp_client)
+
+    def _check_out(self, key, host_key, deadline):
+        """Pop an idle session for key, or reserve a slot to open one and return None.
+
+        Waits until deadline while host_key is at max_per_host. Sessions
+        evicted on the way are closed after the lock is released.
+        """
+        to_close = []
+        try:
+            with self._condition:
+                while True:
+                    to_close.extend(self._evict_expired(time.monotonic()))
+
+                    idle_sessions = self._idle.get(key)
+                    if idle_sessions:
+                        candidate = idle_sessions.pop()
+                        if not idle_sessions:
+                            del self._idle[key]
+                        return candidate
+
+                    if self._open_per_host.get(host_key, 0) < self.max_per_host:
+                        self.misses += 1
+                        self._open_per_host[host_key] = self._open_per_host.get(host_key, 0) + 1
+                        return None
+
+                    victim = self._evict_idle_for_host(host_key)
+                    if victim is not None:
+                        to_close.append(victim)
+                        continue
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            f"Timed out waiting for a free SFTP session to {key[0]}:{key[1]} "
+                            f"(limit {self.max_per_host} per host)."
+                        )
+                    self._condition.wait(remaining)
+        finally:
+            for evicted in to_close:
+                evicted.close()
+
+    def record_stale(self):
+        """Count a pooled session found dead when it was about to be, or was being, reused."""
+        with self._condition:
+            self.stale += 1
+
+    def release(self, session, healthy=True):
+        """Return a session to the pool, or close it if it is no longer usable."""
+        if not healthy or self.idle_ttl <= 0:
+            self.discard(session)
+            return
+        with self._condition:
+            session.last_used = time.monotonic()
+            self._idle.setdefault(session.key, []).append(session)
+            self._condition.notify_all()
+
+    def discard(self, session):
+        """Close a checked-out session and free its slot."""
+        with self._condition:
+            self._forget(session)
+        session.close()
+        log.debug("SFTP session closed.")
+
+    def close_all(self):
+        """Close every idle session, e.g. on shutdown."""
+        with self._condition:
+            sessions = [session for idle in self._idle.values() for session in idle]
+            self._idle.clear()
+            for session in sessions:
+                self._forget(session)
+        for session in sessions:
+            session.close()
+
+
+
+class UploadCoalescer:
+    """Sends uploads bound for the same server and user over one shared session.
+
+    The first upload for a (host, port, user, credential fingerprint) key
+    opens a batch and waits window seconds for more uploads with that key,
+    e.g. from a burst of schedules or the destinations of one request. The
+    batch then checks out a single pooled session and runs its uploads over
+    up to `channels` SFTP channels of it at once, so the server sees one
+    connection and one login instead of one per file. Each upload's result
+    or exception goes back to the request that submitted it. A window of 0
+    turns coalescing off.
+    """
+
+    def __init__(self, pool, window=None, channels=None):
+        self.pool = pool
+        self.window = window if window is not None else env_number(
+            "SFTP_COALESCE_WINDOW_SECONDS", DEFAULT_COALESCE_WINDOW_SECONDS, float, minimum=0)
+        self.channels = channels or env_int(
+            "SFTP_COALESCE_CHANNELS", DEFAULT_COALESCE_CHANNELS)
+
+        self._lock = threading.Lock()
+        self._collecting = {} # key -> list of (upload, Future) still taking uploads
+        self.batches = 0
+        self.uploads = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def stats(self):
+        with self._lock:
+            return {"batches": self.batches, "uploads": self.uploads}
+
+    def run(self, key, connect, upload):
+        """Run upload(sftp_client) over a session for key, shared with the uploads of its batch.
+
+        Args:
+            key: (host, port, user, credential fingerprint), as for SFTPConnectionPool.acquire.
+            connect: Callable returning a connected paramiko.SSHClient.
+            upload: Callable taking an SFTPClient; called on a worker thread
+                with the caller's correlation id.
+
+        Returns:
+            What upload returns. Raises what upload, or opening the session, raises.
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            batch = self._collecting.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._collecting[key] = []
+            batch.append((log.propagate(upload), future))
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                del self._collecting[key]
+            self._run_batch(key, connect, batch)
+        return future.result()
+
+    def _run_batch(self, key, connect, batch):
+        try:
+            session = self.pool.acquire(key, connect)
+        except BaseException as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        channels = queue.Queue()
+        channels.put(session.sftp_client)
+        extra_channels = []
+        for _ in range(min(len(batch), self.channels) - 1):
+            try:
+                extra_channels.append(session.ssh_client.open_sftp())
+            except Exception as e: # e.g. the server's MaxSessions
+                log.debug(f"Could not open another SFTP channel to {key[0]}:{key[1]}: {e}")
+                break
+        for channel in extra_channels:
+            channels.put(channel)
+
+        with self._lock:
+            self.batches += 1
+            self.uploads += len(batch)
+        log.emit(
+            "INFO" if len(batch) > 1 else "DEBUG",
+            f"Sending {len(batch)} upload(s) to {key[0]}:{key[1]} as {key[2]} over one session "
+            f"with {1 + len(extra_channels)} channel(s).",
+            host=key[0], port=key[1], uploads=len(batch), channels=1 + len(extra_channels)
+        )
+
+        failed = []
+
+        def run(upload, future):
+            channel = channels.get()
+            try:
+                future.set_result(upload(channel))
+            except BaseException as e:
+                failed.append(e)
+                future.set_exception(e)
+            finally:
+                channels.put(channel)
+
+        with concurrent.futures.ThreadPoolExecutor(1 + len(extra_channels), thread_name_prefix="coalesced") as executor:
+            for upload, future in batch:
+                executor.submit(run, upload, future)
+
+        for channel in extra_channels:
+            try:
+                channel.close()
+            except Exception:
+                pass
+        healthy = session.is_alive()
+        if session.reused and not healthy:
+            log.warning("Pooled session went stale during upload.")
+            self.pool.record_stale()
+        # As in upload_file_sftp, a session that saw an upload fail is not reused.
+        self.pool.release(session, healthy=healthy and not failed)
+
+
+# Shared by every request handled by this process.
+connection_pool = SFTPConnectionPool()
+upload_coalescer = UploadCoalescer(connection_pool)
@@ -0,0 +1,96 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules live at the top level of the repository, as Cloud Functions deploys them.
+sys.path.insert(0, ROOT)
+# The SFTP stand-in the benchmarks use; see benchmarks/sftp_server.py.
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+AUTH_SECRET = "test-secret"
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    """Give each test its own workspace root and fresh per-process singletons."""
+    import admission
+    import idempotency
+    import jobs
+
+    monkeypatch.setenv("WORKSPACE_ROOT", str(tmp_path / "workspaces"))
+    monkeypatch.setenv("LOOKER_ACTION_HUB_SECRET", AUTH_SECRET)
+    monkeypatch.setattr(admission, "_budget", None)
+    monkeypatch.setattr(idempotency, "_ledger", None)
+    yield
+    jobs.shutdown_job_queue(wait=True)
+
+
+@pytest.fixture(scope="session")
+def private_key(tmp_path_factory):
+    from sftp_server import generate_ed25519_key
+
+    return generate_ed25519_key(str(tmp_path_factory.mktemp("keys") / "id_ed25519"))
+
+
+@pytest.fixture
+def sftp_server(tmp_path, monkeypatch, private_key):
+    """A LocalSFTPServer serving tmp_path/sftp, with the action's default key configured for it."""
+    from sftp_pool import connection_pool
+    from sftp_server import LocalSFTPServer
+
+    root = tmp_path / "sftp"
+    root.mkdir()
+    monkeypatch.setenv("sftp_pem", private_key)
+    with LocalSFTPServer(str(root)) as server:
+        yield server
+        connection_pool.close_all()
+
+
+def csv_zip(tiles):
+    """Zip {name: csv text} the way Looker's csv_zip attachment holds dashboard tiles."""
+    import io
+    import zipfile
+
+    payload = io.BytesIO()
+    with zipfile.ZipFile(payload, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        for name, text in tiles.items():
+            zip_ref.writestr(f"dashboard/{name}", text)
+    return payload.getvalue()
+
+
+@pytest.fixture
+def make_body():
+    """Build an action_execute body delivering an inline csv_zip to 127.0.0.1:port."""
+    import base64
+
+    def make(port=22, filename="/out.xlsx", plan_id=1, rows=2000, tiles=None, **form_params):
+        tiles = tiles or {"sales.csv": "region,amount\n" + "".join(f"r{i},{i}\n" for i in range(rows))}
+        form_params = dict({"host": "127.0.0.1", "port": str(port), "username": "looker", "filename": filename}, **form_params)
+        return {
+            "form_params": form_params,
+            "attachment": {"data": base64.b64encode(csv_zip(tiles)).decode()},
+            "scheduled_plan": {"scheduled_plan_id": plan_id},
+        }
+
+    return make
+
+
+@pytest.fixture
+def execute():
+    """Call action_execute with a JSON body; returns (status code, response JSON)."""
+    from flask import Flask, request
+
+    import main
+
+    app = Flask(__name__)
+
+    def post(body):
+        headers = {"authorization": f'Token token="{AUTH_SECRET}"'}
+        with app.test_request_context("/", method="POST", json=body, headers=headers):
+            response = main.action_execute(request)
+        return response.status_code, response.get_json()
+
+    return post
@@ -0,0 +1,128 @@
+"""Admission control: the memory budget for sync requests and queued async jobs."""
+import os
+import threading
+
+import pytest
+
+import admission
+import execute as execute_module
+import jobs
+
+
+def use_budget(monkeypatch, free_bytes):
+    """Install a MemoryBudget with free_bytes left over the process's current size."""
+    budget = admission.MemoryBudget(1)
+    budget.limit = budget.baseline + free_bytes
+    monkeypatch.setattr(admission, "_budget", budget)
+    return budget
+
+
+def test_admit_falls_back_to_the_cheaper_option():
+    budget = admission.MemoryBudget(0)
+    budget.limit = budget.baseline + 100
+    with budget.admit([("pandas", 150), ("streaming", 60)]) as label:
+        assert label == "streaming"
+        assert budget.stats()["reserved_bytes"] == 60
+        with pytest.raises(admission.MemoryBudgetExceeded) as refused:
+            with budget.admit([("streaming", 60)]):
+                pass
+        assert not isinstance(refused.value, admission.PayloadTooLarge)
+        with pytest.raises(admission.PayloadTooLarge):
+            with budget.admit([("streaming", 101)]):
+                pass
+    assert budget.stats()["reserved_bytes"] == 0
+
+
+def test_admit_takes_over_a_reservation():
+    budget = admission.MemoryBudget(0)
+    budget.limit = budget.baseline + 100
+    token = budget.reserve(70)
+    with budget.admit([("streaming", 90)], replaces=token):
+        assert budget.stats()["reserved_bytes"] == 90
+    assert budget.stats()["reserved_bytes"] == 0
+    budget.release(token) # Already taken over: a no-op
+
+
+def test_refused_admission_keeps_the_replaced_reservation():
+    budget = admission.MemoryBudget(0)
+    budget.limit = budget.baseline + 100
+    token = budget.reserve(70)
+    with pytest.raises(admission.PayloadTooLarge):
+        with budget.admit([("streaming", 200)], replaces=token):
+            pass
+    assert budget.stats()["reserved_bytes"] == 70
+    budget.release(token)
+    assert budget.stats()["reserved_bytes"] == 0
+
+
+def test_oversized_request_is_refused_before_parsing(make_body, monkeypatch, execute):
+    use_budget(monkeypatch, 1000)
+    status, response = execute(make_body())
+    assert status == 413
+    assert "too large" in response["error"]
+
+
+def test_busy_instance_refuses_with_503(make_body, monkeypatch, sftp_server, execute):
+    budget = use_budget(monkeypatch, 64 * 1024 * 1024)
+    with budget.admit([("other request", 64 * 1024 * 1024 - 1000)]):
+        status, response = execute(make_body(sftp_server.port))
+    assert status == 503
+    assert "busy" in response["error"]
+    assert os.listdir(sftp_server.root) == []
+
+
+def test_sync_delivery_releases_its_reservation(make_body, monkeypatch, sftp_server, execute):
+    budget = use_budget(monkeypatch, 256 * 1024 * 1024)
+    status, response = execute(make_body(sftp_server.port))
+    assert status == 200, response
+    assert budget.stats()["reserved_bytes"] == 0
+
+
+@pytest.fixture
+def async_mode(monkeypatch):
+    monkeypatch.setenv("EXECUTE_MODE", "async")
+    monkeypatch.setenv("JOB_WORKERS", "1")
+    monkeypatch.setenv("JOB_QUEUE_MAX", "1")
+
+
+def test_queued_job_holds_its_reservation_until_it_finishes(make_body, monkeypatch, async_mode, execute):
+    budget = use_budget(monkeypatch, 256 * 1024 * 1024)
+    started, finish, seen = threading.Event(), threading.Event(), {}
+
+    def deliver_workbook(request_json, destinations, key, output_format, reservation=None):
+        seen["reservation"] = reservation
+        seen["reserved_bytes"] = budget.stats()["reserved_bytes"]
+        started.set()
+        finish.wait(10)
+        return [execute_module.destination_result(execute_module.Destination(*destinations[0]), status="success", size=1, sha256="0")]
+
+    monkeypatch.setattr(execute_module, "deliver_workbook", deliver_workbook)
+    body = make_body()
+    status, response = execute(body)
+    assert status == 200 and response["status"] == "accepted"
+    assert started.wait(10)
+    assert seen["reservation"] and seen["reserved_bytes"] > 2 * len(body["attachment"]["data"])
+    finish.set()
+    jobs.shutdown_job_queue(wait=True)
+    assert budget.stats()["reserved_bytes"] == 0
+
+
+def test_async_request_is_refused_when_the_budget_is_taken(make_body, monkeypatch, async_mode, execute):
+    budget = use_budget(monkeypatch, 16 * 1024 * 1024)
+    with budget.admit([("other request", 16 * 1024 * 1024 - 1000)]):
+        status, response = execute(make_body())
+    assert status == 503
+    assert "busy" in response["error"]
+    assert budget.stats()["reserved_bytes"] == 0
+
+
+def test_full_queue_releases_the_reservation(make_body, monkeypatch, async_mode, execute):
+    budget = use_budget(monkeypatch, 256 * 1024 * 1024)
+
+    def full(kind, payload):
+        raise jobs.JobQueueFull("full")
+
+    monkeypatch.setattr(jobs.get_job_queue(), "submit", full)
+    status, _ = execute(make_body())
+    assert status == 503
+    assert budget.stats()["reserved_bytes"] == 0
@@ -0,0 +1,122 @@
+"""attachment.open_attachment against a local HTTP stand-in for Looker's download_url."""
+import base64
+import http.server
+import io
+import threading
+import zipfile
+
+import pytest
+
+import attachment
+from execute import convertname
+from workspace import WorkspaceQuotaExceeded, request_workspace
+
+
+def make_csv_zip():
+    payload = io.BytesIO()
+    with zipfile.ZipFile(payload, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr("dashboard/sales.csv", "region,amount\n" + "".join(f"r{i},{i * 1.5}\n" for i in range(2000)))
+        zip_ref.writestr("dashboard/costs.csv", "item,cost\nrent,100\npower,25.5\n")
+    return payload.getvalue()
+
+
+@pytest.fixture
+def serve_payload():
+    """Serve bytes over HTTP on localhost, as Looker's download_url does; yields a function returning the URL."""
+    servers = []
+
+    def serve(payload, content_length=True):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.0" # Without Content-Length the body ends when the connection closes
+
+            def do_GET(self):
+                self.send_response(200)
+                if content_length:
+                    self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/payload.zip"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def workbook_parts(workbook_bytes):
+    """The workbook's zip members, less the document properties that carry a creation time."""
+    with zipfile.ZipFile(io.BytesIO(workbook_bytes)) as workbook:
+        return {name: workbook.read(name) for name in workbook.namelist() if not name.startswith("docProps/")}
+
+
+def convert(request_json):
+    output = io.BytesIO()
+    with request_workspace() as workspace:
+        convertname(request_json, output, workspace)
+    return output.getvalue()
+
+
+def test_download_produces_the_same_workbook_as_inline(serve_payload):
+    payload = make_csv_zip()
+    downloaded = convert({"scheduled_plan": {"download_url": serve_payload(payload)}})
+    inline = convert({"attachment": {"data": base64.b64encode(payload).decode()}})
+    assert workbook_parts(downloaded) == workbook_parts(inline)
+
+
+@pytest.mark.parametrize("content_length", [True, False])
+def test_download_max_bytes_rejects_oversized_payloads(serve_payload, monkeypatch, content_length):
+    payload = make_csv_zip()
+    monkeypatch.setenv("DOWNLOAD_MAX_BYTES", str(len(payload) - 1))
+    monkeypatch.setenv("DOWNLOAD_CHUNK_BYTES", "1024")
+    request_json = {"scheduled_plan": {"download_url": serve_payload(payload, content_length)}}
+    with pytest.raises(ValueError, match="limit"):
+        attachment.open_attachment(request_json)
+
+
+def test_download_within_max_bytes_is_spooled(serve_payload, monkeypatch):
+    payload = make_csv_zip()
+    monkeypatch.setenv("DOWNLOAD_MAX_BYTES", str(len(payload)))
+    monkeypatch.setenv("DOWNLOAD_SPOOL_BYTES", "1024")
+    stream = attachment.open_attachment({"scheduled_plan": {"download_url": serve_payload(payload)}})
+    with stream:
+        assert stream.read() == payload
+
+
+@pytest.mark.parametrize("content_length", [True, False])
+def test_download_spilling_past_the_workspace_quota_is_refused(serve_payload, monkeypatch, content_length):
+    payload = make_csv_zip()
+    monkeypatch.setenv("DOWNLOAD_SPOOL_BYTES", "1024")
+    monkeypatch.setenv("DOWNLOAD_CHUNK_BYTES", "1024")
+    request_json = {"scheduled_plan": {"download_url": serve_payload(payload, content_length)}}
+    with pytest.raises(WorkspaceQuotaExceeded):
+        attachment.open_attachment(request_json, quota_bytes=len(payload) - 1)
+
+
+def test_download_held_in_memory_takes_no_quota(serve_payload, monkeypatch):
+    payload = make_csv_zip()
+    monkeypatch.setenv("DOWNLOAD_SPOOL_BYTES", str(len(payload)))
+    stream = attachment.open_attachment({"scheduled_plan": {"download_url": serve_payload(payload)}}, quota_bytes=0)
+    with stream:
+        assert stream.read() == payload
+
+
+def test_inline_data_is_used_without_a_url(monkeypatch):
+    def no_download(*args, **kwargs):
+        raise AssertionError("requests.get called without a download_url")
+
+    monkeypatch.setattr(attachment.requests, "get", no_download)
+    payload = make_csv_zip()
+    request_json = {"scheduled_plan": {"scheduled_plan_id": 7}, "attachment": {"data": base64.b64encode(payload).decode()}}
+    assert attachment.open_attachment(request_json).read() == payload
+
+
+def test_missing_attachment_without_a_url_is_an_error():
+    with pytest.raises(ValueError, match="attachment"):
+        attachment.open_attachment({"scheduled_plan": {}})
@@ -0,0 +1,117 @@
+"""Cell types written by each conversion engine."""
+import importlib.util
+import io
+import zipfile
+from xml.etree import ElementTree
+
+import pytest
+
+from convert import CsvSource, csv_files_to_excel, get_parse_pool
+from schema import ColumnTyping
+from workspace import WorkspaceQuotaExceeded
+
+NS = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+ENGINES = ["streaming", "pandas"] + (["pyarrow"] if importlib.util.find_spec("pyarrow") else [])
+
+
+def csv_source(name, text):
+    data = text.encode()
+    return CsvSource(name, lambda: io.BytesIO(data), len(data))
+
+
+def sheet_cells(workbook_bytes, sheet=1):
+    """Map each cell reference of a worksheet to its value: a float for number cells, else a str."""
+    with zipfile.ZipFile(io.BytesIO(workbook_bytes)) as workbook:
+        shared = []
+        if "xl/sharedStrings.xml" in workbook.namelist():
+            root = ElementTree.fromstring(workbook.read("xl/sharedStrings.xml"))
+            shared = ["".join(node.itertext()) for node in root.findall("x:si", NS)]
+        root = ElementTree.fromstring(workbook.read(f"xl/worksheets/sheet{sheet}.xml"))
+    cells = {}
+    for cell in root.iter(f"{{{NS['x']}}}c"):
+        kind, value = cell.get("t"), cell.find("x:v", NS)
+        if kind == "s":
+            cells[cell.get("r")] = shared[int(value.text)]
+        elif kind == "inlineStr":
+            cells[cell.get("r")] = "".join(cell.find("x:is", NS).itertext())
+        elif kind == "str":
+            cells[cell.get("r")] = value.text
+        elif value is not None:
+            cells[cell.get("r")] = float(value.text)
+    return cells
+
+
+def convert(text, engine, mode="infer"):
+    output = io.BytesIO()
+    csv_files_to_excel([csv_source("tile.csv", text)], output, engine=engine, column_typing=ColumnTyping(mode))
+    return sheet_cells(output.getvalue())
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_leading_zero_codes_stay_text(engine):
+    cells = convert("code,amount\n007,1.5\nb,2\nc,3\n", engine)
+    assert [cells["A2"], cells["A3"], cells["A4"]] == ["007", "b", "c"]
+    assert [cells["B2"], cells["B3"], cells["B4"]] == [1.5, 2.0, 3.0]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_header_is_text_and_empty_cells_are_blank(engine):
+    cells = convert("2024,name\n1,\n,x\n", engine)
+    assert cells["A1"] == "2024" and cells["B1"] == "name"
+    assert cells["A2"] == 1.0 and "B2" not in cells
+    assert "A3" not in cells and cells["B3"] == "x"
+
+
+def test_streaming_keeps_late_text_in_a_number_column(monkeypatch):
+    monkeypatch.setenv("CONVERSION_SNIFF_ROWS", "3")
+    text = "amount\n" + "".join(f"{i}\n" for i in range(5)) + "n/a\n"
+    cells = convert(text, "streaming")
+    assert cells["A2"] == 0.0 and cells["A7"] == "n/a"
+
+
+def test_raw_mode_writes_every_cell_as_text():
+    cells = convert("amount\n1.5\n", "streaming", mode="raw")
+    assert cells["A2"] == "1.5"
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_check_space_runs_before_each_sheet(engine):
+    calls = []
+    sources = [csv_source("a.csv", "x\n1\n"), csv_source("b.csv", "x\n2\n")]
+    csv_files_to_excel(sources, io.BytesIO(), engine=engine, check_space=lambda: calls.append(len(calls)))
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("engine", ["streaming"] + (["pyarrow"] if "pyarrow" in ENGINES else []))
+def test_quota_refusal_while_splitting_a_tile_is_not_wrapped(engine, monkeypatch):
+    monkeypatch.setenv("CONVERSION_MAX_SHEET_ROWS", "2")
+    calls = []
+
+    def check_space():
+        calls.append(1)
+        if len(calls) > 1:
+            raise WorkspaceQuotaExceeded("full")
+
+    with pytest.raises(WorkspaceQuotaExceeded):
+        csv_files_to_excel([csv_source("a.csv", "x\n1\n2\n3\n")], io.BytesIO(), engine=engine, check_space=check_space)
+
+
+def test_parse_pool_defaults_per_engine(monkeypatch):
+    monkeypatch.delenv("CONVERSION_POOL", raising=False)
+    assert get_parse_pool("streaming") == "process"
+    assert get_parse_pool("pandas") == "thread"
+    monkeypatch.setenv("CONVERSION_POOL", "thread")
+    assert get_parse_pool("streaming") == "thread"
+
+
+def test_streaming_parses_ahead_by_default(monkeypatch):
+    monkeypatch.delenv("CONVERSION_POOL", raising=False)
+    tiles = [csv_source(f"t{i}.csv", "code,n\n" + "".join(f"0{j},{j}\n" for j in range(50))) for i in range(3)]
+    workbooks = {}
+    for workers in ("1", "2"):
+        monkeypatch.setenv("CONVERSION_WORKERS", workers)
+        output = io.BytesIO()
+        csv_files_to_excel(tiles, output, engine="streaming")
+        workbooks[workers] = [sheet_cells(output.getvalue(), sheet) for sheet in (1, 2, 3)]
+    assert workbooks["2"] == workbooks["1"]
+    assert workbooks["2"][2]["A3"] == "01" and workbooks["2"][2]["B3"] == 1.0
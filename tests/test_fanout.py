@@ -0,0 +1,93 @@
+"""Fan-out: one converted workbook uploaded to several destinations."""
+import os
+import threading
+
+import pytest
+
+import fanout
+from fanout import Destination
+from sftp import UploadResult
+
+
+def test_parse_destinations():
+    text = "# partners\npartner_a@sftp.example.com:2222 /inbound/sales.xlsx\n\n  b@10.0.0.5 /drop/Sales Report.xlsx  \n"
+    assert fanout.parse_destinations(text) == [
+        Destination("sftp.example.com", 2222, "partner_a", "/inbound/sales.xlsx"),
+        Destination("10.0.0.5", 22, "b", "/drop/Sales Report.xlsx"),
+    ]
+    assert fanout.parse_destinations(None) == []
+    with pytest.raises(ValueError, match="line 2"):
+        fanout.parse_destinations("a@h /x.xlsx\nmissing-filename@h")
+    with pytest.raises(ValueError, match="out of range"):
+        fanout.parse_destinations("a@h:70000 /x.xlsx")
+
+
+def test_uploads_per_host_are_limited(monkeypatch, tmp_path):
+    monkeypatch.setenv("DELIVERY_UPLOADS_PER_HOST", "1")
+    monkeypatch.setattr(fanout, "_host_slots", {})
+    monkeypatch.setattr(fanout.upload_coalescer, "window", 0)
+    lock, running, peak = threading.Lock(), {}, {}
+
+    def upload_file_sftp(host, port, username, reader, filename, **kwargs):
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), running[host])
+        threading.Event().wait(0.05)
+        data = reader.read()
+        with lock:
+            running[host] -= 1
+        return UploadResult(len(data), "0", 1, 0)
+
+    monkeypatch.setattr(fanout, "upload_file_sftp", upload_file_sftp)
+    workbook = tmp_path / "out.xlsx"
+    workbook.write_bytes(b"x" * 1000)
+    destinations = [Destination(host, 22, "u", f"/{n}.xlsx") for host in ("a", "b") for n in range(3)]
+    with open(workbook, "rb") as local_file:
+        results = fanout.upload_to_destinations(local_file, destinations, None)
+    assert [results[destination]["size"] for destination in destinations] == [1000] * 6
+    assert peak == {"a": 1, "b": 1}
+
+
+def destination_lines(server, *filenames):
+    return "\n".join(f"looker@127.0.0.1:{server.port} {filename}" for filename in filenames)
+
+
+def test_workbook_is_delivered_to_every_destination(make_body, sftp_server, execute):
+    for directory in ("a", "b"):
+        os.mkdir(os.path.join(sftp_server.root, directory))
+    body = make_body(sftp_server.port, destinations=destination_lines(sftp_server, "/a/out.xlsx", "/b/out.xlsx", "/out.xlsx"))
+    status, response = execute(body)
+    assert status == 200, response
+    # The repeated first destination is dropped.
+    assert [(result["filename"], result["status"]) for result in response["destinations"]] == [
+        ("/out.xlsx", "success"), ("/a/out.xlsx", "success"), ("/b/out.xlsx", "success")
+    ]
+    copies = set()
+    for name in ("out.xlsx", "a/out.xlsx", "b/out.xlsx"):
+        with open(os.path.join(sftp_server.root, name), "rb") as copy:
+            copies.add(copy.read())
+    assert len(copies) == 1
+    assert len({result["sha256"] for result in response["destinations"]}) == 1
+
+
+def test_failed_destination_does_not_stop_the_others(make_body, sftp_server, execute):
+    body = make_body(sftp_server.port, destinations=destination_lines(sftp_server, "/missing/out.xlsx"))
+    status, response = execute(body)
+    assert status == 500
+    assert "1 of 2 destinations" in response["error"]
+    delivered, failed = response["destinations"]
+    assert delivered["status"] == "success" and os.path.exists(os.path.join(sftp_server.root, "out.xlsx"))
+    assert failed["status"] == "failure" and failed["retryable"] is False
+
+    # Once the destination is fixed, a retry only uploads what is missing.
+    os.mkdir(os.path.join(sftp_server.root, "missing"))
+    status, response = execute(body)
+    assert status == 200
+    assert [result["duplicate"] for result in response["destinations"]] == [True, False]
+    assert os.path.exists(os.path.join(sftp_server.root, "missing", "out.xlsx"))
+
+
+def test_malformed_destinations_are_refused(make_body, execute):
+    status, response = execute(make_body(destinations="not a destination"))
+    assert status == 400
+    assert "Invalid destinations" in response["error"]
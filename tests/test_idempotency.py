@@ -0,0 +1,101 @@
+"""Duplicate delivery detection: the in-process ledger and the remote digest file."""
+import os
+import threading
+
+import pytest
+
+import idempotency
+
+
+def test_successful_delivery_is_cached():
+    ledger = idempotency.DeliveryLedger(ttl=60, maxsize=8, wait=1)
+    with ledger.claim("key") as claim:
+        assert not claim.cached
+        claim.result = {"status": "success"}
+    with ledger.claim("key") as claim:
+        assert claim.cached and claim.result == {"status": "success"}
+
+
+def test_failed_delivery_is_not_cached():
+    ledger = idempotency.DeliveryLedger(ttl=60, maxsize=8, wait=1)
+    with pytest.raises(RuntimeError):
+        with ledger.claim("key"):
+            raise RuntimeError("upload failed")
+    with ledger.claim("key") as claim:
+        assert not claim.cached
+    assert ledger.stats() == {"in_flight": 0, "cached_results": 0}
+
+
+def test_concurrent_claim_waits_for_the_running_delivery():
+    ledger = idempotency.DeliveryLedger(ttl=60, maxsize=8, wait=10)
+    running, seen = threading.Event(), {}
+
+    def second():
+        with ledger.claim("key") as claim:
+            seen["cached"], seen["result"] = claim.cached, claim.result
+
+    with ledger.claim("key") as claim:
+        waiter = threading.Thread(target=second)
+        waiter.start()
+        waiter.join(0.2)
+        assert waiter.is_alive() # Blocked behind the first claim
+        claim.result = {"status": "success"}
+    waiter.join(5)
+    assert seen == {"cached": True, "result": {"status": "success"}}
+
+
+def test_claim_gives_up_after_the_wait_limit():
+    ledger = idempotency.DeliveryLedger(ttl=60, maxsize=8, wait=0)
+    with ledger.claim("key"):
+        with pytest.raises(idempotency.DeliveryInProgress):
+            with ledger.claim("key"):
+                pass
+
+
+def test_delivery_key_depends_on_plan_destination_and_contents():
+    request_json = {"scheduled_plan": {"scheduled_plan_id": 7, "title": "Sales"}}
+    key = idempotency.delivery_key(request_json, ["h", 22, "u", "/a.xlsx"], "digest")
+    assert key == idempotency.delivery_key({"scheduled_plan": {"scheduled_plan_id": 7}}, ["h", 22, "u", "/a.xlsx"], "digest")
+    assert key != idempotency.delivery_key({"scheduled_plan": {"scheduled_plan_id": 8}}, ["h", 22, "u", "/a.xlsx"], "digest")
+    assert key != idempotency.delivery_key(request_json, ["h", 22, "u", "/b.xlsx"], "digest")
+    assert key != idempotency.delivery_key(request_json, ["h", 22, "u", "/a.xlsx"], "other")
+
+
+def test_duplicate_execute_is_not_uploaded_again(make_body, sftp_server, execute):
+    body = make_body(sftp_server.port)
+    status, response = execute(body)
+    assert status == 200 and response["destinations"][0]["duplicate"] is False
+    remote = os.path.join(sftp_server.root, "out.xlsx")
+    os.remove(remote)
+
+    status, response = execute(body)
+    assert status == 200
+    assert response["destinations"][0]["duplicate"] is True
+    assert "nothing was re-sent" in response["message"]
+    assert not os.path.exists(remote)
+
+    # Different contents are a different delivery.
+    status, response = execute(make_body(sftp_server.port, rows=10))
+    assert status == 200 and response["destinations"][0]["duplicate"] is False
+    assert os.path.exists(remote)
+
+
+def test_remote_digest_survives_a_new_instance(make_body, monkeypatch, sftp_server, execute):
+    monkeypatch.setenv("IDEMPOTENCY_REMOTE_DIGEST", "1")
+    body = make_body(sftp_server.port)
+    assert execute(body)[0] == 200
+    assert os.path.exists(os.path.join(sftp_server.root, "out.xlsx" + idempotency.REMOTE_DIGEST_SUFFIX))
+
+    monkeypatch.setattr(idempotency, "_ledger", None) # As on a fresh instance
+    status, response = execute(body)
+    assert status == 200 and response["destinations"][0]["duplicate"] is True
+
+
+def test_idempotency_off_uploads_every_time(make_body, monkeypatch, sftp_server, execute):
+    monkeypatch.setenv("IDEMPOTENCY", "false")
+    body = make_body(sftp_server.port)
+    assert execute(body)[0] == 200
+    os.remove(os.path.join(sftp_server.root, "out.xlsx"))
+    status, response = execute(body)
+    assert status == 200 and response["destinations"][0]["duplicate"] is False
+    assert os.path.exists(os.path.join(sftp_server.root, "out.xlsx"))
@@ -0,0 +1,37 @@
+"""The job queue interface and the local backend."""
+import threading
+
+import pytest
+
+import jobs
+
+
+class SubmitOnly(jobs.JobQueue):
+    def submit(self, kind, payload):
+        return "job"
+
+
+def test_incomplete_backend_fails_when_instantiated(monkeypatch):
+    with pytest.raises(TypeError, match="status"):
+        SubmitOnly()
+    monkeypatch.setenv("JOB_QUEUE_BACKEND", f"{__name__}:SubmitOnly")
+    with pytest.raises(TypeError):
+        jobs.get_job_queue()
+
+
+def test_local_queue_runs_jobs_and_refuses_when_full():
+    release = threading.Event()
+    jobs.register_handler("test-wait", lambda payload: release.wait(10) and payload)
+    queue = jobs.LocalJobQueue(max_workers=1, max_pending=1, retention=60)
+    try:
+        first = queue.submit("test-wait", {"n": 1})
+        second = queue.submit("test-wait", {"n": 2})
+        with pytest.raises(jobs.JobQueueFull):
+            queue.submit("test-wait", {"n": 3})
+        assert queue.status(second)["status"] == jobs.QUEUED
+    finally:
+        release.set()
+        queue.shutdown(wait=True)
+    assert queue.status(first)["result"] == {"n": 1}
+    assert queue.status(second)["status"] == jobs.SUCCEEDED
+    assert queue.status("unknown") is None
@@ -0,0 +1,121 @@
+"""Uploads against the LocalSFTPServer stand-in: retries, resume and the .part rename."""
+import hashlib
+import io
+import os
+
+import pytest
+
+import sftp
+import transfer
+from credentials import load_private_key
+from sftp_pool import connection_pool
+
+NO_WAIT = transfer.RetryPolicy(max_tries=3, base_seconds=0, max_seconds=0, max_time=60, resume=True, verify="size")
+
+
+@pytest.fixture
+def key(private_key):
+    return load_private_key(private_key)
+
+
+@pytest.fixture
+def data():
+    return os.urandom(3 * 1024 * 1024 + 123)
+
+
+def upload(server, key, data, remote="/out.bin", policy=NO_WAIT):
+    return sftp.upload_file_sftp("127.0.0.1", server.port, "looker", io.BytesIO(data), remote, private_key=key, retry_policy=policy)
+
+
+def remote_files(server):
+    return sorted(os.listdir(server.root))
+
+
+def read_remote(server, name="out.bin"):
+    with open(os.path.join(server.root, name), "rb") as remote:
+        return remote.read()
+
+
+def test_upload_is_renamed_into_place(sftp_server, key, data):
+    with open(os.path.join(sftp_server.root, "out.bin"), "wb") as previous:
+        previous.write(b"previous")
+    result = upload(sftp_server, key, data)
+    assert (result.size, result.sha256, result.attempts, result.resumed_from) == (len(data), hashlib.sha256(data).hexdigest(), 1, 0)
+    assert read_remote(sftp_server) == data
+    assert remote_files(sftp_server) == ["out.bin"]
+
+
+def test_resume_rewinds_past_writes_that_may_be_missing(sftp_server, key, data):
+    profile = transfer.get_transfer_profile()
+    part = transfer.partial_path("/out.bin", hashlib.sha256(data).hexdigest())
+    # A dropped pipelined upload: the partial file's size hides a hole just below its end.
+    partial = bytearray(data[:2 * 1024 * 1024])
+    partial[-profile.chunk_size * 2:-profile.chunk_size] = bytes(profile.chunk_size)
+    with open(os.path.join(sftp_server.root, part.lstrip("/")), "wb") as part_file:
+        part_file.write(partial)
+
+    result = upload(sftp_server, key, data)
+    assert result.resumed_from == len(partial) - profile.max_outstanding_requests * profile.chunk_size
+    assert read_remote(sftp_server) == data
+    assert remote_files(sftp_server) == ["out.bin"]
+
+
+def test_partial_file_larger_than_the_upload_is_rewritten(sftp_server, key, data):
+    part = transfer.partial_path("/out.bin", hashlib.sha256(data).hexdigest())
+    with open(os.path.join(sftp_server.root, part.lstrip("/")), "wb") as part_file:
+        part_file.write(data + b"garbage")
+    assert upload(sftp_server, key, data).resumed_from == 0
+    assert read_remote(sftp_server) == data
+
+
+def test_failed_attempt_is_retried_on_a_new_session(sftp_server, key, data, monkeypatch):
+    real_attempt, clients = sftp._upload_attempt, []
+
+    def flaky_attempt(sftp_client, *args):
+        clients.append(sftp_client)
+        if len(clients) == 1:
+            raise EOFError("connection dropped")
+        return real_attempt(sftp_client, *args)
+
+    monkeypatch.setattr(sftp, "_upload_attempt", flaky_attempt)
+    result = upload(sftp_server, key, data)
+    assert result.attempts == 2
+    assert clients[0] is not clients[1]
+    assert read_remote(sftp_server) == data
+    assert connection_pool.stats()["open"] == 1 # Only the session that worked is kept
+
+
+def test_missing_directory_is_not_retried(sftp_server, key, data):
+    with pytest.raises(sftp.UploadError) as failure:
+        upload(sftp_server, key, data, remote="/missing/out.bin")
+    assert failure.value.attempts == 1 and not failure.value.retryable
+
+
+def test_failed_verification_removes_the_partial_file(sftp_server, key, data, monkeypatch):
+    def wrong_size(*args):
+        raise transfer.UploadVerificationError("size mismatch")
+
+    monkeypatch.setattr(sftp, "verify_upload", wrong_size)
+    with pytest.raises(sftp.UploadError):
+        upload(sftp_server, key, data, policy=NO_WAIT._replace(max_tries=1))
+    assert remote_files(sftp_server) == []
+
+
+def test_streamed_output_replaces_the_file_only_when_complete(sftp_server, key):
+    with open(os.path.join(sftp_server.root, "out.xlsx"), "wb") as previous:
+        previous.write(b"previous")
+
+    def fail_midway(writer):
+        writer.write(os.urandom(200000))
+        raise ValueError("conversion failed")
+
+    with pytest.raises(ValueError):
+        sftp.stream_file_sftp("127.0.0.1", sftp_server.port, "looker", fail_midway, "/out.xlsx", private_key=key)
+    assert remote_files(sftp_server) == ["out.xlsx"]
+    assert read_remote(sftp_server, "out.xlsx") == b"previous"
+
+    payload = os.urandom(500000)
+    result = sftp.stream_file_sftp("127.0.0.1", sftp_server.port, "looker", lambda writer: writer.write(payload), "/out.xlsx", private_key=key)
+    assert (result.size, result.sha256) == (len(payload), hashlib.sha256(payload).hexdigest())
+    assert remote_files(sftp_server) == ["out.xlsx"]
+    assert read_remote(sftp_server, "out.xlsx") == payload
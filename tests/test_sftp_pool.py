@@ -0,0 +1,97 @@
+"""SFTPConnectionPool: reuse, liveness probes and per-host limits."""
+import threading
+
+import paramiko
+import pytest
+
+from sftp_pool import PooledSession, SFTPConnectionPool
+
+
+class FakeSession(PooledSession):
+    """A PooledSession without a connection; is_alive waits for probe_done when given one."""
+
+    def __init__(self, key, alive=True, probe_done=None):
+        super().__init__(key, None, None)
+        self.alive = alive
+        self.probe_done = probe_done
+        self.probing = threading.Event()
+        self.closed = False
+
+    def is_alive(self):
+        self.probing.set()
+        if self.probe_done is not None:
+            self.probe_done.wait(10)
+        return self.alive
+
+    def close(self):
+        self.closed = True
+
+
+def seed(pool, session):
+    """Put session in pool as if it had been opened and released."""
+    with pool._condition:
+        pool._open_per_host[session.host_key] = pool._open_per_host.get(session.host_key, 0) + 1
+    pool.release(session)
+
+
+def no_connect():
+    raise AssertionError("connect called while an idle session was available")
+
+
+def test_slow_probe_does_not_block_other_hosts():
+    pool = SFTPConnectionPool(idle_ttl=60, max_per_host=2, keepalive=0, acquire_timeout=5)
+    probe_done = threading.Event()
+    slow = FakeSession(("slow.example", 22, "u", "k"), probe_done=probe_done)
+    fast = FakeSession(("fast.example", 22, "u", "k"))
+    seed(pool, slow)
+    seed(pool, fast)
+
+    slow_acquire = threading.Thread(target=pool.acquire, args=(slow.key, no_connect))
+    slow_acquire.start()
+    assert slow.probing.wait(5)
+    try:
+        # The slow host's probe is still running; other hosts and the counters are not held up.
+        assert pool.acquire(fast.key, no_connect) is fast
+        pool.release(fast)
+        assert pool.stats()["hits"] == 1
+    finally:
+        probe_done.set()
+        slow_acquire.join(5)
+    assert pool.stats()["hits"] == 2
+
+
+def test_dead_idle_session_is_replaced_and_counted_stale():
+    pool = SFTPConnectionPool(idle_ttl=60, max_per_host=1, keepalive=0, acquire_timeout=5)
+    dead = FakeSession(("sftp.example", 22, "u", "k"), alive=False)
+    seed(pool, dead)
+    replacement = FakeSession(dead.key)
+    opened = []
+
+    def connect():
+        opened.append(True)
+        raise ConnectionError("stop before open_sftp")
+
+    with pytest.raises(ConnectionError):
+        pool.acquire(dead.key, connect)
+    assert dead.closed and opened
+    assert pool.stats() == {"hits": 0, "misses": 1, "stale": 1, "evictions": 0, "idle": 0, "open": 0}
+    seed(pool, replacement)
+    assert pool.acquire(dead.key, no_connect) is replacement
+
+
+def test_closed_sftp_channel_is_detected(sftp_server):
+    pool = SFTPConnectionPool(idle_ttl=60, max_per_host=1, keepalive=0, acquire_timeout=5)
+    pool_key = ("127.0.0.1", sftp_server.port, "u", "password")
+
+    def connect():
+        ssh_client = paramiko.SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh_client.connect("127.0.0.1", port=sftp_server.port, username="u", password="p", look_for_keys=False, allow_agent=False)
+        return ssh_client
+
+    session = pool.acquire(pool_key, connect)
+    assert session.is_alive()
+    session.sftp_client.get_channel().close()
+    assert not session.is_alive()
+    pool.discard(session)
+    assert pool.stats()["open"] == 0
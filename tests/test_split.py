@@ -0,0 +1,74 @@
+"""Tiles longer than a sheet: split across sheets or bundled workbooks."""
+import io
+import os
+import re
+import zipfile
+
+import pytest
+
+from convert import MAX_SHEET_NAME_LENGTH, csv_files_to_excel, split_rows, unique_sheet_name
+from test_convert import ENGINES, csv_source, sheet_cells
+
+
+def sheet_names(workbook):
+    with zipfile.ZipFile(workbook) as workbook_zip:
+        return re.findall(r'<sheet name="([^"]+)"', workbook_zip.read("xl/workbook.xml").decode())
+
+
+def rows(count):
+    return "n\n" + "".join(f"{i}\n" for i in range(count))
+
+
+def test_unique_sheet_name_suffixes_and_ignores_case():
+    used = set()
+    assert unique_sheet_name("Sales", used) == "Sales"
+    assert unique_sheet_name("sales", used) == "sales_2"
+    assert unique_sheet_name("Sales_2", used) == "Sales_2_2"
+    assert unique_sheet_name("Sales", used) == "Sales_3"
+    long_name = "x" * MAX_SHEET_NAME_LENGTH
+    assert unique_sheet_name(long_name, used) == long_name
+    assert unique_sheet_name(long_name, used) == "x" * (MAX_SHEET_NAME_LENGTH - 2) + "_2"
+
+
+def test_split_rows_leaves_room_for_the_header():
+    assert [list(chunk) for chunk in split_rows(range(5), 3)] == [[0, 1], [2, 3], [4]]
+    assert [list(chunk) for chunk in split_rows(range(4), 3)] == [[0, 1], [2, 3]]
+    assert [list(chunk) for chunk in split_rows([], 3)] == [[]]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_long_tile_continues_on_suffixed_sheets(engine, monkeypatch):
+    monkeypatch.setenv("CONVERSION_MAX_SHEET_ROWS", "3")
+    output = io.BytesIO()
+    # 'tile_2' is taken by a tile of its own, so the second part is suffixed again.
+    sources = [csv_source("tile_2.csv", rows(1)), csv_source("tile.csv", rows(5))]
+    workbooks = csv_files_to_excel(sources, output, engine=engine, split="sheet")
+    assert len(workbooks) == 1
+    assert sheet_names(output) == ["tile_2", "tile", "tile_2_2", "tile_3"]
+    continued = [sheet_cells(output.getvalue(), sheet) for sheet in (2, 3, 4)]
+    assert [cells["A1"] for cells in continued] == ["n"] * 3
+    assert [cells.get("A2") for cells in continued] == [0.0, 2.0, 4.0]
+    assert [cells.get("A3") for cells in continued] == [1.0, 3.0, None]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_long_tile_continues_in_further_workbooks(engine, monkeypatch, tmp_path):
+    monkeypatch.setenv("CONVERSION_MAX_SHEET_ROWS", "3")
+    sources = [csv_source("short.csv", rows(1)), csv_source("tile.csv", rows(5))]
+    workbooks = csv_files_to_excel(sources, str(tmp_path / "tabbed.xlsx"), engine=engine, tmpdir=str(tmp_path), split="workbook")
+    assert len(workbooks) == 3
+    assert [sheet_names(workbook) for workbook in workbooks] == [["short", "tile"], ["tile"], ["tile"]]
+    with open(workbooks[2], "rb") as last:
+        assert sheet_cells(last.read()) == {"A1": "n", "A2": 4.0}
+
+
+def test_split_workbooks_are_delivered_as_one_bundle(make_body, monkeypatch, sftp_server, execute):
+    monkeypatch.setenv("CONVERSION_MAX_SHEET_ROWS", "1000")
+    monkeypatch.setenv("CONVERSION_SPLIT", "workbook")
+    status, response = execute(make_body(sftp_server.port, filename="/Sales Report.xlsx", rows=2500))
+    assert status == 200, response
+    assert response["destinations"][0]["filename"] == "/Sales Report.zip"
+    assert os.listdir(sftp_server.root) == ["Sales Report.zip"]
+    with zipfile.ZipFile(os.path.join(sftp_server.root, "Sales Report.zip")) as bundle:
+        assert bundle.namelist() == ["Sales Report.xlsx", "Sales Report_2.xlsx", "Sales Report_3.xlsx"]
+        assert [sheet_names(io.BytesIO(bundle.read(name))) for name in bundle.namelist()] == [["sales"]] * 3
@@ -0,0 +1,71 @@
+"""Request workspaces: orphan cleanup and the quota."""
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import workspace
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setenv("WORKSPACE_ROOT", str(tmp_path))
+    return tmp_path
+
+
+def make_dir(root, name, age=0):
+    path = root / name
+    path.mkdir()
+    (path / "tabbed.xlsx").write_bytes(b"x" * 100)
+    if age:
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+    return path
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_removes_workspaces_of_dead_processes(root):
+    path = make_dir(root, f"req-{dead_pid()}-abc")
+    assert workspace.cleanup_orphans(max_age=3600) == 100
+    assert not path.exists()
+
+
+def test_keeps_old_workspaces_of_live_processes(root):
+    parent = make_dir(root, f"req-{os.getppid()}-abc", age=7200)
+    own = make_dir(root, f"req-{os.getpid()}-abc", age=7200)
+    assert workspace.cleanup_orphans(max_age=60) == 0
+    assert parent.exists() and own.exists()
+
+
+def test_removes_stale_workspaces_without_a_pid(root):
+    stale = make_dir(root, "req-unknown", age=7200)
+    fresh = make_dir(root, "req-other")
+    unrelated = make_dir(root, "keep-me", age=7200)
+    workspace.cleanup_orphans(max_age=3600)
+    assert not stale.exists()
+    assert fresh.exists() and unrelated.exists()
+
+
+def test_remaining_bytes_counts_every_workspace(root, monkeypatch):
+    monkeypatch.setenv("WORKSPACE_QUOTA_BYTES", "1000")
+    make_dir(root, f"req-{os.getpid()}-other")
+    with workspace.request_workspace() as current:
+        assert current.remaining_bytes() == 900
+        with open(current.file_path("spool"), "wb") as spool:
+            spool.write(b"x" * 850)
+        assert current.remaining_bytes() == 50
+        with pytest.raises(workspace.WorkspaceQuotaExceeded):
+            current.check_quota(extra_bytes=51)
+
+
+def test_remaining_bytes_is_none_without_a_quota(root, monkeypatch):
+    monkeypatch.setenv("WORKSPACE_QUOTA_BYTES", "0")
+    with workspace.request_workspace() as current:
+        assert current.remaining_bytes() is None
@@ -0,0 +1,322 @@
+import collections
+import errno
+import hashlib
+import io
+import os
+
+import paramiko
+from paramiko.sftp import SFTPError
+
+from env import env_flag, env_int
+import log
+
+
+# Cipher preference profiles. Ciphers the installed paramiko does not
+# support are dropped, and paramiko's own order is used if none remain.
+CIPHER_PROFILES = {
+    "default": None,
+    # AES-GCM is an AEAD cipher, so there is no separate MAC pass per packet.
+    "fast": ("aes128-gcm@openssh.com", "aes256-gcm@openssh.com", "aes128-ctr", "aes256-ctr"),
+    "strong": ("aes256-gcm@openssh.com", "aes256-ctr"),
+}
+
+# Matches what OpenSSH's sftp client uses: 64 outstanding 32 KiB writes.
+DEFAULT_MAX_OUTSTANDING_REQUESTS = 64
+DEFAULT_CHUNK_SIZE = 32768
+DEFAULT_WINDOW_SIZE = 16 * 1024 * 1024
+DEFAULT_MAX_PACKET_SIZE = 32768
+
+
+TransferProfile = collections.namedtuple(
+    'TransferProfile',
+    ['max_outstanding_requests', 'chunk_size', 'window_size', 'max_packet_size', 'cipher_profile', 'compress'],
+    defaults=[DEFAULT_MAX_OUTSTANDING_REQUESTS, DEFAULT_CHUNK_SIZE, DEFAULT_WINDOW_SIZE,
+              DEFAULT_MAX_PACKET_SIZE, "default", False]
+)
+
+
+# Retry policy for upload_file_sftp: attempts, exponential backoff with full
+# jitter (base doubling per attempt, capped at max_seconds, all attempts
+# within max_time seconds), resume from a partial upload, and the check
+# made before the upload is renamed into place ('size', 'sha256', 'none').
+RetryPolicy = collections.namedtuple(
+    'RetryPolicy',
+    ['max_tries', 'base_seconds', 'max_seconds', 'max_time', 'resume', 'verify'],
+    defaults=[4, 1, 30, 300, True, "size"]
+)
+
+# Remote suffix for uploads in progress; see partial_path.
+PARTIAL_SUFFIX = ".part"
+
+
+class UploadVerificationError(IOError):
+    """The uploaded file does not match the local one."""
+
+
+def get_transfer_profile():
+    """Build the TransferProfile for this process from the environment.
+
+    SFTP_MAX_OUTSTANDING_REQUESTS: pipelined writes in flight (64).
+    SFTP_CHUNK_SIZE: bytes per SFTP write request (32768).
+    SFTP_WINDOW_SIZE / SFTP_MAX_PACKET_SIZE: SSH channel window and packet size.
+    SFTP_CIPHER_PROFILE: one of CIPHER_PROFILES ('default').
+    SFTP_COMPRESSION: 'true' to negotiate zlib transport compression.
+    """
+    cipher_profile = os.environ.get("SFTP_CIPHER_PROFILE", "default").strip().lower()
+    if cipher_profile not in CIPHER_PROFILES:
+        log.warning(f"Unknown SFTP_CIPHER_PROFILE '{cipher_profile}', using 'default'.")
+        cipher_profile = "default"
+    return TransferProfile(
+        max_outstanding_requests=env_int("SFTP_MAX_OUTSTANDING_REQUESTS", DEFAULT_MAX_OUTSTANDING_REQUESTS),
+        chunk_size=env_int("SFTP_CHUNK_SIZE", DEFAULT_CHUNK_SIZE),
+        window_size=env_int("SFTP_WINDOW_SIZE", DEFAULT_WINDOW_SIZE),
+        max_packet_size=env_int("SFTP_MAX_PACKET_SIZE", DEFAULT_MAX_PACKET_SIZE),
+        cipher_profile=cipher_profile,
+        compress=env_flag("SFTP_COMPRESSION", False),
+    )
+
+
+def get_retry_policy():
+    """Build the RetryPolicy for this process from the environment.
+
+    SFTP_UPLOAD_MAX_TRIES: attempts per upload, 1 disables retries (4).
+    SFTP_RETRY_BASE_SECONDS / SFTP_RETRY_MAX_SECONDS: backoff base and cap (1, 30).
+    SFTP_RETRY_MAX_TIME_SECONDS: give up once this much time has passed (300).
+    SFTP_RESUME: 'false' to write the remote file in place instead of
+        uploading to a partial name and renaming it (true).
+    SFTP_VERIFY: 'size' (default), 'sha256' to read the upload back, or 'none'.
+    """
+    verify = os.environ.get("SFTP_VERIFY", "size").strip().lower()
+    if verify not in ("size", "sha256", "none"):
+        log.warning(f"Unknown SFTP_VERIFY '{verify}', using 'size'.")
+        verify = "size"
+    return RetryPolicy(
+        max_tries=env_int("SFTP_UPLOAD_MAX_TRIES", 4),
+        base_seconds=env_int("SFTP_RETRY_BASE_SECONDS", 1),
+        max_seconds=env_int("SFTP_RETRY_MAX_SECONDS", 30),
+        max_time=env_int("SFTP_RETRY_MAX_TIME_SECONDS", 300),
+        resume=env_flag("SFTP_RESUME", True),
+        verify=verify,
+    )
+
+
+def is_retryable(error):
+    """Classify an upload failure: True if trying again may succeed.
+
+    Bad credentials, host keys, permissions and missing paths fail the same
+    way every time. Dropped connections, timeouts, SSH protocol errors and
+    generic SFTP failures are worth another attempt.
+    """
+    if isinstance(error, (paramiko.AuthenticationException, paramiko.BadHostKeyException)):
+        return False
+    if isinstance(error, (PermissionError, FileNotFoundError, IsADirectoryError, NotADirectoryError)):
+        return False
+    if isinstance(error, OSError) and error.errno in (errno.EACCES, errno.ENOENT, errno.ENOSPC, errno.EDQUOT):
+        return False
+    return isinstance(error, (paramiko.SSHException, EOFError, SFTPError, OSError))
+
+
+def file_digest(local_file_obj, algorithm="sha256", chunk_size=1024 * 1024):
+    """Return the size and hex digest of a seekable binary file, leaving it rewound."""
+    digest = hashlib.new(algorithm)
+    size = 0
+    local_file_obj.seek(0)
+    for chunk in iter(lambda: local_file_obj.read(chunk_size), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    local_file_obj.seek(0)
+    return size, digest.hexdigest()
+
+
+def partial_path(remote_file_path, sha256):
+    """Name for a file being uploaded; the digest ties a partial upload to its content."""
+    return f"{remote_file_path}.{sha256[:16]}{PARTIAL_SUFFIX}"
+
+
+def remote_digest(sftp_client, remote_file_path, algorithm="sha256", chunk_size=1024 * 1024):
+    """Read a remote file back and return its hex digest."""
+    digest = hashlib.new(algorithm)
+    with sftp_client.open(remote_file_path, 'rb') as remote_file:
+        remote_file.prefetch()
+        for chunk in iter(lambda: remote_file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_upload(sftp_client, remote_file_path, size, sha256, verify="size"):
+    """Raise UploadVerificationError unless the remote file matches size (and sha256)."""
+    if verify == "none":
+        return
+    remote_size = sftp_client.stat(remote_file_path).st_size
+    if remote_size != size:
+        raise UploadVerificationError(f"Remote file '{remote_file_path}' is {remote_size} bytes, expected {size}.")
+    if verify == "sha256":
+        actual = remote_digest(sftp_client, remote_file_path)
+        if actual != sha256:
+            raise UploadVerificationError(f"Remote file '{remote_file_path}' has sha256 {actual}, expected {sha256}.")
+
+
+def rename_into_place(sftp_client, source_path, remote_file_path):
+    """Rename source_path to remote_file_path, replacing any existing file."""
+    try:
+        sftp_client.posix_rename(source_path, remote_file_path)
+    except IOError:
+        # Server lacks posix-rename@openssh.com; plain SFTP rename refuses to overwrite.
+        try:
+            sftp_client.remove(remote_file_path)
+        except IOError:
+            pass
+        sftp_client.rename(source_path, remote_file_path)
+
+
+def make_transport_factory(profile):
+    """Return a transport_factory for SSHClient.connect that applies profile.
+
+    The window and packet sizes apply to every channel opened on the
+    transport, including the SFTP channel, and the cipher order has to be
+    set before key exchange starts.
+    """
+    def transport_factory(sock, **kwargs):
+        transport = paramiko.Transport(
+            sock,
+            default_window_size=profile.window_size,
+            default_max_packet_size=profile.max_packet_size,
+            **kwargs
+        )
+        preferred = CIPHER_PROFILES.get(profile.cipher_profile)
+        if preferred:
+            options = transport.get_security_options()
+            supported = [cipher for cipher in preferred if cipher in options.ciphers]
+            if supported:
+                options.ciphers = supported
+        return transport
+    return transport_factory
+
+
+class PipelinedWriter:
+    """File-like writer that pipelines writes to an open paramiko SFTPFile.
+
+    The file is put in pipelined mode (SFTPFile.set_pipelined), so each
+    profile.chunk_size write is sent without waiting for its
+    acknowledgement and throughput is no longer capped at one chunk per
+    round trip on high-latency links. Every profile.max_outstanding_requests
+    chunks, and for the last chunk in close(), one write is sent with
+    pipelining off: paramiko then collects every outstanding
+    acknowledgement in order and raises the first failed write, so none is
+    dropped.
+    """
+
+    def __init__(self, remote_file, profile, offset=0):
+        self.remote_file = remote_file
+        self.profile = profile
+        self.offset = offset
+        self._buffer = bytearray()
+        self._unacknowledged = 0
+        if offset:
+            remote_file.seek(offset)
+        remote_file.set_pipelined(True)
+
+    def writable(self):
+        return True
+
+    def _send(self, data, wait=False):
+        wait = wait or self._unacknowledged + 1 >= self.profile.max_outstanding_requests
+        self.remote_file.set_pipelined(not wait)
+        self.remote_file.write(data)
+        self.remote_file.flush()
+        self.remote_file.set_pipelined(True)
+        self._unacknowledged = 0 if wait else self._unacknowledged + 1
+        self.offset += len(data)
+
+    def write(self, data):
+        # The last bytes are held back until close(), which sends them with
+        # pipelining off to check the acknowledgements still outstanding.
+        chunk_size = self.profile.chunk_size
+        self._buffer += data
+        while len(self._buffer) > chunk_size:
+            self._send(bytes(self._buffer[:chunk_size]))
+            del self._buffer[:chunk_size]
+        return len(data)
+
+    def flush(self):
+        """Nothing to do: full chunks are already sent and the rest waits for close()."""
+
+    def close(self):
+        if self._buffer:
+            self._send(bytes(self._buffer), wait=True)
+            self._buffer.clear()
+
+
+class ChecksumWriter:
+    """Forward-only writer that hashes and counts bytes on their way to raw.
+
+    It refuses to seek, so zipfile (and therefore xlsxwriter) writes the
+    archive strictly sequentially and the digest matches the bytes that
+    land at the destination.
+    """
+
+    def __init__(self, raw, algorithm="sha256"):
+        self.raw = raw
+        self.algorithm = algorithm
+        self.size = 0
+        self._hash = hashlib.new(algorithm)
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def seek(self, *args):
+        raise io.UnsupportedOperation("ChecksumWriter is not seekable")
+
+    def tell(self):
+        return self.size
+
+    def write(self, data):
+        self.raw.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        if hasattr(self.raw, "flush"):
+            self.raw.flush()
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def pipelined_write(sftp_client, local_file_obj, remote_file_path, profile, callback=None, offset=0):
+    """Copy local_file_obj to remote_file_path through a PipelinedWriter.
+
+    Args:
+        callback: Optional callable(bytes_so_far), called after each chunk is sent.
+        offset: Resume at this byte: local_file_obj is read from here and the
+            remote file is written from here without being truncated.
+
+    Returns:
+        The size of the remote file once written.
+    """
+    if offset:
+        local_file_obj.seek(offset)
+    with sftp_client.open(remote_file_path, 'r+b' if offset else 'wb') as remote_file:
+        writer = PipelinedWriter(remote_file, profile, offset)
+        while True:
+            data = local_file_obj.read(profile.chunk_size)
+            if not data:
+                break
+            writer.write(data)
+            if callback:
+                callback(writer.offset)
+        writer.close()
+    return writer.offset
+
+
+def upload_file(sftp_client, local_file, remote_file_path, profile=None):
+    """Upload a local file path or binary file object and return its size."""
+    profile = profile or get_transfer_profile()
+    if hasattr(local_file, "read"):
+        return pipelined_write(sftp_client, local_file, remote_file_path, profile)
+    with open(local_file, 'rb') as local_file_obj:
+        return pipelined_write(sftp_client, local_file_obj, remote_file_path, profile)
@@ -0,0 +1,192 @@
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from env import env_int
+import log
+
+
+DEFAULT_QUOTA_BYTES = 512 * 1024 * 1024
+DEFAULT_ORPHAN_AGE_SECONDS = 3600
+
+# Every request directory is named <prefix><pid>-<random>, so a directory
+# whose pid is no longer running belongs to a crashed process.
+WORKSPACE_PREFIX = "req-"
+
+_lock = threading.Lock()
+_active = {}  # path -> Workspace, for the requests running in this process
+_orphans_checked = False
+
+
+class WorkspaceQuotaExceeded(RuntimeError):
+    """Raised when the instance's temp workspaces would exceed WORKSPACE_QUOTA_BYTES."""
+
+
+def get_workspace_root():
+    """Return the directory that holds every request workspace (WORKSPACE_ROOT)."""
+    return os.environ.get("WORKSPACE_ROOT") or os.path.join(tempfile.gettempdir(), "looker_sftp_action")
+
+
+def get_quota_bytes():
+    """Return the per-instance byte quota for all workspaces (WORKSPACE_QUOTA_BYTES, 0 = unlimited)."""
+    return env_int("WORKSPACE_QUOTA_BYTES", DEFAULT_QUOTA_BYTES, minimum=0)
+
+
+def directory_size(path):
+    """Total size in bytes of the files under path."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass # Removed while we were walking
+    return total
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def cleanup_orphans(max_age=None):
+    """Remove workspaces left behind by crashed requests.
+
+    A workspace is an orphan when the process that created it is gone. One
+    whose name records no pid is an orphan once it is older than max_age
+    seconds (WORKSPACE_ORPHAN_AGE_SECONDS). A workspace whose process is
+    still running is never removed, however old: it may belong to another
+    worker sharing WORKSPACE_ROOT or to a long async delivery.
+
+    Returns:
+        The number of bytes freed.
+    """
+    if max_age is None:
+        max_age = env_int("WORKSPACE_ORPHAN_AGE_SECONDS", DEFAULT_ORPHAN_AGE_SECONDS, minimum=0)
+
+    root = get_workspace_root()
+    try:
+        entries = os.listdir(root)
+    except FileNotFoundError:
+        return 0
+
+    freed = 0
+    now = time.time()
+    for name in entries:
+        path = os.path.join(root, name)
+        if not name.startswith(WORKSPACE_PREFIX) or path in _active:
+            continue
+        try:
+            pid = int(name[len(WORKSPACE_PREFIX):].split("-", 1)[0])
+        except ValueError:
+            pid = None
+        try:
+            age = now - os.stat(path).st_mtime
+        except OSError:
+            continue
+        if pid is None:
+            orphaned = age > max_age
+        else:
+            orphaned = pid != os.getpid() and not _pid_alive(pid)
+        if orphaned:
+            size = directory_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            freed += size
+            log.info(f"Removed orphaned workspace {path} ({size} bytes, {age:.0f}s old).")
+    return freed
+
+
+def usage_report():
+    """Summarise temp storage: workspace bytes, quota and the /tmp filesystem."""
+    root = get_workspace_root()
+    report = {
+        "workspace_root": root,
+        "workspace_bytes": directory_size(root) if os.path.isdir(root) else 0,
+        "active_workspaces": len(_active),
+        "quota_bytes": get_quota_bytes(),
+    }
+    try:
+        disk = shutil.disk_usage(tempfile.gettempdir())
+        report.update({"tmp_total_bytes": disk.total, "tmp_used_bytes": disk.used, "tmp_free_bytes": disk.free})
+    except OSError:
+        pass
+    return report
+
+
+class Workspace:
+    """A per-request scratch directory under the workspace root."""
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def create(cls):
+        """Create a new workspace, removing orphans first on the first call in this process."""
+        global _orphans_checked
+        root = get_workspace_root()
+        os.makedirs(root, exist_ok=True)
+        with _lock:
+            if not _orphans_checked:
+                _orphans_checked = True
+                cleanup_orphans()
+            path = os.path.join(root, f"{WORKSPACE_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:12]}")
+            os.mkdir(path)
+            workspace = cls(path)
+            _active[path] = workspace
+        try:
+            workspace.check_quota()
+        except WorkspaceQuotaExceeded:
+            workspace.remove() # The caller never gets it to clean up
+            raise
+        return workspace
+
+    def file_path(self, name):
+        return os.path.join(self.path, name)
+
+    def size(self):
+        return directory_size(self.path)
+
+    def remaining_bytes(self):
+        """Bytes all workspaces may still grow by before the quota, or None without one."""
+        quota = get_quota_bytes()
+        if not quota:
+            return None
+        return max(0, quota - directory_size(get_workspace_root()))
+
+    def check_quota(self, extra_bytes=0):
+        """Raise WorkspaceQuotaExceeded if all workspaces plus extra_bytes pass the quota."""
+        quota = get_quota_bytes()
+        if not quota:
+            return
+        used = directory_size(get_workspace_root())
+        if used + extra_bytes > quota:
+            raise WorkspaceQuotaExceeded(
+                f"Temp workspace quota exceeded: {used + extra_bytes} bytes needed, quota is {quota} bytes."
+            )
+
+    def remove(self):
+        with _lock:
+            _active.pop(self.path, None)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def request_workspace():
+    """Yield a Workspace for one request and remove it afterwards, on success or failure."""
+    workspace = Workspace.create()
+    log.debug(f"Working in temporary directory: {workspace.path}")
+    try:
+        yield workspace
+    finally:
+        size = workspace.size()
+        workspace.remove()
+        log.debug(f"Removed temporary directory {workspace.path} ({size} bytes).")